@@ -130,8 +130,8 @@ async def create_test_reviews():
                     "description": f"Заказ услуги: {service['title']}",
                     "status": "completed",
                     "agreed_price": service.get("price", 1000),
-                    "created_at": (datetime.now(timezone.utc) - timedelta(days=random.randint(10, 60))).isoformat(),
-                    "completed_at": (datetime.now(timezone.utc) - timedelta(days=random.randint(1, 9))).isoformat()
+                    "created_at": datetime.now(timezone.utc) - timedelta(days=random.randint(10, 60)),
+                    "completed_at": datetime.now(timezone.utc) - timedelta(days=random.randint(1, 9))
                 }
                 await db.orders.insert_one(order)
                 orders_created += 1
@@ -154,7 +154,7 @@ async def create_test_reviews():
                 "comment": review_data["comment"],
                 "is_disputed": False,
                 "dispute_reason": None,
-                "created_at": (datetime.now(timezone.utc) - timedelta(days=random.randint(1, 7))).isoformat()
+                "created_at": datetime.now(timezone.utc) - timedelta(days=random.randint(1, 7))
             }
             
             await db.reviews.insert_one(review)
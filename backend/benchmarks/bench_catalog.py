@@ -0,0 +1,153 @@
+"""
+Задержка листинга каталога: MongoDB против снимка каталога в памяти (NumPy)
+
+    python benchmarks/bench_catalog.py [--count 200000] [--rounds 50] [--keep] [--memory-only]
+
+Нужен запущенный MongoDB (MONGO_URL из .env). Данные пишутся в отдельную
+базу <DB_NAME>_bench_catalog и удаляются после замера, если не указан --keep.
+Путь через базу повторяет GET /services без поиска: count_documents + find_page;
+снимок отвечает тем же через CatalogSnapshot.query. С --memory-only база не
+нужна: услуги генерируются в памяти и замеряется только снимок.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from bench_search import make_service, percentile
+from utils.catalog import CatalogSnapshot
+from utils.indexes import ensure_indexes
+from utils.pagination import find_page
+
+load_dotenv(Path(__file__).resolve().parent.parent / '.env')
+
+MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
+DB_NAME = os.environ.get('DB_NAME', 'handcraft_platform') + "_bench_catalog"
+
+# (название, категория, цена от, цена до, поле сортировки, направление, skip)
+SCENARIOS = [
+    ("новые", None, None, None, "created_at", -1, 0),
+    ("категория", "knitting", None, None, "created_at", -1, 0),
+    ("цена 1000–5000", None, 1000, 5000, "price", 1, 0),
+    ("категория + цена, рейтинг", "pottery", 500, 20000, "master.rating", -1, 0),
+    ("skip=5000", None, None, None, "created_at", -1, 5000),
+]
+
+
+def make_catalog_service(rng: random.Random, now: datetime) -> dict:
+    service = make_service(rng, now)
+    service["views"] = rng.randrange(0, 5000)
+    service["orders_count"] = rng.randrange(0, 50)
+    return service
+
+
+async def seed(db, count: int):
+    existing = await db.services.estimated_document_count()
+    if existing >= count:
+        print(f"Коллекция уже заполнена: {existing}")
+        return
+    rng = random.Random(42)
+    now = datetime.now(timezone.utc)
+    started = time.perf_counter()
+    for offset in range(existing, count, 10000):
+        batch = [make_catalog_service(rng, now) for _ in range(min(10000, count - offset))]
+        await db.services.insert_many(batch, ordered=False)
+        print(f"\r📦 Вставлено {offset + len(batch)}/{count}", end="", flush=True)
+    print(f"\n✅ Данные готовы за {time.perf_counter() - started:.0f} с")
+
+
+def scenario_query(category, min_price, max_price) -> dict:
+    query = {"is_active": True}
+    if category:
+        query["category"] = category
+    if min_price is not None or max_price is not None:
+        query["price"] = {}
+        if min_price is not None:
+            query["price"]["$gte"] = min_price
+        if max_price is not None:
+            query["price"]["$lte"] = max_price
+    return query
+
+
+async def db_page(db, scenario):
+    _, category, min_price, max_price, sort_field, direction, skip = scenario
+    query = scenario_query(category, min_price, max_price)
+    await db.services.count_documents(query)
+    await find_page(db.services, query, sort_field, direction, skip, 20)
+
+
+async def snapshot_page(snapshot, scenario):
+    _, category, min_price, max_price, sort_field, direction, skip = scenario
+    snapshot.query(category, min_price, max_price, sort_field, direction, skip, 20)
+
+
+async def measure(func, target, scenario, rounds: int) -> list:
+    await func(target, scenario)
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        await func(target, scenario)
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+async def main(args):
+    snapshot = CatalogSnapshot(enabled=True)
+    client = None
+    db = None
+    try:
+        started = time.perf_counter()
+        if args.memory_only:
+            rng = random.Random(42)
+            now = datetime.now(timezone.utc)
+            snapshot.load([s for s in (make_catalog_service(rng, now) for _ in range(args.count)) if s["is_active"]])
+        else:
+            client = AsyncIOMotorClient(MONGO_URL, tz_aware=True)
+            db = client[DB_NAME]
+            await seed(db, args.count)
+            print("🔧 Индексы...")
+            await ensure_indexes(db, collections=["services"])
+            started = time.perf_counter()
+            await snapshot.build(db)
+        stats = snapshot.get_stats()
+        print(
+            f"🧊 Снимок: {stats['rows']} услуг за {time.perf_counter() - started:.1f} с, "
+            f"колонки {stats['column_bytes'] / 1024 / 1024:.1f} МБ"
+        )
+
+        print(f"{'сценарий':>28} {'db p50, мс':>11} {'p95':>8} {'снимок p50, мс':>15} {'p95':>8} {'ускорение':>10}")
+        for scenario in SCENARIOS:
+            memory = await measure(snapshot_page, snapshot, scenario, args.rounds)
+            if db is None:
+                print(f"{scenario[0]:>28} {'—':>11} {'—':>8} {statistics.median(memory):>15.2f} {percentile(memory, 0.95):>8.2f} {'—':>10}")
+                continue
+            mongo = await measure(db_page, db, scenario, args.rounds)
+            speedup = statistics.median(mongo) / statistics.median(memory)
+            print(
+                f"{scenario[0]:>28} {statistics.median(mongo):>11.1f} {percentile(mongo, 0.95):>8.1f} "
+                f"{statistics.median(memory):>15.2f} {percentile(memory, 0.95):>8.2f} {speedup:>9.1f}x"
+            )
+    finally:
+        if client is not None:
+            if not args.keep:
+                await client.drop_database(DB_NAME)
+            client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=200_000)
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--keep", action="store_true", help="Keep the generated database for the next run")
+    parser.add_argument("--memory-only", action="store_true", help="Measure the snapshot alone on generated data")
+    asyncio.run(main(parser.parse_args()))
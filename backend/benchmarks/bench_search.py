@@ -0,0 +1,135 @@
+"""
+Задержка поиска по каталогу: $regex по title/description против текстового индекса
+
+    python benchmarks/bench_search.py [--count 1000000] [--rounds 20] [--keep]
+
+Нужен запущенный MongoDB (MONGO_URL из .env). Данные пишутся в отдельную
+базу <DB_NAME>_bench_search и удаляются после замера, если не указан --keep;
+повторный запуск с --keep переиспользует уже заполненную коллекцию.
+Оба пути повторяют запросы GET /services: count_documents + страница из 20.
+"""
+import argparse
+import asyncio
+import os
+import random
+import re
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from utils.indexes import ensure_indexes
+
+load_dotenv(Path(__file__).resolve().parent.parent / '.env')
+
+MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
+DB_NAME = os.environ.get('DB_NAME', 'handcraft_platform') + "_bench_search"
+
+CATEGORIES = ["knitting", "embroidery", "sewing", "felting", "jewelry", "pottery", "woodworking", "painting", "soap_making", "other"]
+ITEMS = ["свитер", "шапка", "шарф", "варежки", "кукла", "серьги", "браслет", "кружка", "ваза", "доска", "картина", "мыло", "сумка", "плед", "игрушка"]
+ADJECTIVES = ["вязаный", "теплый", "яркий", "праздничный", "детский", "уютный", "авторский", "льняной", "керамический", "деревянный"]
+WORDS = ["ручной", "работы", "из", "натуральной", "шерсти", "по", "вашим", "меркам", "подарок", "на", "заказ", "мастер", "цвет", "размер", "любой"]
+QUERIES = ["свитер", "вязаные шапки", "керамическая ваза", "подарок ручной работы", "кукла"]
+
+
+def make_service(rng: random.Random, now: datetime) -> dict:
+    title = f"{rng.choice(ADJECTIVES).capitalize()} {rng.choice(ITEMS)} {rng.choice(WORDS)} {rng.choice(WORDS)}"
+    created_at = now - timedelta(minutes=rng.randrange(0, 3 * 365 * 24 * 60))
+    return {
+        "id": str(uuid.uuid4()),
+        "master_id": str(uuid.uuid4()),
+        "title": title,
+        "description": " ".join(rng.choice(WORDS + ITEMS) for _ in range(30)),
+        "category": rng.choice(CATEGORIES),
+        "price": float(rng.randrange(300, 50000)),
+        "is_active": rng.random() < 0.9,
+        "master": {"rating": round(rng.uniform(3, 5), 2)},
+        "created_at": created_at,
+        "updated_at": created_at,
+    }
+
+
+async def seed(db, count: int):
+    existing = await db.services.estimated_document_count()
+    if existing >= count:
+        print(f"Коллекция уже заполнена: {existing}")
+        return
+    rng = random.Random(42)
+    now = datetime.now(timezone.utc)
+    started = time.perf_counter()
+    for offset in range(existing, count, 10000):
+        batch = [make_service(rng, now) for _ in range(min(10000, count - offset))]
+        await db.services.insert_many(batch, ordered=False)
+        print(f"\r📦 Вставлено {offset + len(batch)}/{count}", end="", flush=True)
+    print(f"\n✅ Данные готовы за {time.perf_counter() - started:.0f} с")
+
+
+async def regex_page(db, search: str):
+    pattern = re.escape(search)
+    query = {"is_active": True, "$or": [
+        {"title": {"$regex": pattern, "$options": "i"}},
+        {"description": {"$regex": pattern, "$options": "i"}}
+    ]}
+    await db.services.count_documents(query)
+    await db.services.find(query, {"_id": 0}).sort([("created_at", -1), ("id", -1)]).limit(20).to_list(20)
+
+
+async def text_page(db, search: str):
+    query = {"is_active": True, "$text": {"$search": search}}
+    await db.services.count_documents(query)
+    await db.services.find(
+        query, {"_id": 0, "score": {"$meta": "textScore"}}
+    ).sort([("score", {"$meta": "textScore"}), ("id", -1)]).limit(20).to_list(20)
+
+
+async def measure(func, db, search: str, rounds: int) -> list:
+    await func(db, search)
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        await func(db, search)
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def main(args):
+    client = AsyncIOMotorClient(MONGO_URL, tz_aware=True)
+    db = client[DB_NAME]
+    try:
+        await seed(db, args.count)
+        print("🔧 Индексы...")
+        await ensure_indexes(db, collections=["services"])
+
+        print(f"{'запрос':>24} {'regex p50, мс':>14} {'p95':>8} {'text p50, мс':>13} {'p95':>8} {'ускорение':>10}")
+        for search in QUERIES:
+            regex = await measure(regex_page, db, search, args.rounds)
+            text = await measure(text_page, db, search, args.rounds)
+            speedup = statistics.median(regex) / statistics.median(text)
+            print(
+                f"{search:>24} {statistics.median(regex):>14.1f} {percentile(regex, 0.95):>8.1f} "
+                f"{statistics.median(text):>13.1f} {percentile(text, 0.95):>8.1f} {speedup:>9.1f}x"
+            )
+    finally:
+        if not args.keep:
+            await client.drop_database(DB_NAME)
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=1_000_000)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--keep", action="store_true", help="Keep the generated database for the next run")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,105 @@
+"""
+Сравнение сериализации ответа: стандартный путь FastAPI против fast_response
+
+    python benchmarks/bench_serialization.py [--rounds 2000]
+
+Стандартный путь: валидация по response_model + jsonable_encoder + json.dumps.
+Быстрый путь: utils.responses.fast_response (orjson за один проход).
+"""
+import argparse
+import asyncio
+import sys
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+from typing import List
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from models import Service
+from utils.responses import fast_response, shape
+
+
+def make_services(count: int) -> list:
+    now = datetime.now(timezone.utc)
+    master = {"id": str(uuid.uuid4()), "name": "Мастер Анна", "avatar": None, "rating": 4.87, "total_reviews": 31, "updated_at": now}
+    return [
+        {
+            "id": str(uuid.uuid4()),
+            "master_id": master["id"],
+            "title": f"Вязаный свитер ручной работы №{i}",
+            "description": "Теплый свитер из мериносовой шерсти, вяжется по вашим меркам. " * 3,
+            "category": "knitting",
+            "price": 4500.0 + i,
+            "currency": "RUB",
+            "duration_days": 14,
+            "images": [f"/api/upload/services/{uuid.uuid4()}.jpg" for _ in range(3)],
+            "is_active": True,
+            "views": 120 + i,
+            "orders_count": 4,
+            "rating": 4.8,
+            "total_reviews": 12,
+            "rating_histogram": {"4": 2, "5": 10},
+            "master": master,
+            "created_at": now - timedelta(days=i),
+            "updated_at": now - timedelta(days=i),
+        }
+        for i in range(count)
+    ]
+
+
+DICT_FIELD = create_response_field(name="response", type_=dict)
+MODEL_FIELD = create_response_field(name="response", type_=List[Service])
+
+
+def page(services: list) -> dict:
+    return {"total": 1000, "skip": 0, "limit": len(services), "next_cursor": "W3siJGRhdGUiOiIyMDI2In0sImlkIl0", "services": services}
+
+
+async def standard_dict(services):
+    # response_model=dict with raw documents (list routes)
+    content = await serialize_response(field=DICT_FIELD, response_content=page(services))
+    return JSONResponse(content).body
+
+
+async def standard_models(services):
+    # Documents rebuilt as models, then validated against List[Service]
+    content = await serialize_response(field=MODEL_FIELD, response_content=[Service(**doc) for doc in services])
+    return JSONResponse(content).body
+
+
+async def fast_dict(services):
+    return fast_response(page(services)).body
+
+
+async def fast_models(services):
+    return fast_response([shape(Service, doc) for doc in services]).body
+
+
+async def measure(func, services, rounds: int) -> float:
+    await func(services)
+    started = time.perf_counter()
+    for _ in range(rounds):
+        await func(services)
+    return (time.perf_counter() - started) / rounds * 1e6
+
+
+async def main(rounds: int):
+    print(f"{'страница':>9} {'ответ':>8} {'стандарт, мкс':>14} {'fast, мкс':>10} {'ускорение':>10}")
+    for count in (20, 100):
+        services = make_services(count)
+        for label, standard, fast in (("dict", standard_dict, fast_dict), ("модели", standard_models, fast_models)):
+            before = await measure(standard, services, rounds)
+            after = await measure(fast, services, rounds)
+            print(f"{count:>9} {label:>8} {before:>14.1f} {after:>10.1f} {before / after:>9.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=2000)
+    asyncio.run(main(parser.parse_args().rounds))
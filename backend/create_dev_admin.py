@@ -32,8 +32,8 @@ async def create_developer_admin():
         "rating": 5.0,
         "total_reviews": 0,
         "completed_orders": 0,
-        "created_at": datetime.now(timezone.utc).isoformat(),
-        "updated_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc),
+        "updated_at": datetime.now(timezone.utc)
     }
     
     await db.users.insert_one(admin)
@@ -1,16 +1,24 @@
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from fastapi import Depends
 import os
 from dotenv import load_dotenv
 from pathlib import Path
 
+from utils.loader import DocumentLoader
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# tz_aware: datetimes are stored as native BSON dates and read back as UTC-aware
+client = AsyncIOMotorClient(mongo_url, tz_aware=True)
 db = client[os.environ.get('DB_NAME', 'handcraft_platform')]
 
 # Dependency to get database
 def get_db() -> AsyncIOMotorDatabase:
     return db
+
+# Dependency to get a request-scoped batching loader
+def get_loader(db: AsyncIOMotorDatabase = Depends(get_db)) -> DocumentLoader:
+    return DocumentLoader(db)
@@ -14,7 +14,7 @@ async def fix_admin_role():
         {"$set": {
             "role": "admin",
             "name": "Developer Admin",
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            "updated_at": datetime.now(timezone.utc)
         }}
     )
     
@@ -43,8 +43,8 @@ async def init_database():
             "rating": 5.0,
             "total_reviews": 0,
             "completed_orders": 0,
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc)
         }
         await db.users.insert_one(admin)
         print(f"✅ Админ создан: {admin_email} / admin123")
@@ -99,8 +99,8 @@ async def init_database():
                 "rating": 4.5 + (len(created_masters) * 0.2),
                 "total_reviews": 5 + len(created_masters),
                 "completed_orders": 10 + (len(created_masters) * 5),
-                "created_at": datetime.now(timezone.utc).isoformat(),
-                "updated_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc),
+                "updated_at": datetime.now(timezone.utc)
             }
             await db.users.insert_one(master)
             created_masters.append(master)
@@ -144,8 +144,8 @@ async def init_database():
                 "rating": 0.0,
                 "total_reviews": 0,
                 "completed_orders": 0,
-                "created_at": datetime.now(timezone.utc).isoformat(),
-                "updated_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc),
+                "updated_at": datetime.now(timezone.utc)
             }
             await db.users.insert_one(customer)
             created_customers.append(customer)
@@ -231,8 +231,8 @@ async def init_database():
                 "is_active": True,
                 "views": 0,
                 "orders_count": 0,
-                "created_at": datetime.now(timezone.utc).isoformat(),
-                "updated_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc),
+                "updated_at": datetime.now(timezone.utc)
             }
             await db.services.insert_one(service)
             created_services.append(service)
@@ -0,0 +1,209 @@
+"""
+Служебные команды для обслуживания базы данных
+
+    python manage.py indexes drift           # отчет о расхождении индексов
+    python manage.py indexes apply           # создать недостающие индексы
+    python manage.py indexes apply --drop-extra
+    python manage.py migrate-datetimes       # ISO-строки -> BSON даты (с возобновлением)
+    python manage.py backfill-chats          # время последнего сообщения в заказах*
+    python manage.py reconcile-ratings [--fix]
+    python manage.py sync-master-summaries   # сводка мастера в документах услуг
+    python manage.py rebuild-counters        # счетчики непрочитанного из исходных коллекций*
+    python manage.py revoke-tokens --email user@example.com   # после смены роли или пароля
+    python manage.py blobs rebuild           # пересчитать ссылки на загруженные файлы
+    python manage.py blobs collect --grace 0 # удалить файлы без ссылок
+
+* Один раз выполняется сервером при старте (utils/migrations.py, DATA_MIGRATIONS);
+  вручную нужно только для повторного пересчета.
+"""
+import argparse
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+from motor.motor_asyncio import AsyncIOMotorClient
+import os
+from dotenv import load_dotenv
+
+from utils.indexes import index_drift, ensure_indexes
+from utils.migrations import migrate_datetimes, backfill_last_message_at
+from utils.ratings import reconcile_ratings
+from utils.masters import sync_master_summaries
+from utils.counters import rebuild_counters
+from utils.auth import revocations
+from utils.blobs import rebuild_blob_refs, collect_orphan_blobs, BLOB_GC_GRACE
+
+load_dotenv(Path(__file__).parent / '.env')
+
+MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
+DB_NAME = os.environ.get('DB_NAME', 'handcraft_platform')
+
+
+def print_drift(report: dict):
+    if not report:
+        print("✅ Индексы соответствуют реестру")
+        return
+    for collection, drift in report.items():
+        print(f"📦 {collection}")
+        for name in drift["missing"]:
+            print(f"   ➕ отсутствует: {name}")
+        for item in drift["changed"]:
+            print(f"   ✏️  изменен: {item['name']}")
+            print(f"      ожидается: {json.dumps(item['declared'], default=str)}")
+            print(f"      в базе:    {json.dumps(item['actual'], default=str)}")
+        for name in drift["extra"]:
+            print(f"   ➖ не объявлен: {name}")
+
+
+async def cmd_indexes(db, args):
+    collections = args.collection or None
+    if args.action == "drift":
+        report = await index_drift(db, collections)
+        print_drift(report)
+        # Non-zero exit code lets CI / deploy scripts detect drift
+        return 1 if report else 0
+
+    report = await ensure_indexes(db, drop_extra=args.drop_extra, collections=collections)
+    print_drift(report)
+    remaining = await index_drift(db, collections)
+    if not args.drop_extra:
+        remaining = {name: drift for name, drift in remaining.items() if drift["missing"] or drift["changed"]}
+    if remaining:
+        print("⚠️  После применения остались расхождения:")
+        print_drift(remaining)
+        return 1
+    print("✅ Индексы применены")
+    return 0
+
+
+async def cmd_migrate_datetimes(db, args):
+    def progress(collection, converted, failed):
+        print(f"   {collection}: преобразовано {converted}, ошибок {failed}")
+
+    summary = await migrate_datetimes(
+        db,
+        batch_size=args.batch_size,
+        collections=args.collection or None,
+        restart=args.restart,
+        progress=progress
+    )
+    for collection, state in summary.items():
+        print(f"✅ {collection}: преобразовано {state['converted']}, ошибок {state['failed']}")
+    return 1 if any(state["failed"] for state in summary.values()) else 0
+
+
+async def cmd_backfill_chats(db, args):
+    modified = await backfill_last_message_at(db, batch_size=args.batch_size)
+    print(f"✅ Обновлено заказов: {modified}")
+    return 0
+
+
+async def cmd_reconcile_ratings(db, args):
+    report = await reconcile_ratings(db, fix=args.fix)
+    for collection, drift in report.items():
+        if not drift:
+            print(f"✅ {collection}: рейтинги совпадают с отзывами")
+            continue
+        print(f"⚠️  {collection}: расхождений {len(drift)}" + (" (исправлено)" if args.fix else ""))
+        for item in drift[:args.show]:
+            print(f"   {item['id']}: в базе {json.dumps(item['actual'])}, ожидается {json.dumps(item['expected'])}")
+    return 0 if args.fix or not any(report.values()) else 1
+
+
+async def cmd_sync_master_summaries(db, args):
+    modified = await sync_master_summaries(db)
+    print(f"✅ Обновлено услуг: {modified}")
+    return 0
+
+
+async def cmd_rebuild_counters(db, args):
+    written = await rebuild_counters(db, batch_size=args.batch_size)
+    print(f"✅ Пересчитано счетчиков: {written}")
+    return 0
+
+
+async def cmd_revoke_tokens(db, args):
+    query = {"id": args.user} if args.user else {"email": args.email}
+    user = await db.users.find_one(query, {"_id": 0, "id": 1, "email": 1})
+    if not user:
+        print("❌ Пользователь не найден")
+        return 1
+    await revocations.revoke_user(db, user["id"])
+    print(f"✅ Токены пользователя {user['email']} отозваны")
+    return 0
+
+
+async def cmd_blobs(db, args):
+    root = Path(args.root)
+    if args.action == "rebuild":
+        report = await rebuild_blob_refs(db, root)
+        print(f"✅ Файлов со ссылками: {report['referenced']}, без ссылок: {report['orphaned']}")
+        if report["missing_files"]:
+            print(f"⚠️  Ссылок на отсутствующие файлы: {report['missing_files']}")
+        return 0
+    removed = await collect_orphan_blobs(db, root, grace=args.grace)
+    print(f"✅ Удалено файлов: {removed}")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Handcraft Platform maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    indexes = subparsers.add_parser("indexes", help="Index registry: drift report and apply")
+    indexes.add_argument("action", choices=["drift", "apply"])
+    indexes.add_argument("--collection", action="append", help="Limit to a collection (repeatable)")
+    indexes.add_argument("--drop-extra", action="store_true", help="Drop indexes that are not declared")
+    indexes.set_defaults(handler=cmd_indexes)
+
+    datetimes = subparsers.add_parser("migrate-datetimes", help="Convert ISO string dates to BSON dates")
+    datetimes.add_argument("--batch-size", type=int, default=1000)
+    datetimes.add_argument("--collection", action="append", help="Limit to a collection (repeatable)")
+    datetimes.add_argument("--restart", action="store_true", help="Ignore the saved checkpoint")
+    datetimes.set_defaults(handler=cmd_migrate_datetimes)
+
+    chats = subparsers.add_parser("backfill-chats", help="Stamp orders with the time of their latest message")
+    chats.add_argument("--batch-size", type=int, default=1000)
+    chats.set_defaults(handler=cmd_backfill_chats)
+
+    ratings = subparsers.add_parser("reconcile-ratings", help="Recompute rating state from reviews and report drift")
+    ratings.add_argument("--fix", action="store_true", help="Reset drifted documents")
+    ratings.add_argument("--show", type=int, default=20, help="How many drifted documents to print")
+    ratings.set_defaults(handler=cmd_reconcile_ratings)
+
+    summaries = subparsers.add_parser("sync-master-summaries", help="Rewrite the master summary embedded in services")
+    summaries.set_defaults(handler=cmd_sync_master_summaries)
+
+    counters = subparsers.add_parser("rebuild-counters", help="Recompute unread counters from notifications and messages")
+    counters.add_argument("--batch-size", type=int, default=500)
+    counters.set_defaults(handler=cmd_rebuild_counters)
+
+    revoke = subparsers.add_parser("revoke-tokens", help="Invalidate all tokens issued to a user so far")
+    target = revoke.add_mutually_exclusive_group(required=True)
+    target.add_argument("--user", help="User id")
+    target.add_argument("--email", help="User email")
+    revoke.set_defaults(handler=cmd_revoke_tokens)
+
+    blobs = subparsers.add_parser("blobs", help="Uploaded file refcounts: rebuild from users/services, collect orphans")
+    blobs.add_argument("action", choices=["rebuild", "collect"])
+    blobs.add_argument("--root", default=str(Path(__file__).parent / "uploads"), help="Upload directory")
+    blobs.add_argument("--grace", type=float, default=BLOB_GC_GRACE, help="Seconds an orphan is kept")
+    blobs.set_defaults(handler=cmd_blobs)
+
+    return parser
+
+
+async def main(argv=None):
+    args = build_parser().parse_args(argv)
+    client = AsyncIOMotorClient(MONGO_URL, tz_aware=True)
+    try:
+        return await args.handler(client[DB_NAME], args)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
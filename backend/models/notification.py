@@ -29,4 +29,5 @@ class Notification(BaseModel):
     content: str
     link: Optional[str] = None
     is_read: bool = False
+    count: int = 1
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
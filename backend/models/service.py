@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, ConfigDict
-from typing import Optional, List
+from typing import Optional, List, Dict
 from datetime import datetime, timezone
 from enum import Enum
 
@@ -42,5 +42,8 @@ class Service(ServiceCreate):
     is_active: bool = True
     views: int = 0
     orders_count: int = 0
+    rating: float = 0.0
+    total_reviews: int = 0
+    rating_histogram: Dict[str, int] = {}
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, Field, ConfigDict
-from typing import Optional, List
+from typing import Optional, List, Dict
 from datetime import datetime, timezone
 from enum import Enum
 
@@ -33,6 +33,7 @@ class User(UserBase):
     avatar: Optional[str] = None
     rating: float = 0.0
     total_reviews: int = 0
+    rating_histogram: Dict[str, int] = {}
     completed_orders: int = 0
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
@@ -47,5 +48,6 @@ class UserPublic(BaseModel):
     specializations: Optional[List[str]] = []
     rating: float = 0.0
     total_reviews: int = 0
+    rating_histogram: Dict[str, int] = {}
     completed_orders: int = 0
     created_at: datetime
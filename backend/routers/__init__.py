@@ -5,6 +5,7 @@ from .orders import router as orders_router
 from .reviews import router as reviews_router
 from .messages import router as messages_router
 from .notifications import router as notifications_router
+from .realtime import router as realtime_router
 
 __all__ = [
     "auth_router",
@@ -13,5 +14,6 @@ __all__ = [
     "orders_router",
     "reviews_router",
     "messages_router",
-    "notifications_router"
+    "notifications_router",
+    "realtime_router"
 ]
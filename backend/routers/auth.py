@@ -1,11 +1,14 @@
 from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi.security import HTTPAuthorizationCredentials
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from pydantic import BaseModel
 import uuid
 from datetime import datetime, timezone
 
 from models import User, UserCreate, UserRole
-from utils import create_access_token, hash_password, verify_password
+from utils import create_access_token, password_hasher, revocations, token_cache
+from utils.auth import security
+from utils.suggest import suggest_index
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
@@ -33,15 +36,17 @@ async def register(user_data: UserCreate, db: AsyncIOMotorDatabase = Depends(get
     # Create user
     user_dict = user_data.model_dump(exclude={"password"})
     user_dict["id"] = str(uuid.uuid4())
-    user_dict["password_hash"] = hash_password(user_data.password)
+    user_dict["password_hash"] = await password_hasher.hash(user_data.password)
     user_dict["rating"] = 0.0
     user_dict["total_reviews"] = 0
     user_dict["completed_orders"] = 0
     user_dict["avatar"] = None
-    user_dict["created_at"] = datetime.now(timezone.utc).isoformat()
-    user_dict["updated_at"] = datetime.now(timezone.utc).isoformat()
+    user_dict["created_at"] = datetime.now(timezone.utc)
+    user_dict["updated_at"] = datetime.now(timezone.utc)
     
     await db.users.insert_one(user_dict)
+    if user_dict["role"] == UserRole.MASTER:
+        suggest_index.add_master(user_dict)
     
     # Create token
     token = create_access_token({
@@ -50,10 +55,6 @@ async def register(user_data: UserCreate, db: AsyncIOMotorDatabase = Depends(get
         "role": user_dict["role"]
     })
     
-    # Convert datetime strings back for response
-    user_dict["created_at"] = datetime.fromisoformat(user_dict["created_at"])
-    user_dict["updated_at"] = datetime.fromisoformat(user_dict["updated_at"])
-    
     user = User(**{k: v for k, v in user_dict.items() if k != "password_hash"})
     
     return AuthResponse(token=token, user=user)
@@ -68,13 +69,21 @@ async def login(login_data: LoginRequest, db: AsyncIOMotorDatabase = Depends(get
             detail="Invalid credentials"
         )
     
-    # Verify password
-    if not verify_password(login_data.password, user_doc["password_hash"]):
+    # Verify password (off the event loop)
+    valid, new_hash = await password_hasher.verify_and_update(login_data.password, user_doc["password_hash"])
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid credentials"
         )
     
+    # Stored hash uses an old bcrypt cost: replace it while we have the password
+    if new_hash:
+        await db.users.update_one(
+            {"id": user_doc["id"], "password_hash": user_doc["password_hash"]},
+            {"$set": {"password_hash": new_hash}}
+        )
+    
     # Create token
     token = create_access_token({
         "sub": user_doc["id"],
@@ -82,12 +91,17 @@ async def login(login_data: LoginRequest, db: AsyncIOMotorDatabase = Depends(get
         "role": user_doc["role"]
     })
     
-    # Convert datetime strings
-    if isinstance(user_doc["created_at"], str):
-        user_doc["created_at"] = datetime.fromisoformat(user_doc["created_at"])
-    if isinstance(user_doc["updated_at"], str):
-        user_doc["updated_at"] = datetime.fromisoformat(user_doc["updated_at"])
-    
     user = User(**{k: v for k, v in user_doc.items() if k not in ["_id", "password_hash"]})
     
     return AuthResponse(token=token, user=user)
+
+@router.post("/logout", response_model=dict)
+async def logout(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    # Deny this token until it expires (other sessions stay logged in)
+    claims = token_cache.verify(credentials.credentials)
+    await revocations.revoke_token(db, credentials.credentials, claims)
+    
+    return {"message": "Logged out"}
@@ -1,28 +1,32 @@
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, status, Depends, Query
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from typing import Optional
 import uuid
 from datetime import datetime, timezone
 
 from models import Message, MessageCreate, NotificationCreate, NotificationType
 from utils import get_current_user
-from database import get_db
+from utils.loader import DocumentLoader
+from utils.pagination import find_page
+from utils.totals import count_total, TotalMode
+from utils.responses import fast_response
+from utils.notifications import notification_service
+from utils.counters import get_counters, add_message, read_messages
+from utils.realtime import event_bus
+from database import get_db, get_loader
 
 router = APIRouter(prefix="/messages", tags=["messages"])
 
-async def create_notification(db: AsyncIOMotorDatabase, notification: NotificationCreate):
-    notif_dict = notification.model_dump()
-    notif_dict["id"] = str(uuid.uuid4())
-    notif_dict["is_read"] = False
-    notif_dict["created_at"] = datetime.now(timezone.utc).isoformat()
-    await db.notifications.insert_one(notif_dict)
-
 @router.get("/order/{order_id}", response_model=dict)
 async def get_order_messages(
     order_id: str,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
+    total_mode: TotalMode = Query("exact", alias="total"),
     current_user: dict = Depends(get_current_user),
-    db: AsyncIOMotorDatabase = Depends(get_db)
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    loader: DocumentLoader = Depends(get_loader)
 ):
     # Check order access
     order = await db.orders.find_one({"id": order_id})
@@ -33,20 +37,20 @@ async def get_order_messages(
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
     
     query = {"order_id": order_id}
-    total = await db.messages.count_documents(query)
-    messages_cursor = db.messages.find(query, {"_id": 0}).sort("created_at", 1).skip(skip).limit(limit)
-    messages = await messages_cursor.to_list(length=limit)
+    total = await count_total(db.messages, query, total_mode)
+    messages, cursor_next = await find_page(db.messages, query, "created_at", 1, skip, limit, cursor, peek=total_mode == "none")
     
-    # Add sender name
+    # Add sender name (a chat has two participants, so this is one small query)
+    senders = await loader.load_many("users", [msg["sender_id"] for msg in messages])
     for msg in messages:
-        sender = await db.users.find_one({"id": msg["sender_id"]}, {"_id": 0, "name": 1})
+        sender = senders.get(msg["sender_id"])
         if sender:
             msg["sender_name"] = sender["name"]
-        
-        if isinstance(msg.get("created_at"), str):
-            msg["created_at"] = datetime.fromisoformat(msg["created_at"])
     
-    return {"total": total, "messages": messages}
+    result = {"total": total, "next_cursor": cursor_next, "messages": messages}
+    if total_mode == "none":
+        result["has_more"] = cursor_next is not None
+    return fast_response(result)
 
 @router.post("", response_model=Message, status_code=status.HTTP_201_CREATED)
 async def send_message(
@@ -71,21 +75,26 @@ async def send_message(
     message_dict["sender_id"] = current_user["id"]
     message_dict["receiver_id"] = receiver_id
     message_dict["is_read"] = False
-    message_dict["created_at"] = datetime.now(timezone.utc).isoformat()
+    message_dict["created_at"] = datetime.now(timezone.utc)
     
     await db.messages.insert_one(message_dict)
-    
-    # Create notification for receiver
-    await create_notification(db, NotificationCreate(
+    # Chats are listed by this; $max keeps it from moving back on a race
+    await db.orders.update_one({"id": order["id"]}, {"$max": {"last_message_at": message_dict["created_at"]}})
+    await add_message(db, receiver_id, message_data.order_id)
+    message = Message(**message_dict)
+    # Sender gets it too so their other open tabs stay in sync
+    await event_bus.publish([receiver_id, current_user["id"]], "message.new", message.model_dump())
+    
+    # Create notification for receiver; unread ones for the same chat are merged
+    await notification_service.notify(db, NotificationCreate(
         user_id=receiver_id,
         type=NotificationType.NEW_MESSAGE,
         title="Новое сообщение",
         content=f"Новое сообщение в заказе",
         link=f"/chat/{message_data.order_id}"
-    ))
+    ), group_key=f"chat:{message_data.order_id}")
     
-    message_dict["created_at"] = datetime.fromisoformat(message_dict["created_at"])
-    return Message(**message_dict)
+    return message
 
 @router.patch("/order/{order_id}/read", response_model=dict)
 async def mark_messages_as_read(
@@ -106,62 +115,85 @@ async def mark_messages_as_read(
         {"order_id": order_id, "receiver_id": current_user["id"], "is_read": False},
         {"$set": {"is_read": True}}
     )
+    await read_messages(db, current_user["id"], order_id, result.modified_count)
+    if result.modified_count:
+        # Read receipt for the other participant
+        other_id = order["master_id"] if current_user["id"] == order["customer_id"] else order["customer_id"]
+        await event_bus.publish([other_id, current_user["id"]], "message.read", {
+            "order_id": order_id,
+            "reader_id": current_user["id"],
+            "count": result.modified_count
+        })
     
     return {"marked_as_read": result.modified_count}
 
 @router.get("/chats", response_model=dict)
 async def get_chats(
+    skip: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=100),
+    total_mode: TotalMode = Query("exact", alias="total"),
     current_user: dict = Depends(get_current_user),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
-    # Get all orders where user is involved
-    orders = await db.orders.find(
-        {"$or": [{"customer_id": current_user["id"]}, {"master_id": current_user["id"]}]},
-        {"_id": 0}
-    ).to_list(1000)
-    
-    chats = []
-    for order in orders:
-        # Get last message
-        last_message = await db.messages.find_one(
-            {"order_id": order["id"]},
-            {"_id": 0},
-            sort=[("created_at", -1)]
-        )
-        
-        # Get unread count
-        unread_count = await db.messages.count_documents({
-            "order_id": order["id"],
-            "receiver_id": current_user["id"],
-            "is_read": False
-        })
-        
-        # Get service info
-        service = await db.services.find_one({"id": order["service_id"]}, {"_id": 0, "title": 1})
-        
-        # Get other user info
-        other_user_id = order["master_id"] if current_user["id"] == order["customer_id"] else order["customer_id"]
-        other_user = await db.users.find_one({"id": other_user_id}, {"_id": 0, "id": 1, "name": 1, "avatar": 1})
-        
-        chat_data = {
-            "order_id": order["id"],
-            "order_title": service["title"] if service else "Unknown",
-            "other_user": other_user,
-            "unread_count": unread_count
-        }
-        
-        if last_message:
-            if isinstance(last_message.get("created_at"), str):
-                last_message["created_at"] = datetime.fromisoformat(last_message["created_at"])
-            chat_data["last_message"] = {
-                "content": last_message["content"],
-                "created_at": last_message["created_at"],
-                "is_read": last_message["is_read"]
+    user_id = current_user["id"]
+    fetch = limit + 1 if total_mode == "none" else limit
+    match = {"$or": [{"customer_id": user_id}, {"master_id": user_id}]}
+    
+    # Orders carry last_message_at, so the page is cut on the index ($or is
+    # answered by both branches) and only its chats are joined
+    pipeline = [
+        {"$match": match},
+        # Chats without messages have no last_message_at and sort last
+        {"$sort": {"last_message_at": -1, "id": -1}},
+        {"$skip": skip},
+        {"$limit": fetch},
+        {"$addFields": {
+            "other_user_id": {"$cond": [{"$eq": ["$customer_id", user_id]}, "$master_id", "$customer_id"]}
+        }},
+        {"$lookup": {"from": "services", "localField": "service_id", "foreignField": "id", "as": "service"}},
+        {"$lookup": {"from": "users", "localField": "other_user_id", "foreignField": "id", "as": "other_user"}},
+        {"$addFields": {"other_user": {"$arrayElemAt": ["$other_user", 0]}}},
+        {"$project": {
+            "_id": 0,
+            "order_id": "$id",
+            "order_title": {"$ifNull": [{"$arrayElemAt": ["$service.title", 0]}, "Unknown"]},
+            "other_user": {
+                "$cond": [
+                    {"$ifNull": ["$other_user", False]},
+                    {"id": "$other_user.id", "name": "$other_user.name", "avatar": "$other_user.avatar"},
+                    None
+                ]
             }
-        
-        chats.append(chat_data)
-    
-    # Sort by last message time
-    chats.sort(key=lambda x: x.get("last_message", {}).get("created_at", datetime.min), reverse=True)
-    
-    return {"chats": chats}
+        }}
+    ]
+    
+    total = await count_total(db.orders, match, total_mode)
+    chats = await db.orders.aggregate(pipeline).to_list(length=fetch)
+    has_more = len(chats) > limit
+    chats = chats[:limit]
+    
+    # Latest message per chat in one query; the reversed scan of the
+    # (order_id, created_at) index puts each chat's newest message first
+    last_messages = {}
+    async for row in db.messages.aggregate([
+        {"$match": {"order_id": {"$in": [chat["order_id"] for chat in chats]}}},
+        {"$sort": {"order_id": -1, "created_at": -1}},
+        {"$group": {
+            "_id": "$order_id",
+            "content": {"$first": "$content"},
+            "created_at": {"$first": "$created_at"},
+            "is_read": {"$first": "$is_read"}
+        }}
+    ]):
+        last_messages[row.pop("_id")] = row
+    
+    # Unread counts come from the user's counter document
+    unread = (await get_counters(db, user_id))["chats_unread"]
+    for chat in chats:
+        chat["last_message"] = last_messages.get(chat["order_id"])
+        chat["unread_count"] = unread.get(chat["order_id"], 0)
+    
+    result = {"total": total, "skip": skip, "limit": limit, "chats": chats}
+    if total_mode == "none":
+        result["has_more"] = has_more
+    return fast_response(result)
@@ -1,8 +1,11 @@
 from fastapi import APIRouter, HTTPException, status, Depends
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from datetime import datetime
+from typing import Optional
 
 from utils import get_current_user
+from utils.pagination import find_page
+from utils.responses import fast_response
+from utils.counters import get_counters, read_notifications
 from database import get_db
 
 router = APIRouter(prefix="/notifications", tags=["notifications"])
@@ -12,6 +15,7 @@ async def get_notifications(
     unread_only: bool = False,
     skip: int = 0,
     limit: int = 50,
+    cursor: Optional[str] = None,
     current_user: dict = Depends(get_current_user),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
@@ -19,21 +23,31 @@ async def get_notifications(
     if unread_only:
         query["is_read"] = False
     
-    total = await db.notifications.count_documents({"user_id": current_user["id"]})
-    unread_count = await db.notifications.count_documents({"user_id": current_user["id"], "is_read": False})
+    counters = await get_counters(db, current_user["id"])
     
-    notifications_cursor = db.notifications.find(query, {"_id": 0}).sort("created_at", -1).skip(skip).limit(limit)
-    notifications = await notifications_cursor.to_list(length=limit)
+    notifications, cursor_next = await find_page(
+        db.notifications, query, "created_at", -1, skip, limit, cursor, projection={"_id": 0, "batches": 0}
+    )
     
-    # Convert datetime
-    for notif in notifications:
-        if isinstance(notif.get("created_at"), str):
-            notif["created_at"] = datetime.fromisoformat(notif["created_at"])
+    return fast_response({
+        "total": counters["notifications_total"],
+        "unread_count": counters["notifications_unread"],
+        "next_cursor": cursor_next,
+        "notifications": notifications
+    })
+
+@router.get("/unread-count", response_model=dict)
+async def get_unread_count(
+    current_user: dict = Depends(get_current_user),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    # Single point read of the materialized counters, cheap enough to poll
+    counters = await get_counters(db, current_user["id"])
     
     return {
-        "total": total,
-        "unread_count": unread_count,
-        "notifications": notifications
+        "notifications": counters["notifications_unread"],
+        "messages": counters["messages_unread"],
+        "chats": counters["chats_unread"]
     }
 
 @router.patch("/{notification_id}/read", response_model=dict)
@@ -49,7 +63,8 @@ async def mark_notification_as_read(
     if notif["user_id"] != current_user["id"]:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
     
-    await db.notifications.update_one({"id": notification_id}, {"$set": {"is_read": True}})
+    result = await db.notifications.update_one({"id": notification_id, "is_read": False}, {"$set": {"is_read": True}})
+    await read_notifications(db, current_user["id"], result.modified_count)
     
     return {"id": notification_id, "is_read": True}
 
@@ -62,5 +77,6 @@ async def mark_all_as_read(
         {"user_id": current_user["id"], "is_read": False},
         {"$set": {"is_read": True}}
     )
+    await read_notifications(db, current_user["id"], result.modified_count)
     
     return {"marked_as_read": result.modified_count}
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, status, Depends, Query
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from typing import Optional
 import uuid
@@ -6,16 +6,39 @@ from datetime import datetime, timezone
 
 from models import Order, OrderCreate, OrderUpdateStatus, OrderStatus, NotificationCreate, NotificationType
 from utils import get_current_user
-from database import get_db
+from utils.loader import DocumentLoader, pick
+from utils.pagination import find_page
+from utils.totals import count_total, TotalMode
+from utils.responses import fast_response, shape
+from utils.jobs import job_queue
+from utils.cache import response_cache
+from utils.notifications import notification_service, build_notification
+from database import get_db, get_loader
 
 router = APIRouter(prefix="/orders", tags=["orders"])
 
-async def create_notification(db: AsyncIOMotorDatabase, notification: NotificationCreate):
-    notif_dict = notification.model_dump()
-    notif_dict["id"] = str(uuid.uuid4())
-    notif_dict["is_read"] = False
-    notif_dict["created_at"] = datetime.now(timezone.utc).isoformat()
-    await db.notifications.insert_one(notif_dict)
+@job_queue.handler("order_created")
+async def handle_order_created(db: AsyncIOMotorDatabase, payload: dict):
+    # Increment service orders count
+    await job_queue.run_once(
+        db, f"order:{payload['order_id']}:orders_count",
+        lambda: db.services.update_one({"id": payload["service_id"]}, {"$inc": {"orders_count": 1}})
+    )
+    await notification_service.write(db, [payload["notification"]])
+
+@job_queue.handler("order_status_changed")
+async def handle_order_status_changed(db: AsyncIOMotorDatabase, payload: dict):
+    if payload["status"] == OrderStatus.COMPLETED.value:
+        # Increment master's completed orders
+        await job_queue.run_once(
+            db, f"order:{payload['order_id']}:completed_orders",
+            lambda: db.users.update_one({"id": payload["master_id"]}, {"$inc": {"completed_orders": 1}})
+        )
+        # Service detail pages embed the master document
+        response_cache.invalidate(f"user:{payload['master_id']}")
+    if payload.get("notification"):
+        # Written directly: the id fixed at enqueue time makes retries safe
+        await notification_service.write(db, [payload["notification"]])
 
 @router.post("", response_model=Order, status_code=status.HTTP_201_CREATED)
 async def create_order(
@@ -39,29 +62,26 @@ async def create_order(
     order_dict["status"] = OrderStatus.PENDING.value
     order_dict["agreed_price"] = None
     order_dict["deadline"] = None
-    order_dict["created_at"] = datetime.now(timezone.utc).isoformat()
-    order_dict["updated_at"] = datetime.now(timezone.utc).isoformat()
+    order_dict["created_at"] = datetime.now(timezone.utc)
+    order_dict["updated_at"] = datetime.now(timezone.utc)
     order_dict["completed_at"] = None
     
     await db.orders.insert_one(order_dict)
     
-    # Increment service orders count
-    await db.services.update_one({"id": order_data.service_id}, {"$inc": {"orders_count": 1}})
-    
-    # Create notification for master
-    await create_notification(db, NotificationCreate(
-        user_id=service["master_id"],
-        type=NotificationType.NEW_ORDER,
-        title="Новый заказ",
-        content=f"У вас новый заказ на услугу '{service['title']}'",
-        link=f"/orders/{order_dict['id']}"
-    ))
-    
-    # Convert datetime
-    order_dict["created_at"] = datetime.fromisoformat(order_dict["created_at"])
-    order_dict["updated_at"] = datetime.fromisoformat(order_dict["updated_at"])
-    
-    return Order(**order_dict)
+    # Counter and notification for master are applied in the background
+    await job_queue.enqueue(db, "order_created", {
+        "order_id": order_dict["id"],
+        "service_id": order_data.service_id,
+        "notification": build_notification(NotificationCreate(
+            user_id=service["master_id"],
+            type=NotificationType.NEW_ORDER,
+            title="Новый заказ",
+            content=f"У вас новый заказ на услугу '{service['title']}'",
+            link=f"/orders/{order_dict['id']}"
+        ))
+    }, idempotency_key=f"order_created:{order_dict['id']}")
+    
+    return fast_response(shape(Order, order_dict), status.HTTP_201_CREATED)
 
 @router.get("", response_model=dict)
 async def get_orders(
@@ -69,8 +89,11 @@ async def get_orders(
     role: Optional[str] = None,
     skip: int = 0,
     limit: int = 20,
+    cursor: Optional[str] = None,
+    total_mode: TotalMode = Query("exact", alias="total"),
     current_user: dict = Depends(get_current_user),
-    db: AsyncIOMotorDatabase = Depends(get_db)
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    loader: DocumentLoader = Depends(get_loader)
 ):
     # Build query based on role
     if role == "customer":
@@ -84,41 +107,39 @@ async def get_orders(
     if status_filter:
         query["status"] = status_filter
     
-    total = await db.orders.count_documents(query)
-    orders_cursor = db.orders.find(query, {"_id": 0}).sort("created_at", -1).skip(skip).limit(limit)
-    orders = await orders_cursor.to_list(length=limit)
+    total = await count_total(db.orders, query, total_mode)
+    orders, cursor_next = await find_page(db.orders, query, "created_at", -1, skip, limit, cursor, peek=total_mode == "none")
     
-    # Enrich with service, customer, master info
+    # Enrich with service, customer, master info (one query per collection)
+    services = await loader.load_many("services", [order["service_id"] for order in orders])
+    users = await loader.load_many(
+        "users",
+        [order["customer_id"] for order in orders] + [order["master_id"] for order in orders]
+    )
     for order in orders:
-        service = await db.services.find_one({"id": order["service_id"]}, {"_id": 0, "id": 1, "title": 1, "price": 1, "images": 1})
+        service = pick(services.get(order["service_id"]), ("id", "title", "price", "images"))
         if service:
             order["service"] = service
         
-        customer = await db.users.find_one({"id": order["customer_id"]}, {"_id": 0, "id": 1, "name": 1, "avatar": 1})
+        customer = pick(users.get(order["customer_id"]), ("id", "name", "avatar"))
         if customer:
             order["customer"] = customer
         
-        master = await db.users.find_one({"id": order["master_id"]}, {"_id": 0, "id": 1, "name": 1, "avatar": 1, "rating": 1})
+        master = pick(users.get(order["master_id"]), ("id", "name", "avatar", "rating"))
         if master:
             order["master"] = master
-        
-        # Convert datetime
-        if isinstance(order.get("created_at"), str):
-            order["created_at"] = datetime.fromisoformat(order["created_at"])
-        if isinstance(order.get("updated_at"), str):
-            order["updated_at"] = datetime.fromisoformat(order["updated_at"])
-        if order.get("deadline") and isinstance(order["deadline"], str):
-            order["deadline"] = datetime.fromisoformat(order["deadline"])
-        if order.get("completed_at") and isinstance(order["completed_at"], str):
-            order["completed_at"] = datetime.fromisoformat(order["completed_at"])
-    
-    return {"total": total, "skip": skip, "limit": limit, "orders": orders}
+    
+    result = {"total": total, "skip": skip, "limit": limit, "next_cursor": cursor_next, "orders": orders}
+    if total_mode == "none":
+        result["has_more"] = cursor_next is not None
+    return fast_response(result)
 
 @router.get("/{order_id}", response_model=dict)
 async def get_order(
     order_id: str,
     current_user: dict = Depends(get_current_user),
-    db: AsyncIOMotorDatabase = Depends(get_db)
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    loader: DocumentLoader = Depends(get_loader)
 ):
     order_doc = await db.orders.find_one({"id": order_id}, {"_id": 0})
     if not order_doc:
@@ -129,36 +150,19 @@ async def get_order(
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
     
     # Enrich data
-    service = await db.services.find_one({"id": order_doc["service_id"]}, {"_id": 0})
+    service = await loader.load("services", order_doc["service_id"])
+    users = await loader.load_many("users", [order_doc["customer_id"], order_doc["master_id"]])
     if service:
-        if isinstance(service.get("created_at"), str):
-            service["created_at"] = datetime.fromisoformat(service["created_at"])
-        if isinstance(service.get("updated_at"), str):
-            service["updated_at"] = datetime.fromisoformat(service["updated_at"])
         order_doc["service"] = service
     
-    customer = await db.users.find_one({"id": order_doc["customer_id"]}, {"_id": 0, "password_hash": 0})
+    customer = users.get(order_doc["customer_id"])
     if customer:
-        if isinstance(customer.get("created_at"), str):
-            customer["created_at"] = datetime.fromisoformat(customer["created_at"])
         order_doc["customer"] = customer
     
-    master = await db.users.find_one({"id": order_doc["master_id"]}, {"_id": 0, "password_hash": 0})
+    master = users.get(order_doc["master_id"])
     if master:
-        if isinstance(master.get("created_at"), str):
-            master["created_at"] = datetime.fromisoformat(master["created_at"])
         order_doc["master"] = master
     
-    # Convert datetime
-    if isinstance(order_doc.get("created_at"), str):
-        order_doc["created_at"] = datetime.fromisoformat(order_doc["created_at"])
-    if isinstance(order_doc.get("updated_at"), str):
-        order_doc["updated_at"] = datetime.fromisoformat(order_doc["updated_at"])
-    if order_doc.get("deadline") and isinstance(order_doc["deadline"], str):
-        order_doc["deadline"] = datetime.fromisoformat(order_doc["deadline"])
-    if order_doc.get("completed_at") and isinstance(order_doc["completed_at"], str):
-        order_doc["completed_at"] = datetime.fromisoformat(order_doc["completed_at"])
-    
     return order_doc
 
 @router.patch("/{order_id}/status", response_model=dict)
@@ -177,29 +181,24 @@ async def update_order_status(
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only master can update order status")
     
     update_dict = status_data.model_dump(exclude_unset=True)
-    update_dict["updated_at"] = datetime.now(timezone.utc).isoformat()
+    update_dict["updated_at"] = datetime.now(timezone.utc)
     
     if status_data.status == OrderStatus.COMPLETED:
-        update_dict["completed_at"] = datetime.now(timezone.utc).isoformat()
-        # Increment master's completed orders
-        await db.users.update_one({"id": order_doc["master_id"]}, {"$inc": {"completed_orders": 1}})
-    
-    # Convert deadline to ISO string if present
-    if "deadline" in update_dict and update_dict["deadline"]:
-        update_dict["deadline"] = update_dict["deadline"].isoformat()
+        update_dict["completed_at"] = datetime.now(timezone.utc)
     
     await db.orders.update_one({"id": order_id}, {"$set": update_dict})
     
-    # Create notification for customer
-    service = await db.services.find_one({"id": order_doc["service_id"]})
+    # Notification for customer (and master's counter) go through the job queue
+    service = await db.services.find_one({"id": order_doc["service_id"]}, {"_id": 0, "title": 1})
     notification_types = {
         OrderStatus.ACCEPTED: NotificationType.ORDER_ACCEPTED,
         OrderStatus.REJECTED: NotificationType.ORDER_REJECTED,
         OrderStatus.COMPLETED: NotificationType.ORDER_COMPLETED
     }
     
+    notification = None
     if status_data.status in notification_types:
-        await create_notification(db, NotificationCreate(
+        notification = build_notification(NotificationCreate(
             user_id=order_doc["customer_id"],
             type=notification_types[status_data.status],
             title=f"Заказ {status_data.status.value}",
@@ -207,5 +206,13 @@ async def update_order_status(
             link=f"/orders/{order_id}"
         ))
     
+    # Keyed by the status change, so a repeated request does not repeat effects
+    await job_queue.enqueue(db, "order_status_changed", {
+        "order_id": order_id,
+        "master_id": order_doc["master_id"],
+        "status": status_data.status.value,
+        "notification": notification
+    }, idempotency_key=f"order_status:{order_id}:{order_doc['status']}:{status_data.status.value}")
+    
     # Get updated order
-    return await get_order(order_id, current_user, db)
+    return await get_order(order_id, current_user, db, DocumentLoader(db))
@@ -0,0 +1,78 @@
+from fastapi import APIRouter, HTTPException, Request, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
+import asyncio
+import json
+
+from utils.auth import token_cache
+from utils.realtime import event_bus, EVENT_HEARTBEAT_INTERVAL
+
+router = APIRouter(prefix="/realtime", tags=["realtime"])
+
+# Browsers cannot set headers on WebSocket / EventSource requests, so the
+# access token is passed as ?token=...
+
+def user_from_token(token: str) -> str:
+    payload = token_cache.verify(token)
+    user_id = payload.get("sub")
+    if user_id is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials")
+    return user_id
+
+@router.websocket("/ws")
+async def websocket_events(websocket: WebSocket, token: str = ""):
+    try:
+        user_id = user_from_token(token)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    queue = event_bus.registry.connect(user_id)
+
+    async def receive():
+        # Clients do not send anything yet; this only notices disconnects
+        while True:
+            await websocket.receive_text()
+
+    receiver = asyncio.create_task(receive())
+    try:
+        while True:
+            getter = asyncio.create_task(queue.get())
+            done, _ = await asyncio.wait({getter, receiver}, timeout=EVENT_HEARTBEAT_INTERVAL, return_when=asyncio.FIRST_COMPLETED)
+            if getter not in done:
+                getter.cancel()
+            if receiver in done:
+                break
+            await websocket.send_json(getter.result() if getter in done else {"type": "ping"})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        event_bus.registry.disconnect(user_id, queue)
+
+@router.get("/events")
+async def sse_events(request: Request, token: str = ""):
+    user_id = user_from_token(token)
+
+    async def stream():
+        # Subscribed on first iteration, so a response that is never streamed
+        # leaves no queue behind
+        queue = event_bus.registry.connect(user_id)
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), EVENT_HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    # Comment line keeps proxies from closing an idle stream
+                    yield ": ping\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+        finally:
+            event_bus.registry.disconnect(user_id, queue)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -1,36 +1,35 @@
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, status, Depends, Query, Request, Response
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import DuplicateKeyError
+from typing import Optional
 import uuid
 from datetime import datetime, timezone
 
 from models import Review, ReviewCreate, ReviewDispute, OrderStatus, NotificationCreate, NotificationType
 from utils import get_current_user
-from database import get_db
+from utils.loader import DocumentLoader, pick
+from utils.pagination import find_page
+from utils.totals import count_total, TotalMode
+from utils.ratings import apply_review_rating
+from utils.masters import propagate_master_summary
+from utils.jobs import job_queue
+from utils.notifications import notification_service, build_notification
+from utils.cache import response_cache, cache_key, service_tags, CACHE_TTLS
+from utils.etag import etag_for, check_etag
+from utils.responses import fast_response, shape
+from database import get_db, get_loader
 
 router = APIRouter(prefix="/reviews", tags=["reviews"])
 
-async def create_notification(db: AsyncIOMotorDatabase, notification: NotificationCreate):
-    notif_dict = notification.model_dump()
-    notif_dict["id"] = str(uuid.uuid4())
-    notif_dict["is_read"] = False
-    notif_dict["created_at"] = datetime.now(timezone.utc).isoformat()
-    await db.notifications.insert_one(notif_dict)
-
-async def update_master_rating(db: AsyncIOMotorDatabase, master_id: str):
-    # Calculate average rating
-    pipeline = [
-        {"$match": {"master_id": master_id}},
-        {"$group": {"_id": None, "avg_rating": {"$avg": "$rating"}, "count": {"$sum": 1}}}
-    ]
-    result = await db.reviews.aggregate(pipeline).to_list(1)
-    
-    if result:
-        avg_rating = round(result[0]["avg_rating"], 2)
-        total_reviews = result[0]["count"]
-        await db.users.update_one(
-            {"id": master_id},
-            {"$set": {"rating": avg_rating, "total_reviews": total_reviews}}
-        )
+@job_queue.handler("review_created")
+async def handle_review_created(db: AsyncIOMotorDatabase, payload: dict):
+    review = payload["review"]
+    # Recomputes both ratings from the reviews collection, so a retry is harmless
+    master = await apply_review_rating(db, review)
+    # Re-reads the master when a newer rating state was already stored
+    await propagate_master_summary(db, review["master_id"], master)
+    response_cache.invalidate(f"user:{review['master_id']}", *service_tags(review["service_id"], review["master_id"]))
+    await notification_service.write(db, [payload["notification"]])
 
 @router.post("", response_model=Review, status_code=status.HTTP_201_CREATED)
 async def create_review(
@@ -71,55 +70,64 @@ async def create_review(
     review_dict["master_id"] = order["master_id"]
     review_dict["customer_id"] = current_user["id"]
     review_dict["service_id"] = order["service_id"]
-    review_dict["created_at"] = datetime.now(timezone.utc).isoformat()
-    
-    await db.reviews.insert_one(review_dict)
-    
-    # Update master rating
-    await update_master_rating(db, order["master_id"])
+    review_dict["created_at"] = datetime.now(timezone.utc)
     
-    # Create notification for master
-    await create_notification(db, NotificationCreate(
-        user_id=order["master_id"],
-        type=NotificationType.NEW_REVIEW,
-        title="Новый отзыв",
-        content=f"Вы получили новый отзыв с оценкой {review_data.rating} звезд",
-        link=f"/orders/{review_data.order_id}"
-    ))
+    try:
+        await db.reviews.insert_one(review_dict)
+    except DuplicateKeyError:
+        # Concurrent request for the same order won the unique index
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Review already exists for this order"
+        )
     
-    review_dict["created_at"] = datetime.fromisoformat(review_dict["created_at"])
-    return Review(**review_dict)
+    response_cache.invalidate(f"service_reviews:{order['service_id']}")
+    
+    # Ratings, master summary and notification are applied in the background
+    await job_queue.enqueue(db, "review_created", {
+        "review": {key: review_dict[key] for key in ("id", "rating", "master_id", "service_id")},
+        "notification": build_notification(NotificationCreate(
+            user_id=order["master_id"],
+            type=NotificationType.NEW_REVIEW,
+            title="Новый отзыв",
+            content=f"Вы получили новый отзыв с оценкой {review_data.rating} звезд",
+            link=f"/orders/{review_data.order_id}"
+        ))
+    }, idempotency_key=f"review_created:{review_dict['id']}")
+    
+    return fast_response(shape(Review, review_dict), status.HTTP_201_CREATED)
 
 @router.get("/master/{master_id}")
 async def get_master_reviews(
     master_id: str,
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 20,
-    db: AsyncIOMotorDatabase = Depends(get_db)
+    cursor: Optional[str] = None,
+    total_mode: TotalMode = Query("exact", alias="total"),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    loader: DocumentLoader = Depends(get_loader)
 ):
     # Get reviews with customer info
-    reviews = await db.reviews.find(
-        {"master_id": master_id},
-        {"_id": 0}
-    ).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
+    reviews, cursor_next = await find_page(
+        db.reviews, {"master_id": master_id}, "created_at", -1, skip, limit, cursor, peek=total_mode == "none"
+    )
     
     # Enrich with customer info
+    customers = await loader.load_many("users", [review["customer_id"] for review in reviews])
     for review in reviews:
-        customer = await db.users.find_one(
-            {"id": review["customer_id"]},
-            {"_id": 0, "name": 1, "avatar": 1}
-        )
+        customer = customers.get(review["customer_id"])
         if customer:
             review["customer_name"] = customer["name"]
             review["customer_avatar"] = customer.get("avatar")
-        
-        # Convert datetime if needed
-        if isinstance(review.get("created_at"), str):
-            review["created_at"] = datetime.fromisoformat(review["created_at"]).isoformat()
     
-    total = await db.reviews.count_documents({"master_id": master_id})
+    total = await count_total(db.reviews, {"master_id": master_id}, total_mode)
     
-    return {"reviews": reviews, "total": total, "skip": skip, "limit": limit}
+    result = {"reviews": reviews, "total": total, "skip": skip, "limit": limit, "next_cursor": cursor_next}
+    if total_mode == "none":
+        result["has_more"] = cursor_next is not None
+    return check_etag(request, response, etag_for(result)) or fast_response(result, response=response)
 
 @router.get("/order/{order_id}", response_model=dict)
 async def get_order_review(
@@ -133,11 +141,21 @@ async def get_order_review(
 @router.get("/service/{service_id}", response_model=dict)
 async def get_service_reviews(
     service_id: str,
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 20,
     sort: str = "newest",
-    db: AsyncIOMotorDatabase = Depends(get_db)
+    cursor: Optional[str] = None,
+    total_mode: TotalMode = Query("exact", alias="total"),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    loader: DocumentLoader = Depends(get_loader)
 ):
+    key = cache_key(request)
+    cached = response_cache.get_with_etag(key)
+    if cached is not None:
+        return check_etag(request, response, cached[1]) or fast_response(cached[0], response=response)
+    
     # Sort
     if sort == "highest":
         sort_field, sort_direction = "rating", -1
@@ -147,20 +165,23 @@ async def get_service_reviews(
         sort_field, sort_direction = "created_at", -1
     
     query = {"service_id": service_id}
-    total = await db.reviews.count_documents(query)
-    reviews_cursor = db.reviews.find(query, {"_id": 0}).sort(sort_field, sort_direction).skip(skip).limit(limit)
-    reviews = await reviews_cursor.to_list(length=limit)
+    total = await count_total(db.reviews, query, total_mode)
+    reviews, cursor_next = await find_page(
+        db.reviews, query, sort_field, sort_direction, skip, limit, cursor, peek=total_mode == "none"
+    )
     
     # Enrich with customer info
+    customers = await loader.load_many("users", [review["customer_id"] for review in reviews])
     for review in reviews:
-        customer = await db.users.find_one({"id": review["customer_id"]}, {"_id": 0, "id": 1, "name": 1, "avatar": 1})
+        customer = pick(customers.get(review["customer_id"]), ("id", "name", "avatar"))
         if customer:
             review["customer"] = customer
-        
-        if isinstance(review.get("created_at"), str):
-            review["created_at"] = datetime.fromisoformat(review["created_at"])
     
-    return {"total": total, "skip": skip, "limit": limit, "reviews": reviews}
+    result = {"total": total, "skip": skip, "limit": limit, "next_cursor": cursor_next, "reviews": reviews}
+    if total_mode == "none":
+        result["has_more"] = cursor_next is not None
+    result, etag = response_cache.set_with_etag(key, result, CACHE_TTLS["service_reviews"], [f"service_reviews:{service_id}"])
+    return check_etag(request, response, etag) or fast_response(result, response=response)
 
 
 @router.post("/{review_id}/dispute", response_model=dict)
@@ -199,7 +220,7 @@ async def dispute_review(
     )
     
     # Create notification for admins and customer
-    await create_notification(db, NotificationCreate(
+    await notification_service.notify(db, NotificationCreate(
         user_id=review["customer_id"],
         type=NotificationType.REVIEW_DISPUTED,
         title="Отзыв оспорен",
@@ -1,115 +1,264 @@
-from fastapi import APIRouter, HTTPException, status, Depends, Query, Request
+from fastapi import APIRouter, HTTPException, status, Depends, Query, Request, Response
+from fastapi.security import HTTPAuthorizationCredentials
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
 from typing import Optional, List
+import re
 import uuid
 from datetime import datetime, timezone
 
-from models import Service, ServiceCreate, ServiceUpdate, UserRole
+from models import Service, ServiceCreate, ServiceUpdate, ServiceCategory, UserRole
 from utils import get_current_user
-from database import get_db
+from utils.auth import optional_security
+from utils.loader import DocumentLoader
+from utils.pagination import find_page, apply_cursor, sort_spec, next_cursor
+from utils.facets import price_bucket_stage, price_buckets, category_counts
+from utils.totals import count_total, TotalMode
+from utils.views import view_counter
+from utils.masters import master_summary, MASTER_SUMMARY_PROJECTION
+from utils.cache import response_cache, cache_key, service_tags, CACHE_TTLS
+from utils.etag import etag_for, check_etag
+from utils.responses import fast_response, shape
+from utils.blobs import retain_blobs, release_blobs, blob_changes
+from utils.suggest import suggest_index
+from utils.catalog import catalog_snapshot
+from database import get_db, get_loader
 
 router = APIRouter(prefix="/services", tags=["services"])
 
+# Service fields that change whenever the detail response does. The body
+# embeds the full master document, so the version carries that as returned:
+# counters like completed_orders never touch the embedded summary.
+SERVICE_VERSION_FIELDS = ("updated_at", "views", "orders_count", "rating", "total_reviews")
+SERVICE_VERSION_PROJECTION = {"_id": 0, "master_id": 1, "master": 1, **{field: 1 for field in SERVICE_VERSION_FIELDS}}
+
+async def load_service_master(loader: DocumentLoader, service_doc: dict) -> Optional[dict]:
+    master = await loader.load("users", service_doc["master_id"])
+    if master:
+        return {k: v for k, v in master.items() if k not in ("email", "phone")}
+    # Falls back to the embedded summary, as the response body does
+    return service_doc.get("master")
+
+def service_version(doc: dict, master: Optional[dict]) -> dict:
+    return {**{field: doc.get(field) for field in SERVICE_VERSION_FIELDS}, "master": master}
+
 @router.get("", response_model=dict)
 async def get_services(
+    request: Request,
+    response: Response,
     category: Optional[str] = None,
     search: Optional[str] = None,
+    search_mode: str = "text",
     min_price: Optional[float] = None,
     max_price: Optional[float] = None,
-    sort_by: str = "created_at",
+    sort_by: Optional[str] = None,
     skip: int = 0,
     limit: int = 20,
-    db: AsyncIOMotorDatabase = Depends(get_db)
+    cursor: Optional[str] = None,
+    facets: bool = False,
+    total_mode: TotalMode = Query("exact", alias="total"),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    loader: DocumentLoader = Depends(get_loader)
 ):
-    # Build query
-    query = {"is_active": True}
-    if category:
-        query["category"] = category
-    if search:
-        query["$or"] = [
-            {"title": {"$regex": search, "$options": "i"}},
-            {"description": {"$regex": search, "$options": "i"}}
+    search = search.strip() if search else None
+    if search_mode not in ("text", "regex"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="search_mode must be text or regex")
+    # Substring matching scans every active service, so it stays an admin
+    # tool; its results are not cached for anonymous readers
+    regex_search = bool(search) and search_mode == "regex"
+    # The catalog is public: the token is only looked at when regex search
+    # needs an admin, so a stale session still browses anonymously
+    current_user = await get_current_user(credentials) if regex_search and credentials else None
+    if regex_search and (current_user is None or current_user["role"] != UserRole.ADMIN.value):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Regex search is available to admins only")
+    
+    key = cache_key(request)
+    cached = response_cache.get_with_etag(key) if not regex_search else None
+    if cached is not None:
+        return check_etag(request, response, cached[1]) or fast_response(cached[0], response=response)
+    
+    # Build query; category and price filters are kept apart for facets
+    base_query = {"is_active": True}
+    if regex_search:
+        pattern = re.escape(search)
+        base_query["$or"] = [
+            {"title": {"$regex": pattern, "$options": "i"}},
+            {"description": {"$regex": pattern, "$options": "i"}}
         ]
+    elif search:
+        # Served by the text_search index: Russian stemming, title weighted highest
+        base_query["$text"] = {"$search": search}
+    category_filter = {"category": category} if category else {}
+    price_filter = {}
     if min_price is not None or max_price is not None:
-        query["price"] = {}
+        price_filter["price"] = {}
         if min_price is not None:
-            query["price"]["$gte"] = min_price
+            price_filter["price"]["$gte"] = min_price
         if max_price is not None:
-            query["price"]["$lte"] = max_price
+            price_filter["price"]["$lte"] = max_price
+    query = {**base_query, **category_filter, **price_filter}
+    
+    # Sort (rating is the master's rating embedded in each service)
+    sort_fields = {"price": ("price", 1), "created_at": ("created_at", -1), "rating": ("master.rating", -1)}
+    sort_field, sort_direction = sort_fields.get(sort_by, sort_fields["created_at"])
+    relevance = "$text" in query and sort_by in (None, "relevance")
+    has_more = None
     
-    # Sort
-    sort_field = sort_by if sort_by in ["price", "created_at", "rating"] else "created_at"
-    sort_direction = -1 if sort_field in ["created_at", "rating"] else 1
+    # Plain listings can come from the in-process snapshot when it is on
+    snapshot_page = None
+    if not search and not facets:
+        snapshot_page = catalog_snapshot.query(
+            category, min_price, max_price, sort_field, sort_direction, skip, limit, cursor, peek=total_mode == "none"
+        )
     
-    total = await db.services.count_documents(query)
-    services_cursor = db.services.find(query, {"_id": 0}).sort(sort_field, sort_direction).skip(skip).limit(limit)
-    services = await services_cursor.to_list(length=limit)
+    facet_counts = None
+    if facets:
+        # Page, total and both facets in one aggregation. Category counts
+        # skip the category filter so the other categories stay selectable;
+        # the price histogram spans the filtered price range.
+        filters = {**category_filter, **price_filter}
+        if relevance:
+            page = [{"$match": filters}, {"$sort": {"score": {"$meta": "textScore"}, "id": -1}}]
+        else:
+            page = [
+                {"$match": apply_cursor(filters, sort_field, sort_direction, cursor)},
+                {"$sort": dict(sort_spec(sort_field, sort_direction))}
+            ]
+        if skip and (relevance or not cursor):
+            page.append({"$skip": skip})
+        # One extra row tells whether another page exists, with or without a cursor
+        fetch = limit + 1 if total_mode == "none" and limit > 0 else limit
+        if fetch > 0:
+            page.append({"$limit": fetch})
+        page.append({"$project": {"_id": 0}})
+        price_stage = price_bucket_stage(min_price, max_price)
+        
+        pipeline = [{"$match": base_query}, {"$facet": {
+            "services": page,
+            "total": [{"$match": filters}, {"$count": "n"}],
+            "categories": [{"$match": price_filter}, {"$group": {"_id": "$category", "count": {"$sum": 1}}}],
+            "prices": [{"$match": filters}, price_stage],
+        }}]
+        row = (await db.services.aggregate(pipeline).to_list(length=1))[0]
+        services = row["services"]
+        total = row["total"][0]["n"] if row["total"] else 0
+        if fetch > limit:
+            has_more = len(services) > limit
+            services = services[:limit]
+        cursor_next = None if relevance or has_more is False else next_cursor(services, sort_field, limit)
+        facet_counts = {
+            "categories": category_counts(row["categories"], [c.value for c in ServiceCategory]),
+            "prices": price_buckets(row["prices"], price_stage, max_price),
+        }
+    elif relevance:
+        total = await count_total(db.services, query, total_mode)
+        # Relevance has no stable keyset to seek from, so it pages with skip
+        fetch = limit + 1 if total_mode == "none" and limit > 0 else limit
+        services = await db.services.find(
+            query, {"_id": 0, "score": {"$meta": "textScore"}}
+        ).sort([("score", {"$meta": "textScore"}), ("id", -1)]).skip(skip).limit(fetch).to_list(length=fetch)
+        has_more = len(services) > limit if fetch > limit else None
+        services = services[:limit] if limit > 0 else services
+        for service in services:
+            service.pop("score", None)
+        cursor_next = None
+    elif snapshot_page is not None:
+        # Counting the matching rows is free, so every mode gets an exact total
+        total, services, cursor_next = snapshot_page
+        if total_mode == "none":
+            total = None
+    else:
+        # Without search, category or price filters nearly every service matches
+        total = await count_total(db.services, query, total_mode, trivial=query == {"is_active": True})
+        services, cursor_next = await find_page(
+            db.services, query, sort_field, sort_direction, skip, limit, cursor, peek=total_mode == "none"
+        )
     
-    # Get master info for each service
+    # Master info is embedded at write time; services written before that
+    # are resolved in one batched query
+    masters = await loader.load_many(
+        "users",
+        [service["master_id"] for service in services if "master" not in service]
+    )
     for service in services:
-        master = await db.users.find_one({"id": service["master_id"]}, {"_id": 0, "name": 1, "rating": 1, "id": 1})
+        master = service.get("master") or masters.get(service["master_id"])
         if master:
             service["master_name"] = master.get("name")
             service["master_rating"] = master.get("rating", 0)
-        
-        # Convert datetime
-        if isinstance(service.get("created_at"), str):
-            service["created_at"] = datetime.fromisoformat(service["created_at"])
-        if isinstance(service.get("updated_at"), str):
-            service["updated_at"] = datetime.fromisoformat(service["updated_at"])
     
-    return {"total": total, "skip": skip, "limit": limit, "services": services}
+    result = {"total": total, "skip": skip, "limit": limit, "next_cursor": cursor_next, "services": services}
+    if facet_counts is not None:
+        result["facets"] = facet_counts
+    if total_mode == "none":
+        result["has_more"] = has_more if has_more is not None else cursor_next is not None
+    if regex_search:
+        etag = etag_for(result)
+    else:
+        result, etag = response_cache.set_with_etag(key, result, CACHE_TTLS["services"], ["services"])
+    return check_etag(request, response, etag) or fast_response(result, response=response)
+
+@router.get("/suggest", response_model=dict)
+async def suggest_services(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(8, ge=1, le=20)
+):
+    # Answered from the in-process trigram index, no database round trip
+    return fast_response({"query": q, "suggestions": suggest_index.search(q, limit)})
 
 @router.get("/{service_id}", response_model=dict)
 async def get_service(
     service_id: str,
     request: Request,
-    db: AsyncIOMotorDatabase = Depends(get_db)
+    response: Response,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    loader: DocumentLoader = Depends(get_loader)
 ):
-    service_doc = await db.services.find_one({"id": service_id}, {"_id": 0})
-    if not service_doc:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Service not found")
+    key = cache_key(request)
+    cached = response_cache.get(key)
+    
+    if cached is not None:
+        version = cached["version"]
+    else:
+        revalidating = bool(request.headers.get("if-none-match"))
+        if revalidating:
+            # Revalidation reads only the version fields and the master, so a
+            # client holding the current copy costs no enrichment
+            service_doc = await db.services.find_one({"id": service_id}, SERVICE_VERSION_PROJECTION)
+        else:
+            service_doc = await db.services.find_one({"id": service_id}, {"_id": 0})
+        if service_doc is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Service not found")
+        master = await load_service_master(loader, service_doc)
+        version = service_version(service_doc, master)
     
-    # Increment views only once per session
-    # Use IP address + service_id as unique identifier
+    # Count one view per client; the counter dedupes in memory and flushes
+    # aggregated increments in the background, so no write happens here
     client_ip = request.client.host if request.client else "unknown"
-    view_key = f"view_{service_id}_{client_ip}"
-    
-    # Check if already viewed (ever, not just 1 hour)
-    view_record = await db.service_views.find_one({"key": view_key})
-    if not view_record:
-        # First view ever - increment counter
-        result = await db.services.find_one_and_update(
-            {"id": service_id},
-            {"$inc": {"views": 1}},
-            return_document=True
-        )
-        service_doc["views"] = result.get("views", 0)
-        
-        # Store view record permanently
-        await db.service_views.insert_one({
-            "key": view_key,
-            "service_id": service_id,
-            "created_at": datetime.now(timezone.utc)
-        })
-    
-    # Get master info
-    master = await db.users.find_one(
-        {"id": service_doc["master_id"]},
-        {"_id": 0, "password_hash": 0, "email": 0, "phone": 0}
-    )
-    if master:
-        if isinstance(master.get("created_at"), str):
-            master["created_at"] = datetime.fromisoformat(master["created_at"])
-        service_doc["master"] = master
+    view_counter.record(service_id, client_ip)
+    
+    # Tagged on flushed plus pending views, so a flush alone changes nothing
+    pending = view_counter.pending(service_id)
+    not_modified = check_etag(request, response, etag_for({**version, "views": (version["views"] or 0) + pending}))
+    if not_modified:
+        return not_modified
     
-    # Convert datetime
-    if isinstance(service_doc.get("created_at"), str):
-        service_doc["created_at"] = datetime.fromisoformat(service_doc["created_at"])
-    if isinstance(service_doc.get("updated_at"), str):
-        service_doc["updated_at"] = datetime.fromisoformat(service_doc["updated_at"])
+    if cached is None:
+        if revalidating:
+            service_doc = await db.services.find_one({"id": service_id}, {"_id": 0})
+            if not service_doc:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Service not found")
+        if master is not None:
+            service_doc["master"] = master
+        
+        cached = response_cache.set(
+            key, {"version": version, "service": service_doc}, CACHE_TTLS["service"],
+            [f"service:{service_id}", f"user:{service_doc['master_id']}"]
+        )
     
-    return service_doc
+    # The cached document is shared, so add pending views to a copy
+    service_doc = cached["service"]
+    return fast_response({**service_doc, "views": (service_doc.get("views") or 0) + pending}, response=response)
 
 @router.post("", response_model=Service, status_code=status.HTTP_201_CREATED)
 async def create_service(
@@ -130,16 +279,25 @@ async def create_service(
     service_dict["is_active"] = True
     service_dict["views"] = 0
     service_dict["orders_count"] = 0
-    service_dict["created_at"] = datetime.now(timezone.utc).isoformat()
-    service_dict["updated_at"] = datetime.now(timezone.utc).isoformat()
+    service_dict["created_at"] = datetime.now(timezone.utc)
+    service_dict["updated_at"] = datetime.now(timezone.utc)
     
-    await db.services.insert_one(service_dict)
+    master = await db.users.find_one({"id": current_user["id"]}, MASTER_SUMMARY_PROJECTION)
+    if master:
+        service_dict["master"] = master_summary(master)
     
-    # Convert datetime for response
-    service_dict["created_at"] = datetime.fromisoformat(service_dict["created_at"])
-    service_dict["updated_at"] = datetime.fromisoformat(service_dict["updated_at"])
+    # Uploaded images are referenced before the service points at them
+    await retain_blobs(db, service_dict["images"] or [])
+    try:
+        await db.services.insert_one(service_dict)
+    except Exception:
+        await release_blobs(db, service_dict["images"] or [])
+        raise
+    response_cache.invalidate(*service_tags(None, current_user["id"]))
+    suggest_index.add_service(service_dict)
+    catalog_snapshot.upsert(service_dict)
     
-    return Service(**service_dict)
+    return fast_response(shape(Service, service_dict), status.HTTP_201_CREATED)
 
 @router.put("/{service_id}", response_model=Service)
 async def update_service(
@@ -163,19 +321,30 @@ async def update_service(
     if not update_dict:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No data to update")
     
-    update_dict["updated_at"] = datetime.now(timezone.utc).isoformat()
+    update_dict["updated_at"] = datetime.now(timezone.utc)
     
-    await db.services.update_one({"id": service_id}, {"$set": update_dict})
+    images = update_dict.get("images") or []
+    added = []
+    if "images" in update_dict:
+        added, _ = blob_changes(service_doc.get("images"), images)
+        await retain_blobs(db, added)
     
-    updated_doc = await db.services.find_one({"id": service_id}, {"_id": 0})
+    previous = await db.services.find_one_and_update(
+        {"id": service_id}, {"$set": update_dict}, {"_id": 0, "images": 1}, return_document=ReturnDocument.BEFORE
+    )
+    if "images" in update_dict:
+        # Diff against the list actually replaced, so an image uploaded
+        # between the read above and this write is released as well
+        needed, removed = blob_changes(previous.get("images") if previous else [], images)
+        surplus, _ = blob_changes(needed, added)
+        await release_blobs(db, removed + surplus)
+    response_cache.invalidate(*service_tags(service_id, current_user["id"]))
     
-    # Convert datetime
-    if isinstance(updated_doc.get("created_at"), str):
-        updated_doc["created_at"] = datetime.fromisoformat(updated_doc["created_at"])
-    if isinstance(updated_doc.get("updated_at"), str):
-        updated_doc["updated_at"] = datetime.fromisoformat(updated_doc["updated_at"])
+    updated_doc = await db.services.find_one({"id": service_id}, {"_id": 0})
+    suggest_index.add_service(updated_doc)
+    catalog_snapshot.upsert(updated_doc)
     
-    return Service(**updated_doc)
+    return fast_response(shape(Service, updated_doc))
 
 @router.delete("/{service_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_service(
@@ -194,25 +363,37 @@ async def delete_service(
         )
     
     await db.services.delete_one({"id": service_id})
+    response_cache.invalidate(*service_tags(service_id, current_user["id"]))
+    await release_blobs(db, service_doc.get("images", []))
+    suggest_index.remove_service(service_id)
+    catalog_snapshot.remove(service_id)
     return None
 
 @router.get("/master/{master_id}", response_model=dict)
 async def get_master_services(
     master_id: str,
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 20,
+    cursor: Optional[str] = None,
+    total_mode: TotalMode = Query("exact", alias="total"),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
-    query = {"master_id": master_id, "is_active": True}
+    key = cache_key(request)
+    cached = response_cache.get_with_etag(key)
+    if cached is not None:
+        return check_etag(request, response, cached[1]) or fast_response(cached[0], response=response)
     
-    total = await db.services.count_documents(query)
-    services_cursor = db.services.find(query, {"_id": 0}).sort("created_at", -1).skip(skip).limit(limit)
-    services = await services_cursor.to_list(length=limit)
+    query = {"master_id": master_id, "is_active": True}
     
-    for service in services:
-        if isinstance(service.get("created_at"), str):
-            service["created_at"] = datetime.fromisoformat(service["created_at"])
-        if isinstance(service.get("updated_at"), str):
-            service["updated_at"] = datetime.fromisoformat(service["updated_at"])
+    total = await count_total(db.services, query, total_mode)
+    services, cursor_next = await find_page(db.services, query, "created_at", -1, skip, limit, cursor, peek=total_mode == "none")
     
-    return {"total": total, "skip": skip, "limit": limit, "services": services}
+    result = {"total": total, "skip": skip, "limit": limit, "next_cursor": cursor_next, "services": services}
+    if total_mode == "none":
+        result["has_more"] = cursor_next is not None
+    result, etag = response_cache.set_with_etag(
+        key, result, CACHE_TTLS["master_services"], [f"master_services:{master_id}", f"user:{master_id}"]
+    )
+    return check_etag(request, response, etag) or fast_response(result, response=response)
@@ -1,11 +1,17 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File, Depends, status
+from fastapi import APIRouter, HTTPException, UploadFile, File, Depends, Query, Request, status
 from fastapi.responses import FileResponse
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
 from pathlib import Path
-import uuid
-import os
-from typing import List
+import asyncio
+from typing import List, Optional
+from datetime import datetime, timezone
 from utils.auth import get_current_user
+from utils.masters import propagate_master_summary
+from utils.cache import response_cache, service_tags
+from utils.uploads import save_upload, MULTIPART_OVERHEAD
+from utils.blobs import release_blobs, is_content_addressed, IMMUTABLE_CACHE_CONTROL
+from utils.images import image_variants, negotiate_format, MEDIA_TYPES, IMAGE_MAX_DIMENSION
 from database import get_db
 
 router = APIRouter(prefix="/upload", tags=["upload"])
@@ -15,6 +21,13 @@ AVATAR_DIR = UPLOAD_DIR / "avatars"
 SERVICE_DIR = UPLOAD_DIR / "services"
 ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
 MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
+MAX_SERVICE_FILES = 10
+
+# Whole-body caps enforced by UploadSizeLimitMiddleware before parsing
+UPLOAD_BODY_LIMITS = [
+    ("/api/upload/avatar", MAX_FILE_SIZE + MULTIPART_OVERHEAD),
+    ("/api/upload/service/", MAX_SERVICE_FILES * (MAX_FILE_SIZE + MULTIPART_OVERHEAD)),
+]
 
 def validate_image(file: UploadFile):
     # Check file extension
@@ -34,21 +47,11 @@ async def upload_avatar(
 ):
     ext = validate_image(file)
     
-    # Generate unique filename
-    filename = f"{uuid.uuid4()}{ext}"
-    file_path = AVATAR_DIR / filename
-    
-    # Save file
+    # Save file under its content hash
     try:
-        content = await file.read()
-        if len(content) > MAX_FILE_SIZE:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="File too large. Max size is 5MB"
-            )
-        
-        with open(file_path, "wb") as f:
-            f.write(content)
+        filename = await save_upload(db, file, AVATAR_DIR, ext, MAX_FILE_SIZE)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -58,18 +61,19 @@ async def upload_avatar(
     # Update user avatar in database
     avatar_url = f"/api/upload/avatars/{filename}"
     
-    # Delete old avatar if exists
-    user = await db.users.find_one({"id": current_user["id"]})
-    if user and user.get("avatar"):
-        old_filename = user["avatar"].split("/")[-1]
-        old_path = AVATAR_DIR / old_filename
-        if old_path.exists():
-            os.remove(old_path)
-    
-    await db.users.update_one(
+    # Swap the avatar and drop the reference to the old one; the file goes
+    # once nothing else points at it
+    user = await db.users.find_one_and_update(
         {"id": current_user["id"]},
-        {"$set": {"avatar": avatar_url}}
+        {"$set": {"avatar": avatar_url, "updated_at": datetime.now(timezone.utc)}},
+        projection={"_id": 0, "avatar": 1}
     )
+    if user and user.get("avatar"):
+        await release_blobs(db, [user["avatar"]])
+    response_cache.invalidate(f"user:{current_user['id']}")
+    if current_user["role"] == "master":
+        await propagate_master_summary(db, current_user["id"])
+        response_cache.invalidate("services")
     
     return {"avatar_url": avatar_url, "message": "Avatar uploaded successfully"}
 
@@ -91,55 +95,41 @@ async def upload_service_images(
             detail="You don't have permission to upload images for this service"
         )
     
-    if len(files) > 10:
+    if len(files) > MAX_SERVICE_FILES:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Maximum 10 images allowed"
+            detail=f"Maximum {MAX_SERVICE_FILES} images allowed"
         )
     
-    uploaded_urls = []
-    
-    for file in files:
-        ext = validate_image(file)
-        
-        # Generate unique filename
-        filename = f"{uuid.uuid4()}{ext}"
-        file_path = SERVICE_DIR / filename
-        
-        # Save file
-        try:
-            content = await file.read()
-            if len(content) > MAX_FILE_SIZE:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"File {file.filename} is too large. Max size is 5MB"
-                )
-            
-            with open(file_path, "wb") as f:
-                f.write(content)
-            
-            image_url = f"/api/upload/services/{filename}"
-            uploaded_urls.append(image_url)
-        except Exception as e:
-            # Clean up already uploaded files on error
-            for url in uploaded_urls:
-                filename = url.split("/")[-1]
-                path = SERVICE_DIR / filename
-                if path.exists():
-                    os.remove(path)
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Failed to save file: {str(e)}"
-            )
-    
-    # Update service images in database
-    current_images = service.get("images", [])
-    updated_images = current_images + uploaded_urls
-    
-    await db.services.update_one(
+    exts = [validate_image(file) for file in files]
+    
+    # Save files concurrently; if any fails, release the ones that made it
+    results = await asyncio.gather(
+        *(save_upload(db, file, SERVICE_DIR, ext, MAX_FILE_SIZE) for file, ext in zip(files, exts)),
+        return_exceptions=True
+    )
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        await release_blobs(db, [f"/api/upload/services/{result}" for result in results if isinstance(result, str)])
+        if isinstance(errors[0], HTTPException):
+            raise errors[0]
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to save file: {str(errors[0])}"
+        )
+    
+    uploaded_urls = [f"/api/upload/services/{filename}" for filename in results]
+    
+    # Appended in place, so concurrent uploads and deletes don't overwrite
+    # each other's lists and leave references nothing points at
+    result = await db.services.update_one(
         {"id": service_id},
-        {"$set": {"images": updated_images}}
+        {"$push": {"images": {"$each": uploaded_urls}}, "$set": {"updated_at": datetime.now(timezone.utc)}}
     )
+    if not result.matched_count:
+        await release_blobs(db, uploaded_urls)
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Service not found")
+    response_cache.invalidate(*service_tags(service_id, service["master_id"]))
     
     return {"image_urls": uploaded_urls, "message": f"{len(uploaded_urls)} images uploaded successfully"}
 
@@ -161,36 +151,55 @@ async def delete_service_image(
             detail="You don't have permission to delete images for this service"
         )
     
-    # Remove image from database
-    current_images = service.get("images", [])
-    if image_url not in current_images:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
-    
-    updated_images = [img for img in current_images if img != image_url]
-    
-    await db.services.update_one(
-        {"id": service_id},
-        {"$set": {"images": updated_images}}
+    # Pulled in place; the document from before the write says how many
+    # copies were actually removed, whatever else changed meanwhile
+    previous = await db.services.find_one_and_update(
+        {"id": service_id, "images": image_url},
+        {"$pull": {"images": image_url}, "$set": {"updated_at": datetime.now(timezone.utc)}},
+        projection={"_id": 0, "images": 1},
+        return_document=ReturnDocument.BEFORE
     )
+    if previous is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
+    removed = previous["images"].count(image_url)
+    response_cache.invalidate(*service_tags(service_id, service["master_id"]))
     
-    # Delete physical file
-    filename = image_url.split("/")[-1]
-    file_path = SERVICE_DIR / filename
-    if file_path.exists():
-        os.remove(file_path)
+    # The file itself is removed by the blob collector once unreferenced
+    await release_blobs(db, [image_url] * removed)
     
     return {"message": "Image deleted successfully"}
 
-@router.get("/avatars/{filename}")
-async def get_avatar(filename: str):
-    file_path = AVATAR_DIR / filename
+async def serve_image(request: Request, directory: Path, filename: str, width: Optional[int], height: Optional[int], image_format: Optional[str]):
+    file_path = directory / filename
     if not file_path.exists():
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
-    return FileResponse(file_path)
+    headers = {"Cache-Control": IMMUTABLE_CACHE_CONTROL} if is_content_addressed(filename) else {}
+    if not (width or height or image_format):
+        return FileResponse(file_path, headers=headers)
+    
+    fmt = negotiate_format(image_format, request.headers.get("accept", ""), file_path.suffix.lower())
+    variant = await image_variants.get(file_path, width or 0, height or 0, fmt)
+    # Without an explicit format the encoding depends on Accept
+    if not image_format:
+        headers["Vary"] = "Accept"
+    return FileResponse(variant, media_type=MEDIA_TYPES[fmt], headers=headers)
+
+@router.get("/avatars/{filename}")
+async def get_avatar(
+    filename: str,
+    request: Request,
+    w: Optional[int] = Query(None, ge=1, le=IMAGE_MAX_DIMENSION),
+    h: Optional[int] = Query(None, ge=1, le=IMAGE_MAX_DIMENSION),
+    image_format: Optional[str] = Query(None, alias="format")
+):
+    return await serve_image(request, AVATAR_DIR, filename, w, h, image_format)
 
 @router.get("/services/{filename}")
-async def get_service_image(filename: str):
-    file_path = SERVICE_DIR / filename
-    if not file_path.exists():
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
-    return FileResponse(file_path)
+async def get_service_image(
+    filename: str,
+    request: Request,
+    w: Optional[int] = Query(None, ge=1, le=IMAGE_MAX_DIMENSION),
+    h: Optional[int] = Query(None, ge=1, le=IMAGE_MAX_DIMENSION),
+    image_format: Optional[str] = Query(None, alias="format")
+):
+    return await serve_image(request, SERVICE_DIR, filename, w, h, image_format)
@@ -1,9 +1,16 @@
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, status, Depends, Request, Response
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
 from datetime import datetime, timezone
 
-from models import User, UserUpdate, UserPublic
+from models import User, UserUpdate, UserPublic, UserRole
 from utils import get_current_user
+from utils.masters import propagate_master_summary
+from utils.suggest import suggest_index
+from utils.blobs import retain_blobs, release_blobs
+from utils.cache import response_cache, cache_key, CACHE_TTLS
+from utils.etag import check_etag
+from utils.responses import fast_response, shape
 from database import get_db
 
 router = APIRouter(prefix="/users", tags=["users"])
@@ -17,13 +24,7 @@ async def get_current_user_profile(
     if not user_doc:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
     
-    # Convert datetime strings
-    if isinstance(user_doc.get("created_at"), str):
-        user_doc["created_at"] = datetime.fromisoformat(user_doc["created_at"])
-    if isinstance(user_doc.get("updated_at"), str):
-        user_doc["updated_at"] = datetime.fromisoformat(user_doc["updated_at"])
-    
-    return User(**user_doc)
+    return fast_response(shape(User, user_doc))
 
 @router.put("/me", response_model=User)
 async def update_current_user_profile(
@@ -35,28 +36,47 @@ async def update_current_user_profile(
     if not update_dict:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No data to update")
     
-    update_dict["updated_at"] = datetime.now(timezone.utc).isoformat()
+    update_dict["updated_at"] = datetime.now(timezone.utc)
+    
+    # A client may only point its avatar at an uploaded file, which then
+    # gains a reference; the avatar it replaces loses one
+    avatar_changed = "avatar" in update_dict
+    if avatar_changed:
+        await retain_blobs(db, [update_dict["avatar"]] if update_dict["avatar"] else [])
     
-    await db.users.update_one(
+    previous = await db.users.find_one_and_update(
         {"id": current_user["id"]},
-        {"$set": update_dict}
+        {"$set": update_dict},
+        {"_id": 0, "avatar": 1},
+        return_document=ReturnDocument.BEFORE
     )
+    if avatar_changed:
+        await release_blobs(db, [(previous or {}).get("avatar")])
     
     user_doc = await db.users.find_one({"id": current_user["id"]}, {"_id": 0, "password_hash": 0})
+    response_cache.invalidate(f"user:{current_user['id']}")
     
-    # Convert datetime strings
-    if isinstance(user_doc.get("created_at"), str):
-        user_doc["created_at"] = datetime.fromisoformat(user_doc["created_at"])
-    if isinstance(user_doc.get("updated_at"), str):
-        user_doc["updated_at"] = datetime.fromisoformat(user_doc["updated_at"])
+    # Keep the summary embedded in the master's services in sync; it carries
+    # updated_at, which service ETags are derived from
+    if current_user["role"] == UserRole.MASTER.value:
+        await propagate_master_summary(db, current_user["id"], user_doc)
+        response_cache.invalidate("services")
+        suggest_index.add_master(user_doc)
     
-    return User(**user_doc)
+    return fast_response(shape(User, user_doc))
 
 @router.get("/{user_id}", response_model=UserPublic)
 async def get_user_profile(
     user_id: str,
+    request: Request,
+    response: Response,
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
+    key = cache_key(request)
+    cached = response_cache.get_with_etag(key)
+    if cached is not None:
+        return check_etag(request, response, cached[1]) or fast_response(cached[0], response=response)
+    
     # Публичный профиль - скрываем email и phone
     user_doc = await db.users.find_one(
         {"id": user_id},
@@ -65,8 +85,5 @@ async def get_user_profile(
     if not user_doc:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
     
-    # Convert datetime strings
-    if isinstance(user_doc.get("created_at"), str):
-        user_doc["created_at"] = datetime.fromisoformat(user_doc["created_at"])
-    
-    return UserPublic(**user_doc)
+    profile, etag = response_cache.set_with_etag(key, shape(UserPublic, user_doc), CACHE_TTLS["user"], [f"user:{user_id}"])
+    return check_etag(request, response, etag) or fast_response(profile, response=response)
@@ -1,4 +1,4 @@
-from fastapi import FastAPI, APIRouter
+from fastapi import FastAPI, APIRouter, Depends
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 import os
@@ -16,9 +16,27 @@ from routers import (
     orders_router,
     reviews_router,
     messages_router,
-    notifications_router
+    notifications_router,
+    realtime_router
 )
-from routers.upload import router as upload_router
+from routers.upload import router as upload_router, UPLOAD_BODY_LIMITS, UPLOAD_DIR
+from utils.indexes import ensure_indexes
+from utils.migrations import apply_data_migrations
+from utils.views import view_counter
+from utils.ratings import run_rating_reconciliation, RATING_RECONCILE_INTERVAL
+from utils.tasks import PeriodicTask
+from utils.jobs import job_queue
+from utils.notifications import notification_service
+from utils.realtime import event_bus
+from utils.cache import response_cache
+from utils.security import password_hasher
+from utils.uploads import UploadSizeLimitMiddleware
+from utils.images import image_variants
+from utils.blobs import collect_orphan_blobs, BLOB_GC_INTERVAL
+from utils.suggest import suggest_index, SUGGEST_REFRESH_INTERVAL
+from utils.totals import count_cache
+from utils.catalog import catalog_snapshot
+from utils.auth import revocations, token_cache, get_current_admin, AUTH_REVOCATION_SYNC_INTERVAL
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -42,6 +60,23 @@ async def health_check():
     except Exception as e:
         return {"status": "unhealthy", "error": str(e)}
 
+# In-process counters of caches and background workers, for admins only
+@api_router.get("/metrics", dependencies=[Depends(get_current_admin)])
+async def metrics():
+    return {
+        "cache": response_cache.get_stats(),
+        "views": view_counter.get_stats(),
+        "jobs": job_queue.get_stats(),
+        "notifications": notification_service.get_stats(),
+        "realtime": event_bus.get_stats(),
+        "passwords": password_hasher.get_stats(),
+        "auth": token_cache.get_stats(),
+        "images": image_variants.get_stats(),
+        "suggest": suggest_index.get_stats(),
+        "counts": count_cache.get_stats(),
+        "catalog": catalog_snapshot.get_stats()
+    }
+
 # Include all routers
 api_router.include_router(auth_router)
 api_router.include_router(users_router)
@@ -51,10 +86,13 @@ api_router.include_router(reviews_router)
 api_router.include_router(messages_router)
 api_router.include_router(notifications_router)
 api_router.include_router(upload_router)
+api_router.include_router(realtime_router)
 
 # Include the router in the main app
 app.include_router(api_router)
 
+app.add_middleware(UploadSizeLimitMiddleware, limits=UPLOAD_BODY_LIMITS)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -70,6 +108,79 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+rating_reconciler = PeriodicTask(
+    "rating-reconcile",
+    RATING_RECONCILE_INTERVAL,
+    lambda: run_rating_reconciliation(db)
+)
+
+revocation_sync = PeriodicTask(
+    "auth-revocation-sync",
+    AUTH_REVOCATION_SYNC_INTERVAL,
+    lambda: revocations.sync(db)
+)
+
+blob_gc = PeriodicTask(
+    "blob-gc",
+    BLOB_GC_INTERVAL,
+    lambda: collect_orphan_blobs(db, UPLOAD_DIR)
+)
+
+suggest_refresh = PeriodicTask(
+    "suggest-refresh",
+    SUGGEST_REFRESH_INTERVAL,
+    lambda: suggest_index.refresh(db)
+)
+
+@app.on_event("startup")
+async def create_indexes():
+    try:
+        drift = await ensure_indexes(db)
+        if drift:
+            logger.info("Index drift applied: %s", ", ".join(drift))
+    except Exception as e:
+        # Serving without indexes is slow but still correct
+        logger.error("Failed to apply indexes: %s", e)
+
+@app.on_event("startup")
+async def run_data_migrations():
+    # Runs before background tasks and requests read the backfilled fields
+    applied = await apply_data_migrations(db)
+    if applied:
+        logger.info("Data migrations applied: %s", ", ".join(applied))
+
+@app.on_event("startup")
+async def start_background_tasks():
+    try:
+        await revocations.sync(db)
+    except Exception as e:
+        logger.error("Failed to load revoked tokens: %s", e)
+    revocation_sync.start()
+    try:
+        await suggest_index.build(db)
+    except Exception as e:
+        logger.error("Failed to build suggest index: %s", e)
+    suggest_refresh.start()
+    catalog_snapshot.start(db)
+    await event_bus.start(db)
+    job_queue.start(db)
+    notification_service.start(db)
+    view_counter.start(db)
+    rating_reconciler.start()
+    blob_gc.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    # Let running jobs finish and flush buffered state before the connection goes away
+    await job_queue.drain()
+    await notification_service.stop()
+    await event_bus.stop()
+    password_hasher.shutdown()
+    image_variants.shutdown()
+    await view_counter.stop()
+    await rating_reconciler.stop()
+    await blob_gc.stop()
+    await suggest_refresh.stop()
+    await catalog_snapshot.stop()
+    await revocation_sync.stop()
     client.close()
\ No newline at end of file
@@ -14,7 +14,7 @@ async def update_admin_password():
         {"email": "developer@handycraft.com"},
         {"$set": {
             "password_hash": hash_password("admin"),
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            "updated_at": datetime.now(timezone.utc)
         }}
     )
     
@@ -1,10 +1,14 @@
-from .auth import create_access_token, verify_token, get_current_user
-from .security import hash_password, verify_password
+from .auth import create_access_token, verify_token, get_current_user, get_current_admin, revocations, token_cache
+from .security import hash_password, verify_password, password_hasher
 
 __all__ = [
     "create_access_token",
     "verify_token",
     "get_current_user",
+    "get_current_admin",
+    "revocations",
+    "token_cache",
     "hash_password",
-    "verify_password"
+    "verify_password",
+    "password_hasher"
 ]
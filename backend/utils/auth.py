@@ -2,23 +2,35 @@ from datetime import datetime, timedelta, timezone
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from collections import OrderedDict
 from typing import Optional
+import hashlib
 import os
+import time
 
 SECRET_KEY = os.environ.get("JWT_SECRET", "your-secret-key-change-in-production")
 ALGORITHM = os.environ.get("JWT_ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get("JWT_EXPIRATION", "1440"))  # 24 hours
+AUTH_TOKEN_CACHE_SIZE = int(os.environ.get("AUTH_TOKEN_CACHE_SIZE", "10000"))
+AUTH_REVOCATION_SYNC_INTERVAL = float(os.environ.get("AUTH_REVOCATION_SYNC_INTERVAL", "5"))
+# How far back each sync re-reads: an entry stamped before a later one can
+# commit after it, so a strict created_at watermark would skip it
+AUTH_REVOCATION_SYNC_OVERLAP = float(os.environ.get("AUTH_REVOCATION_SYNC_OVERLAP", "60"))
 
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
+    now = datetime.now(timezone.utc)
     if expires_delta:
-        expire = datetime.now(timezone.utc) + expires_delta
+        expire = now + expires_delta
     else:
-        expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    
-    to_encode.update({"exp": expire})
+        expire = now + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+
+    # iat lets revoke_user() invalidate every token issued before it
+    to_encode.update({"exp": expire, "iat": now})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
@@ -33,9 +45,136 @@ def verify_token(token: str) -> dict:
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+def token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class TokenRevocations:
+    # Denylist kept in the "revoked_tokens" collection and mirrored in every
+    # process: single tokens (logout) by digest, and whole users (role or
+    # password changes) by a cut-off that rejects tokens issued earlier.
+    # Entries expire with the longest-lived token they can affect. Other
+    # workers pick new entries up within AUTH_REVOCATION_SYNC_INTERVAL.
+
+    def __init__(self):
+        self._tokens = {}
+        self._users = {}
+        self._synced_at = None
+        self._seen = {}
+
+    def is_revoked(self, digest: str, claims: dict) -> bool:
+        if digest in self._tokens:
+            return True
+        # iat has second resolution: a token issued in the same second as the
+        # revocation is rejected too, never the other way round
+        revoked = self._users.get(claims.get("sub"))
+        return revoked is not None and claims.get("iat", 0) <= int(revoked[0])
+
+    def _apply(self, doc: dict):
+        expires_at = doc["expires_at"].timestamp()
+        if doc["kind"] == "token":
+            self._tokens[doc["digest"]] = expires_at
+        else:
+            revoked_before, _ = self._users.get(doc["user_id"], (0, 0))
+            self._users[doc["user_id"]] = (max(revoked_before, doc["revoked_before"].timestamp()), expires_at)
+
+    async def _record(self, db: AsyncIOMotorDatabase, doc: dict):
+        now = datetime.now(timezone.utc)
+        doc["created_at"] = now
+        await db.revoked_tokens.insert_one(doc)
+        self._seen[doc["_id"]] = now
+        self._apply(doc)
+
+    async def revoke_token(self, db: AsyncIOMotorDatabase, token: str, claims: dict):
+        await self._record(db, {
+            "kind": "token",
+            "digest": token_digest(token),
+            "expires_at": datetime.fromtimestamp(claims["exp"], timezone.utc)
+        })
+
+    async def revoke_user(self, db: AsyncIOMotorDatabase, user_id: str):
+        now = datetime.now(timezone.utc)
+        await self._record(db, {
+            "kind": "user",
+            "user_id": user_id,
+            "revoked_before": now,
+            "expires_at": now + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        })
+
+    async def sync(self, db: AsyncIOMotorDatabase):
+        query = {}
+        if self._synced_at:
+            window_start = self._synced_at - timedelta(seconds=AUTH_REVOCATION_SYNC_OVERLAP)
+            query = {"created_at": {"$gte": window_start}}
+            # Entries read by an earlier sync are skipped by _id
+            self._seen = {key: created_at for key, created_at in self._seen.items() if created_at >= window_start}
+        async for doc in db.revoked_tokens.find(query).sort("created_at", 1):
+            if doc["_id"] in self._seen:
+                continue
+            self._seen[doc["_id"]] = doc["created_at"]
+            self._apply(doc)
+            self._synced_at = max(self._synced_at or doc["created_at"], doc["created_at"])
+
+        # Expired entries can no longer match a valid token
+        now = time.time()
+        self._tokens = {digest: exp for digest, exp in self._tokens.items() if exp > now}
+        self._users = {user_id: entry for user_id, entry in self._users.items() if entry[1] > now}
+
+
+class TokenCache:
+    # LRU of verified tokens keyed by digest, holding the decoded claims until
+    # the token's exp. A hit skips signature verification and JSON decoding;
+    # revocation is still checked on every request, so it needs no eviction.
+
+    def __init__(self, max_entries: int = AUTH_TOKEN_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "revoked": 0}
+
+    def verify(self, token: str) -> dict:
+        digest = token_digest(token)
+        entry = self._entries.get(digest)
+        if entry is not None and entry[1] > time.time():
+            self._entries.move_to_end(digest)
+            self.stats["hits"] += 1
+            claims = entry[0]
+        else:
+            if entry is not None:
+                del self._entries[digest]
+            self.stats["misses"] += 1
+            claims = verify_token(token)
+            self._entries[digest] = (claims, claims.get("exp", 0))
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+        if revocations.is_revoked(digest, claims):
+            self.stats["revoked"] += 1
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Token has been revoked",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        return claims
+
+    def clear(self):
+        self._entries.clear()
+
+    def get_stats(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else 0.0,
+            "entries": len(self._entries),
+        }
+
+
+revocations = TokenRevocations()
+token_cache = TokenCache()
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
     token = credentials.credentials
-    payload = verify_token(token)
+    payload = token_cache.verify(token)
     user_id: str = payload.get("sub")
     if user_id is None:
         raise HTTPException(
@@ -43,3 +182,8 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             detail="Could not validate credentials"
         )
     return {"id": user_id, "email": payload.get("email"), "role": payload.get("role")}
+
+async def get_current_admin(current_user: dict = Depends(get_current_user)) -> dict:
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return current_user
@@ -0,0 +1,202 @@
+from fastapi import HTTPException, status
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from collections import Counter
+from typing import Iterable, Optional
+import anyio
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+BLOB_GC_INTERVAL = float(os.environ.get("BLOB_GC_INTERVAL", "3600"))
+# Unreferenced blobs are kept this long, so an upload racing its own
+# database write is never collected
+BLOB_GC_GRACE = float(os.environ.get("BLOB_GC_GRACE", "86400"))
+BLOB_GC_BATCH = int(os.environ.get("BLOB_GC_BATCH", "200"))
+
+# Content-addressed URLs never change meaning, so clients may keep them forever
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+URL_PREFIX = "/api/upload/"
+BLOB_KINDS = ("avatars", "services")
+_HASH_NAME = re.compile(r"^[0-9a-f]{64}\.[a-z]+$")
+
+
+def is_content_addressed(filename: str) -> bool:
+    return bool(_HASH_NAME.match(filename))
+
+
+# "/api/upload/avatars/<sha256>.png" -> "avatars/<sha256>.png"
+def blob_id(url: Optional[str]) -> Optional[str]:
+    if not url or not url.startswith(URL_PREFIX):
+        return None
+    key = url[len(URL_PREFIX):]
+    kind, _, filename = key.partition("/")
+    if kind not in BLOB_KINDS or not filename or "/" in filename:
+        return None
+    return key
+
+
+# One reference per users.avatar / services.images entry. Taken before the
+# file is moved into place, so the collector never removes a file that an
+# upload is about to point at.
+async def acquire_blob(db: AsyncIOMotorDatabase, key: str, size: int):
+    update = {
+        "$inc": {"refs": 1},
+        "$setOnInsert": {"size": size, "created_at": datetime.now(timezone.utc)},
+        "$unset": {"orphaned_at": ""}
+    }
+    try:
+        await db.blobs.update_one({"_id": key}, update, upsert=True)
+    except DuplicateKeyError:
+        # Lost an upsert race for the same content; the document exists now
+        await db.blobs.update_one({"_id": key}, update)
+
+
+async def release_blobs(db: AsyncIOMotorDatabase, urls: Iterable[str]):
+    keys = [key for key in map(blob_id, urls) if key]
+    if not keys:
+        return
+    await db.blobs.bulk_write([UpdateOne({"_id": key}, {"$inc": {"refs": -1}}) for key in keys], ordered=False)
+    await db.blobs.update_many(
+        {"_id": {"$in": keys}, "refs": {"$lte": 0}, "orphaned_at": {"$exists": False}},
+        {"$set": {"orphaned_at": datetime.now(timezone.utc)}}
+    )
+
+
+# References for blob URLs a client writes back itself (service images and
+# avatars set through PUT). Only blobs the upload endpoints created can be
+# referenced; anything else under /api/upload/ is rejected so no document
+# points at a file the collector does not know about.
+async def retain_blobs(db: AsyncIOMotorDatabase, urls: Iterable[str]):
+    counts = Counter(key for key in map(blob_id, urls) if key)
+    if not counts:
+        return
+    result = await db.blobs.bulk_write([
+        UpdateOne({"_id": key}, {"$inc": {"refs": n}, "$unset": {"orphaned_at": ""}}) for key, n in counts.items()
+    ], ordered=False)
+    if result.matched_count < len(counts):
+        known = {doc["_id"] async for doc in db.blobs.find({"_id": {"$in": list(counts)}}, {"_id": 1})}
+        await release_blobs(db, [URL_PREFIX + key for key in counts.elements() if key in known])
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unknown uploaded file")
+
+
+# (added, removed) between two lists of blob URLs, as multisets since a
+# service may list the same image twice
+def blob_changes(old: Iterable[str], new: Iterable[str]):
+    old, new = Counter(old or ()), Counter(new or ())
+    return list((new - old).elements()), list((old - new).elements())
+
+
+async def count_references(db: AsyncIOMotorDatabase, key: str) -> int:
+    url = URL_PREFIX + key
+    if key.startswith("avatars/"):
+        return await db.users.count_documents({"avatar": url})
+    pipeline = [
+        {"$match": {"images": url}},
+        {"$project": {"n": {"$size": {"$filter": {"input": "$images", "cond": {"$eq": ["$$this", url]}}}}}},
+        {"$group": {"_id": None, "n": {"$sum": "$n"}}}
+    ]
+    rows = await db.services.aggregate(pipeline).to_list(1)
+    return rows[0]["n"] if rows else 0
+
+
+def _rename(source: Path, target: Path) -> bool:
+    try:
+        os.replace(source, target)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+async def collect_orphan_blobs(db: AsyncIOMotorDatabase, root: Path, grace: float = BLOB_GC_GRACE,
+                               batch_size: int = BLOB_GC_BATCH) -> int:
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=grace)
+    query = {"refs": {"$lte": 0}, "orphaned_at": {"$lte": cutoff}}
+    removed = 0
+    while True:
+        batch = await db.blobs.find(query, {"_id": 1}).limit(batch_size).to_list(batch_size)
+        for doc in batch:
+            key = doc["_id"]
+            # Counts can drift low (a crash between a write and its release);
+            # a blob that is still referenced gets its count repaired instead
+            references = await count_references(db, key)
+            if references:
+                await db.blobs.update_one({"_id": key}, {"$set": {"refs": references}, "$unset": {"orphaned_at": ""}})
+                logger.warning("Blob %s had a stale refcount, repaired to %d", key, references)
+                continue
+
+            # Move the file aside first: if an upload acquires the blob before
+            # the document is gone, the file is put back where it was
+            path = root / key
+            tombstone = path.with_name(f".{path.name}.gc")
+            moved = await anyio.to_thread.run_sync(_rename, path, tombstone)
+            result = await db.blobs.delete_one({"_id": key, "refs": {"$lte": 0}})
+            if not moved:
+                continue
+            if result.deleted_count:
+                await anyio.to_thread.run_sync(os.remove, tombstone)
+                removed += 1
+            else:
+                await anyio.to_thread.run_sync(_rename, tombstone, path)
+
+        if len(batch) < batch_size:
+            break
+    if removed:
+        logger.info("Collected %d orphaned blobs", removed)
+    return removed
+
+
+# Recompute every refcount from users and services, and register files on
+# disk that have no blob document (uploads from before content addressing)
+# as orphans, so the collector picks them up after the grace period.
+async def rebuild_blob_refs(db: AsyncIOMotorDatabase, root: Path, batch_size: int = 500) -> dict:
+    refs = {}
+    async for user in db.users.find({"avatar": {"$ne": None}}, {"_id": 0, "avatar": 1}):
+        key = blob_id(user["avatar"])
+        if key:
+            refs[key] = refs.get(key, 0) + 1
+    async for service in db.services.find({"images.0": {"$exists": True}}, {"_id": 0, "images": 1}):
+        for url in service["images"]:
+            key = blob_id(url)
+            if key:
+                refs[key] = refs.get(key, 0) + 1
+
+    def list_files():
+        files = {}
+        for kind in BLOB_KINDS:
+            directory = root / kind
+            if directory.is_dir():
+                for entry in os.scandir(directory):
+                    if entry.is_file() and not entry.name.startswith("."):
+                        files[f"{kind}/{entry.name}"] = entry.stat().st_size
+        return files
+
+    files = await anyio.to_thread.run_sync(list_files)
+    known = {doc["_id"] async for doc in db.blobs.find({}, {"_id": 1})}
+    now = datetime.now(timezone.utc)
+
+    operations, report = [], {"referenced": 0, "orphaned": 0, "missing_files": 0}
+    for key in known | set(files) | set(refs):
+        count = refs.get(key, 0)
+        update = {"$set": {"refs": count}, "$setOnInsert": {"size": files.get(key, 0), "created_at": now}}
+        if count:
+            update["$unset"] = {"orphaned_at": ""}
+            report["referenced"] += 1
+            if key not in files:
+                report["missing_files"] += 1
+        else:
+            update["$min"] = {"orphaned_at": now}
+            report["orphaned"] += 1
+        operations.append(UpdateOne({"_id": key}, update, upsert=True))
+        if len(operations) >= batch_size:
+            await db.blobs.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        await db.blobs.bulk_write(operations, ordered=False)
+    return report
@@ -0,0 +1,144 @@
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from collections import OrderedDict
+from typing import Iterable, Optional
+from urllib.parse import urlencode
+import json
+import os
+import time
+
+from utils.etag import etag_for
+
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Seconds a cached response stays valid, per route. Writes in this process
+# invalidate entries right away; the TTL bounds staleness for writes made
+# by other workers.
+CACHE_TTLS = {
+    "services": float(os.environ.get("CACHE_TTL_SERVICES", "30")),
+    "service": float(os.environ.get("CACHE_TTL_SERVICE", "60")),
+    "master_services": float(os.environ.get("CACHE_TTL_MASTER_SERVICES", "60")),
+    "user": float(os.environ.get("CACHE_TTL_USER", "120")),
+    "service_reviews": float(os.environ.get("CACHE_TTL_SERVICE_REVIEWS", "60")),
+}
+
+
+def cache_key(request: Request) -> str:
+    # Path plus sorted query string, so ?a=1&b=2 and ?b=2&a=1 share an entry
+    params = sorted(request.query_params.multi_items())
+    return f"{request.url.path}?{urlencode(params)}"
+
+
+class ResponseCache:
+    # Read-through cache for anonymous GET responses. Entries are kept in
+    # LRU order and bounded by their JSON-encoded size; each entry carries
+    # tags ("service:<id>", "user:<id>", ...) that write endpoints invalidate.
+    # Cached values are shared between requests and must not be mutated.
+    # Entries stored with set_with_etag keep their ETag, so a hit is served
+    # without hashing the body again.
+
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._tags = {}
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "invalidations": 0}
+
+    def get(self, key: str):
+        entry = self._lookup(key)
+        return entry[0] if entry is not None else None
+
+    def get_with_etag(self, key: str) -> Optional[tuple]:
+        # (value, etag) for entries stored with set_with_etag
+        entry = self._lookup(key)
+        return (entry[0], entry[4]) if entry is not None else None
+
+    def _lookup(self, key: str) -> Optional[tuple]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+
+        if entry[1] <= time.monotonic():
+            self._remove(key)
+            self.stats["expired"] += 1
+            self.stats["misses"] += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return entry
+
+    def set(self, key: str, value, ttl: float, tags: Iterable[str] = ()):
+        return self._store(key, jsonable_encoder(value), ttl, tags, None)
+
+    def set_with_etag(self, key: str, value, ttl: float, tags: Iterable[str] = ()) -> tuple:
+        # Hashes the body once here; returns (value, etag) like get_with_etag
+        value = jsonable_encoder(value)
+        etag = etag_for(value)
+        return self._store(key, value, ttl, tags, etag), etag
+
+    def _store(self, key: str, value, ttl: float, tags: Iterable[str], etag: Optional[str]):
+        size = len(key) + len(json.dumps(value, ensure_ascii=False, separators=(",", ":")))
+        if size > self.max_bytes:
+            return value
+
+        if key in self._entries:
+            self._remove(key)
+        tags = tuple(tags)
+        self._entries[key] = (value, time.monotonic() + ttl, size, tags, etag)
+        self.bytes += size
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+
+        while self.bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.stats["evictions"] += 1
+        return value
+
+    def invalidate(self, *tags: str) -> int:
+        removed = 0
+        for tag in tags:
+            for key in list(self._tags.get(tag, ())):
+                self._remove(key)
+                removed += 1
+        self.stats["invalidations"] += removed
+        return removed
+
+    def clear(self):
+        self._entries.clear()
+        self._tags.clear()
+        self.bytes = 0
+
+    def _remove(self, key: str):
+        value, expires_at, size, tags, etag = self._entries.pop(key)
+        self.bytes -= size
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def get_stats(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else 0.0,
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+response_cache = ResponseCache()
+
+
+# Tags a catalog change touches: list pages, the service itself and the
+# master's service list
+def service_tags(service_id: Optional[str], master_id: str) -> list:
+    tags = ["services", f"master_services:{master_id}"]
+    if service_id:
+        tags.append(f"service:{service_id}")
+    return tags
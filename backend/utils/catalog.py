@@ -0,0 +1,365 @@
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import OperationFailure, PyMongoError
+from datetime import datetime, timezone, timedelta
+from typing import Optional
+import asyncio
+import logging
+import numpy as np
+import os
+import time
+
+from models.service import ServiceCategory
+from utils.pagination import decode_cursor, next_cursor
+
+logger = logging.getLogger(__name__)
+
+CATALOG_SNAPSHOT = os.environ.get("CATALOG_SNAPSHOT", "0").lower() in ("1", "true", "yes")
+# auto tries a change stream and falls back to polling when the server is
+# not a replica set; poll skips the change stream altogether
+CATALOG_SYNC = os.environ.get("CATALOG_SYNC", "auto")
+CATALOG_POLL_INTERVAL = float(os.environ.get("CATALOG_POLL_INTERVAL", "5"))
+# Polling only sees writes that bump updated_at; view, order and rating
+# counters and hard deletes by other workers wait for a full rebuild
+CATALOG_REBUILD_INTERVAL = float(os.environ.get("CATALOG_REBUILD_INTERVAL", "600"))
+CATALOG_CHANGE_BATCH = 500
+
+CATEGORY_CODES = {category.value: code for code, category in enumerate(ServiceCategory)}
+# Catalog sort fields and the column each one reads
+SORT_COLUMNS = {"price": "price", "created_at": "created_at", "master.rating": "rating"}
+# Columns a write can change; id and the row it maps to never do
+VALUE_COLUMNS = ("price", "category", "created_at", "rating", "views", "orders_count")
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def _micros(value) -> float:
+    # Timestamps as float microseconds: exact for any realistic date and
+    # NaN-able like the other sortable columns
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return np.nan
+    if not isinstance(value, datetime):
+        return np.nan
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return float((value - EPOCH) // MICROSECOND)
+
+
+def _number(value) -> float:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return np.nan
+    return float(value)
+
+
+def _bson_datetimes(doc: dict) -> dict:
+    # BSON dates keep milliseconds; trimming in-process writes the same way
+    # keeps cursors interchangeable with the ones Mongo pages produce
+    return {
+        key: value.replace(microsecond=value.microsecond // 1000 * 1000) if isinstance(value, datetime) else value
+        for key, value in doc.items()
+    }
+
+
+def _columns(docs: list) -> dict:
+    return {
+        # UTF-8 bytes order like Mongo compares strings, at a quarter of the size of str
+        "id": np.array([doc["id"].encode() for doc in docs], dtype=bytes),
+        "price": np.array([_number(doc.get("price")) for doc in docs], dtype=np.float64),
+        "category": np.array([CATEGORY_CODES.get(doc.get("category"), -1) for doc in docs], dtype=np.int16),
+        "created_at": np.array([_micros(doc.get("created_at")) for doc in docs], dtype=np.float64),
+        "rating": np.array([_number((doc.get("master") or {}).get("rating")) for doc in docs], dtype=np.float64),
+        "views": np.array([doc.get("views") or 0 for doc in docs], dtype=np.int64),
+        "orders_count": np.array([doc.get("orders_count") or 0 for doc in docs], dtype=np.int64),
+    }
+
+
+class CatalogSnapshot:
+    # Opt-in in-process copy of the active catalog for GET /services. Each
+    # filterable or sortable field is a NumPy column with one row per
+    # service, so a listing is a few vectorized comparisons for the filter
+    # and a lexsort of the matching rows, with id breaking ties the same way
+    # the Mongo sort does. The documents themselves are kept alongside to
+    # build the page. Updates overwrite rows in place; removed services leave
+    # a dead row until the next compaction. Text search and facets stay on
+    # Mongo. Kept current from a change stream, or by polling updated_at on
+    # servers without one.
+
+    def __init__(self, enabled: bool = CATALOG_SNAPSHOT):
+        self.enabled = enabled
+        self.mode = None
+        self._task = None
+        self._synced_at = None
+        self._built_at = 0.0
+        self._oids = {}
+        self.load([])
+        self.ready = False
+        self.stats = {
+            "queries": 0, "fallbacks": 0, "changes": 0, "rebuilds": 0, "compactions": 0, "query_us_total": 0.0
+        }
+
+    def load(self, docs: list):
+        # Replaces the snapshot with the given active service documents
+        self._docs = list(docs)
+        self._rows = {doc["id"]: row for row, doc in enumerate(self._docs)}
+        self._cols = _columns(self._docs)
+        self._alive = np.ones(len(self._docs), dtype=bool)
+        self._rerank()
+        self.ready = True
+
+    def _rerank(self):
+        # Position of each id in sorted order, so lexsort can break ties on
+        # id in either direction by negating it
+        ids = self._cols["id"]
+        self._rank = np.empty(len(ids), dtype=np.int64)
+        self._rank[np.argsort(ids, kind="stable")] = np.arange(len(ids))
+
+    def _apply(self, docs: list = (), removed: list = ()):
+        latest, removed = {}, list(removed)
+        for doc in docs:
+            if doc.get("is_active", True):
+                latest[doc["id"]] = doc
+            else:
+                removed.append(doc["id"])
+                latest.pop(doc["id"], None)
+
+        for service_id in removed:
+            row = self._rows.pop(service_id, None)
+            if row is not None:
+                self._alive[row] = False
+                self._docs[row] = None
+
+        existing = [doc for service_id, doc in latest.items() if service_id in self._rows]
+        if existing:
+            rows = np.array([self._rows[doc["id"]] for doc in existing], dtype=np.int64)
+            columns = _columns(existing)
+            for name in VALUE_COLUMNS:
+                self._cols[name][rows] = columns[name]
+            for row, doc in zip(rows.tolist(), existing):
+                self._docs[row] = doc
+
+        added = [doc for service_id, doc in latest.items() if service_id not in self._rows]
+        if added:
+            start = len(self._docs)
+            columns = _columns(added)
+            self._cols = {name: np.concatenate([self._cols[name], columns[name]]) for name in self._cols}
+            self._alive = np.concatenate([self._alive, np.ones(len(added), dtype=bool)])
+            self._docs.extend(added)
+            self._rows.update((doc["id"], start + i) for i, doc in enumerate(added))
+            self._rerank()
+
+        self.stats["changes"] += len(latest) + len(removed)
+        dead = len(self._docs) - len(self._rows)
+        if dead > 1000 and dead > len(self._rows):
+            self.load([doc for doc in self._docs if doc is not None])
+            self.stats["compactions"] += 1
+
+    def upsert(self, service: dict):
+        # Applies a write made by this worker right away instead of waiting
+        # for the change stream or the next poll
+        if not self.ready:
+            return
+        service = _bson_datetimes(service)
+        oid = service.pop("_id", None)
+        if oid is not None:
+            self._oids[oid] = service["id"]
+        self._apply([service])
+
+    def remove(self, service_id: str):
+        if self.ready:
+            self._apply(removed=[service_id])
+
+    def query(
+        self,
+        category: Optional[str],
+        min_price: Optional[float],
+        max_price: Optional[float],
+        sort_field: str,
+        sort_direction: int,
+        skip: int = 0,
+        limit: int = 20,
+        cursor: Optional[str] = None,
+        peek: bool = False
+    ):
+        # Same contract as counting plus find_page on the Mongo side: returns
+        # (total, page, next cursor), or None when the caller has to fall
+        # back to Mongo
+        if not self.ready or sort_field not in SORT_COLUMNS:
+            return None
+        started = time.perf_counter()
+        cols = self._cols
+        key = cols[SORT_COLUMNS[sort_field]]
+
+        mask = self._alive.copy()
+        if category:
+            mask &= cols["category"] == CATEGORY_CODES.get(category, -2)
+        if min_price is not None:
+            mask &= cols["price"] >= min_price
+        if max_price is not None:
+            mask &= cols["price"] <= max_price
+        total = int(np.count_nonzero(mask))
+
+        if cursor:
+            value, last_id = decode_cursor(cursor)
+            last_id = str(last_id).encode()
+            value = _micros(value) if sort_field == "created_at" else _number(value)
+            if np.isnan(value):
+                # Cursors past the services missing this field are rare; Mongo handles them
+                self.stats["fallbacks"] += 1
+                return None
+            if sort_direction < 0:
+                # Missing values sort last descending, so they all come after the cursor
+                mask &= (key < value) | np.isnan(key) | ((key == value) & (cols["id"] < last_id))
+            else:
+                mask &= (key > value) | ((key == value) & (cols["id"] > last_id))
+            skip = 0
+
+        rows = np.flatnonzero(mask)
+        # Keys and ranks are flipped for descending sorts so one ascending
+        # lexsort serves both; missing values sort first ascending and last
+        # descending, as in Mongo
+        keys = np.where(np.isnan(key[rows]), -np.inf, key[rows]) * sort_direction
+        ranks = self._rank[rows] * sort_direction
+        fetch = limit + 1 if peek and limit > 0 else limit
+        window = skip + fetch if fetch > 0 else len(rows)
+        if window < len(rows):
+            # Only the rows that can reach the page get sorted: everything up
+            # to the window's last key, ties included so id can order them
+            kth = np.partition(keys, window - 1)[window - 1]
+            candidates = np.flatnonzero(keys <= kth)
+            rows, keys, ranks = rows[candidates], keys[candidates], ranks[candidates]
+        order = np.lexsort((ranks, keys))[skip:skip + fetch if fetch > 0 else None]
+        items = [dict(self._docs[row]) for row in rows[order].tolist()]
+
+        if fetch > limit:
+            cursor_next = next_cursor(items[:limit], sort_field, limit) if len(items) > limit else None
+            items = items[:limit]
+        else:
+            cursor_next = next_cursor(items, sort_field, limit)
+
+        self.stats["queries"] += 1
+        self.stats["query_us_total"] += (time.perf_counter() - started) * 1e6
+        return total, items, cursor_next
+
+    async def build(self, db: AsyncIOMotorDatabase):
+        # Read off to the side and swapped in whole
+        synced_at = datetime.now(timezone.utc)
+        docs, oids = [], {}
+        async for service in db.services.find({"is_active": True}):
+            oids[service.pop("_id")] = service["id"]
+            docs.append(service)
+            if len(docs) % 2000 == 0:
+                await asyncio.sleep(0)
+        self.load(docs)
+        self._oids = oids
+        self._synced_at = synced_at
+        self._built_at = time.monotonic()
+        self.stats["rebuilds"] += 1
+
+    async def refresh(self, db: AsyncIOMotorDatabase):
+        if self._synced_at is None or time.monotonic() - self._built_at > CATALOG_REBUILD_INTERVAL:
+            await self.build(db)
+            return
+        synced_at = datetime.now(timezone.utc)
+        changed = []
+        async for service in db.services.find({"updated_at": {"$gt": self._synced_at}}):
+            self._oids[service.pop("_id")] = service["id"]
+            changed.append(service)
+        if changed:
+            self._apply(changed)
+        self._synced_at = synced_at
+
+    def _apply_changes(self, changes: list):
+        docs, removed = [], []
+        for change in changes:
+            operation = change["operationType"]
+            oid = change.get("documentKey", {}).get("_id")
+            if operation in ("insert", "update", "replace") and change.get("fullDocument"):
+                doc = change["fullDocument"]
+                self._oids[doc.pop("_id")] = doc["id"]
+                docs.append(doc)
+            elif operation in ("insert", "update", "replace", "delete") and oid in self._oids:
+                # Deleted, or gone again before the lookup ran
+                removed.append(self._oids.pop(oid))
+        self._apply(docs, removed)
+
+    async def _watch(self, db: AsyncIOMotorDatabase):
+        # The stream is opened before the build, so writes made while
+        # loading arrive as changes afterwards instead of being missed
+        async with db.services.watch(full_document="updateLookup") as stream:
+            await self.build(db)
+            self.mode = "stream"
+            async for change in stream:
+                if change["operationType"] in ("drop", "rename", "invalidate"):
+                    return
+                changes = [change]
+                while len(changes) < CATALOG_CHANGE_BATCH:
+                    change = await stream.try_next()
+                    if change is None:
+                        break
+                    changes.append(change)
+                self._apply_changes(changes)
+
+    async def _poll(self, db: AsyncIOMotorDatabase):
+        self.mode = "poll"
+        while True:
+            try:
+                await self.refresh(db)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Catalog snapshot refresh failed")
+            await asyncio.sleep(CATALOG_POLL_INTERVAL)
+
+    async def _sync(self, db: AsyncIOMotorDatabase):
+        while CATALOG_SYNC != "poll":
+            try:
+                await self._watch(db)
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                # Standalone servers have no change streams
+                logger.info("Catalog change stream unavailable (%s), polling every %ss", e, CATALOG_POLL_INTERVAL)
+                break
+            except PyMongoError:
+                logger.exception("Catalog change stream failed, reopening")
+                self.ready = False
+                await asyncio.sleep(1)
+        await self._poll(db)
+
+    def start(self, db: AsyncIOMotorDatabase):
+        # Queries fall back to Mongo until the first build has finished
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._sync(db), name="catalog-sync")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def get_stats(self) -> dict:
+        queries = self.stats["queries"] or 1
+        column_bytes = sum(column.nbytes for column in self._cols.values()) + self._alive.nbytes + self._rank.nbytes
+        return {
+            "enabled": self.enabled,
+            "ready": self.ready,
+            "mode": self.mode,
+            "rows": len(self._rows),
+            "dead_rows": len(self._docs) - len(self._rows),
+            "column_bytes": column_bytes,
+            "queries": self.stats["queries"],
+            "avg_query_us": round(self.stats["query_us_total"] / queries, 1),
+            "fallbacks": self.stats["fallbacks"],
+            "changes": self.stats["changes"],
+            "rebuilds": self.stats["rebuilds"],
+            "compactions": self.stats["compactions"],
+        }
+
+
+catalog_snapshot = CatalogSnapshot()
@@ -0,0 +1,110 @@
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+
+# One document per user in "counters" holding what the frontend polls:
+#   notifications_total, notifications_unread,
+#   messages_unread (all chats) and chats_unread.<order_id>.
+# Writers keep them in step with atomic $inc; rebuild_counters recomputes
+# them from the source collections if they ever drift.
+COUNTER_DEFAULTS = {
+    "notifications_total": 0,
+    "notifications_unread": 0,
+    "messages_unread": 0,
+    "chats_unread": {},
+}
+
+
+async def get_counters(db: AsyncIOMotorDatabase, user_id: str) -> dict:
+    doc = await db.counters.find_one({"user_id": user_id}, {"_id": 0, "user_id": 0})
+    counters = {**COUNTER_DEFAULTS, **(doc or {})}
+    # A read of something counted before the counters existed takes them
+    # below zero until the next rebuild; never show that
+    for field in ("notifications_total", "notifications_unread", "messages_unread"):
+        counters[field] = max(counters[field], 0)
+    counters["chats_unread"] = {order_id: count for order_id, count in counters["chats_unread"].items() if count > 0}
+    return counters
+
+
+# deltas: {user_id: (total, unread)}
+async def add_notifications(db: AsyncIOMotorDatabase, deltas: dict):
+    operations = [
+        UpdateOne(
+            {"user_id": user_id},
+            {"$inc": {"notifications_total": total, "notifications_unread": unread}},
+            upsert=True
+        )
+        for user_id, (total, unread) in deltas.items() if total or unread
+    ]
+    if operations:
+        await db.counters.bulk_write(operations, ordered=False)
+
+
+async def read_notifications(db: AsyncIOMotorDatabase, user_id: str, count: int):
+    if count:
+        await db.counters.update_one({"user_id": user_id}, {"$inc": {"notifications_unread": -count}}, upsert=True)
+
+
+async def add_message(db: AsyncIOMotorDatabase, receiver_id: str, order_id: str):
+    await db.counters.update_one(
+        {"user_id": receiver_id},
+        {"$inc": {"messages_unread": 1, f"chats_unread.{order_id}": 1}},
+        upsert=True
+    )
+
+
+async def read_messages(db: AsyncIOMotorDatabase, user_id: str, order_id: str, count: int):
+    if count:
+        await db.counters.update_one(
+            {"user_id": user_id},
+            {"$inc": {"messages_unread": -count, f"chats_unread.{order_id}": -count}},
+            upsert=True
+        )
+        # Drop fully read chats so the map only grows with active ones
+        await db.counters.update_one(
+            {"user_id": user_id, f"chats_unread.{order_id}": {"$lte": 0}},
+            {"$unset": {f"chats_unread.{order_id}": ""}}
+        )
+
+
+# Recompute every counter document from notifications and messages
+async def rebuild_counters(db: AsyncIOMotorDatabase, batch_size: int = 500, progress=None) -> int:
+    counters = {}
+
+    def counter(user_id):
+        return counters.setdefault(user_id, {**COUNTER_DEFAULTS, "chats_unread": {}})
+
+    pipeline = [{"$group": {
+        "_id": "$user_id",
+        "total": {"$sum": 1},
+        "unread": {"$sum": {"$cond": [{"$eq": ["$is_read", False]}, 1, 0]}}
+    }}]
+    async for row in db.notifications.aggregate(pipeline):
+        counter(row["_id"]).update(notifications_total=row["total"], notifications_unread=row["unread"])
+
+    pipeline = [
+        {"$match": {"is_read": False}},
+        {"$group": {"_id": {"user_id": "$receiver_id", "order_id": "$order_id"}, "count": {"$sum": 1}}}
+    ]
+    async for row in db.messages.aggregate(pipeline):
+        doc = counter(row["_id"]["user_id"])
+        doc["chats_unread"][row["_id"]["order_id"]] = row["count"]
+        doc["messages_unread"] += row["count"]
+
+    # Users whose counters are stale but have nothing left get reset
+    async for doc in db.counters.find({"user_id": {"$nin": list(counters)}}, {"_id": 0, "user_id": 1}):
+        counter(doc["user_id"])
+
+    written, operations = 0, []
+    for user_id, doc in counters.items():
+        operations.append(UpdateOne({"user_id": user_id}, {"$set": doc}, upsert=True))
+        if len(operations) >= batch_size:
+            await db.counters.bulk_write(operations, ordered=False)
+            written += len(operations)
+            operations = []
+            if progress:
+                progress(written)
+    if operations:
+        await db.counters.bulk_write(operations, ordered=False)
+        written += len(operations)
+
+    return written
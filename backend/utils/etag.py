@@ -0,0 +1,35 @@
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from typing import Optional
+import hashlib
+import json
+
+# Clients must revalidate, but a matching ETag costs a 304 with no body
+CACHE_CONTROL = "no-cache"
+
+
+def etag_for(*parts) -> str:
+    # Strong ETag over JSON-encodable parts (version fields or a whole body)
+    encoded = json.dumps(jsonable_encoder(parts), sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return '"' + hashlib.blake2b(encoded.encode(), digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison, so W/ prefixes are ignored
+    candidates = (tag.strip() for tag in header.split(","))
+    return etag in (tag[2:] if tag.startswith("W/") else tag for tag in candidates)
+
+
+# Set validators on the response; returns a 304 to send instead when the
+# client already has this representation.
+def check_etag(request: Request, response: Response, etag: str) -> Optional[Response]:
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    return None
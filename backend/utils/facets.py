@@ -0,0 +1,37 @@
+from typing import Optional
+import os
+
+FACET_PRICE_BUCKETS = int(os.environ.get("FACET_PRICE_BUCKETS", "6"))
+
+
+# Histogram stage for a $facet branch. With both price bounds the range is
+# split evenly; otherwise $bucketAuto picks edges that spread the matching
+# services across the buckets.
+def price_bucket_stage(min_price: Optional[float], max_price: Optional[float], buckets: int = FACET_PRICE_BUCKETS) -> dict:
+    if min_price is not None and max_price is not None and max_price > min_price:
+        step = (max_price - min_price) / buckets
+        # The upper edge is exclusive, so the last one sits just above max_price
+        boundaries = sorted({round(min_price + step * i, 2) for i in range(buckets)} | {max_price + 0.01})
+        return {"$bucket": {"groupBy": "$price", "boundaries": boundaries, "default": "other", "output": {"count": {"$sum": 1}}}}
+    return {"$bucketAuto": {"groupBy": "$price", "buckets": buckets}}
+
+
+def price_buckets(rows: list, stage: dict, max_price: Optional[float]) -> list:
+    if "$bucketAuto" in stage:
+        return [{"min": row["_id"]["min"], "max": row["_id"]["max"], "count": row["count"]} for row in rows]
+    # $bucket only reports non-empty buckets by lower edge; empty ones are
+    # filled in so the histogram always has every bar
+    counts = {row["_id"]: row["count"] for row in rows}
+    boundaries = stage["$bucket"]["boundaries"]
+    return [
+        {"min": lower, "max": upper if i < len(boundaries) - 2 else max_price, "count": counts.get(lower, 0)}
+        for i, (lower, upper) in enumerate(zip(boundaries, boundaries[1:]))
+    ]
+
+
+def category_counts(rows: list, categories) -> dict:
+    counts = {category: 0 for category in categories}
+    for row in rows:
+        if row["_id"] is not None:
+            counts[row["_id"]] = row["count"]
+    return counts
@@ -0,0 +1,203 @@
+from fastapi import HTTPException, status
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional
+import anyio
+import asyncio
+import hashlib
+import logging
+import os
+import uuid
+
+logger = logging.getLogger(__name__)
+
+IMAGE_VARIANT_DIR = Path(os.environ.get("IMAGE_VARIANT_DIR", "/app/backend/uploads/variants"))
+IMAGE_VARIANT_CACHE_BYTES = int(os.environ.get("IMAGE_VARIANT_CACHE_BYTES", str(512 * 1024 * 1024)))
+IMAGE_RESIZE_WORKERS = int(os.environ.get("IMAGE_RESIZE_WORKERS", str(min(2, os.cpu_count() or 1))))
+IMAGE_RESIZE_MAX_QUEUE = int(os.environ.get("IMAGE_RESIZE_MAX_QUEUE", "32"))
+IMAGE_MAX_DIMENSION = int(os.environ.get("IMAGE_MAX_DIMENSION", "2048"))
+IMAGE_QUALITY = int(os.environ.get("IMAGE_QUALITY", "80"))
+
+MEDIA_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg", "png": "image/png"}
+# Re-encoding target when neither ?format= nor Accept picks one; GIFs lose
+# their animation when resized, so they become PNGs
+SOURCE_FORMATS = {".jpg": "jpeg", ".jpeg": "jpeg", ".png": "png", ".gif": "png", ".webp": "webp"}
+
+
+def resize_image(source: str, target: str, width: int, height: int, fmt: str, quality: int) -> int:
+    # Runs in a worker process: Pillow holds the GIL while decoding
+    from PIL import Image, ImageOps
+
+    box = (width or IMAGE_MAX_DIMENSION, height or IMAGE_MAX_DIMENSION)
+    with Image.open(source) as image:
+        # JPEGs can be decoded straight at a reduced scale, far cheaper than full size
+        image.draft("RGB", box)
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(box, Image.LANCZOS)
+        if fmt == "jpeg" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        elif image.mode == "P":
+            image = image.convert("RGBA")
+        options = {"quality": quality, "optimize": True} if fmt in ("jpeg", "webp") else {"optimize": True}
+        temp = f"{target}.{uuid.uuid4().hex}.part"
+        try:
+            image.save(temp, format=fmt.upper(), **options)
+            os.replace(temp, target)
+        except BaseException:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+    return os.path.getsize(target)
+
+
+def negotiate_format(requested: Optional[str], accept: str, source_ext: str) -> str:
+    if requested:
+        if requested not in MEDIA_TYPES:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unsupported format. Allowed formats: {', '.join(MEDIA_TYPES)}"
+            )
+        return requested
+    if "image/webp" in accept:
+        return "webp"
+    return SOURCE_FORMATS.get(source_ext, "jpeg")
+
+
+class ImageVariantCache:
+    # Resized variants live on disk under IMAGE_VARIANT_DIR, named by a hash
+    # of the source bytes plus the resize parameters, so a replaced source
+    # never serves a stale variant. The directory is bounded by total size
+    # and evicted in LRU order; the index is rebuilt from the directory on
+    # first use, oldest access first. Each worker enforces the budget on its
+    # own view of the directory. Concurrent requests for the same missing
+    # variant share a single resize.
+
+    def __init__(self, directory: Path = IMAGE_VARIANT_DIR, max_bytes: int = IMAGE_VARIANT_CACHE_BYTES,
+                 workers: int = IMAGE_RESIZE_WORKERS, max_queue: int = IMAGE_RESIZE_MAX_QUEUE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self.max_queue = max_queue
+        self.bytes = 0
+        self._entries = None
+        self._source_hashes = OrderedDict()
+        self._inflight = {}
+        self._executor = None
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "rejected": 0, "failed": 0}
+
+    def _scan(self) -> OrderedDict:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith(".part"):
+                info = entry.stat()
+                files.append((info.st_atime, entry.name, info.st_size))
+        return OrderedDict((name, size) for _, name, size in sorted(files))
+
+    async def _load(self):
+        if self._entries is None:
+            entries = await anyio.to_thread.run_sync(self._scan)
+            if self._entries is None:
+                self._entries = entries
+                self.bytes = sum(entries.values())
+
+    async def _source_hash(self, source: Path) -> str:
+        # Memoized per (path, mtime, size) so the source is read once, not per request
+        info = await anyio.to_thread.run_sync(source.stat)
+        key = (str(source), info.st_mtime_ns, info.st_size)
+        digest = self._source_hashes.get(key)
+        if digest is None:
+            def hash_file():
+                h = hashlib.blake2b(digest_size=16)
+                with open(source, "rb") as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                        h.update(chunk)
+                return h.hexdigest()
+            digest = await anyio.to_thread.run_sync(hash_file)
+            self._source_hashes[key] = digest
+            if len(self._source_hashes) > 4096:
+                self._source_hashes.popitem(last=False)
+        else:
+            self._source_hashes.move_to_end(key)
+        return digest
+
+    async def get(self, source: Path, width: int, height: int, fmt: str) -> Path:
+        await self._load()
+        digest = await self._source_hash(source)
+        name = f"{digest}-{width}x{height}-q{IMAGE_QUALITY}.{fmt}"
+        path = self.directory / name
+
+        if name in self._entries and path.exists():
+            self._entries.move_to_end(name)
+            self.stats["hits"] += 1
+            return path
+
+        self.stats["misses"] += 1
+        pending = self._inflight.get(name)
+        if pending is None:
+            pending = asyncio.ensure_future(self._render(source, path, width, height, fmt))
+            self._inflight[name] = pending
+            pending.add_done_callback(lambda _: self._inflight.pop(name, None))
+        await asyncio.shield(pending)
+        return path
+
+    async def _render(self, source: Path, path: Path, width: int, height: int, fmt: str):
+        if len(self._inflight) > self.workers + self.max_queue:
+            self.stats["rejected"] += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many image requests, try again shortly",
+                headers={"Retry-After": "1"}
+            )
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.workers)
+        try:
+            size = await asyncio.get_running_loop().run_in_executor(
+                self._executor, resize_image, str(source), str(path), width, height, fmt, IMAGE_QUALITY
+            )
+        except Exception as e:
+            self.stats["failed"] += 1
+            logger.warning("Failed to resize %s: %s", source.name, e)
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Image could not be processed")
+
+        if path.name in self._entries:
+            self.bytes -= self._entries.pop(path.name)
+        self._entries[path.name] = size
+        self.bytes += size
+        await self._evict()
+
+    async def _evict(self):
+        removed = []
+        while self.bytes > self.max_bytes and len(self._entries) > 1:
+            name, size = self._entries.popitem(last=False)
+            self.bytes -= size
+            removed.append(self.directory / name)
+            self.stats["evictions"] += 1
+        if removed:
+            def remove_all():
+                for path in removed:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+            await anyio.to_thread.run_sync(remove_all)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def get_stats(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else 0.0,
+            "entries": len(self._entries or ()),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "in_flight": len(self._inflight),
+        }
+
+
+image_variants = ImageVariantCache()
@@ -0,0 +1,248 @@
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import OperationFailure
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Declarative index registry. Compound indexes follow the filter + sort shape
+# of the router queries that use them, so every list endpoint is served by
+# an index scan instead of a collection scan. Sort keys end with "id", the
+# tiebreaker used by keyset pagination (utils/pagination.py).
+INDEXES = {
+    "users": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        # Blob collector reference checks
+        IndexModel([("avatar", ASCENDING)], name="avatar", sparse=True),
+        # Suggest index refresh polls recently changed masters and services
+        IndexModel([("updated_at", ASCENDING)], name="updated_at"),
+    ],
+    "services": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        # GET /services (default sort, by category, by price)
+        IndexModel([("is_active", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="active_created"),
+        IndexModel(
+            [("is_active", ASCENDING), ("category", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+            name="active_category_created"
+        ),
+        IndexModel([("is_active", ASCENDING), ("price", ASCENDING), ("id", ASCENDING)], name="active_price"),
+        # sort_by=rating sorts on the embedded master summary
+        IndexModel(
+            [("is_active", ASCENDING), ("master.rating", DESCENDING), ("id", DESCENDING)],
+            name="active_master_rating"
+        ),
+        IndexModel(
+            [("is_active", ASCENDING), ("category", ASCENDING), ("master.rating", DESCENDING), ("id", DESCENDING)],
+            name="active_category_master_rating"
+        ),
+        # GET /services/master/{id}
+        IndexModel(
+            [("master_id", ASCENDING), ("is_active", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+            name="master_active_created"
+        ),
+        IndexModel([("images", ASCENDING)], name="images"),
+        IndexModel([("updated_at", ASCENDING)], name="updated_at"),
+        # GET /services?search= (one text index per collection; stems Russian)
+        IndexModel(
+            [("title", TEXT), ("description", TEXT), ("category", TEXT)],
+            name="text_search",
+            weights={"title": 10, "category": 5, "description": 1},
+            default_language="russian"
+        ),
+    ],
+    "orders": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        # GET /orders
+        IndexModel([("customer_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="customer_created"),
+        IndexModel([("master_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="master_created"),
+        # GET /messages/chats, most recent conversation first
+        IndexModel(
+            [("customer_id", ASCENDING), ("last_message_at", DESCENDING), ("id", DESCENDING)],
+            name="customer_last_message"
+        ),
+        IndexModel(
+            [("master_id", ASCENDING), ("last_message_at", DESCENDING), ("id", DESCENDING)],
+            name="master_last_message"
+        ),
+        IndexModel(
+            [("customer_id", ASCENDING), ("status", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+            name="customer_status_created"
+        ),
+        IndexModel(
+            [("master_id", ASCENDING), ("status", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+            name="master_status_created"
+        ),
+    ],
+    "messages": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        # GET /messages/order/{id}, last message lookup for chats
+        IndexModel([("order_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="order_created"),
+        # Unread counts and PATCH /messages/order/{id}/read
+        IndexModel(
+            [("order_id", ASCENDING), ("receiver_id", ASCENDING), ("is_read", ASCENDING)],
+            name="order_receiver_read"
+        ),
+    ],
+    "reviews": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("order_id", ASCENDING)], name="order_unique", unique=True),
+        # GET /reviews/master/{id}, rating aggregation
+        IndexModel([("master_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="master_created"),
+        # GET /reviews/service/{id} (newest / highest / lowest)
+        IndexModel([("service_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="service_created"),
+        IndexModel([("service_id", ASCENDING), ("rating", DESCENDING), ("id", DESCENDING)], name="service_rating"),
+    ],
+    "notifications": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="user_created"),
+        IndexModel(
+            [("user_id", ASCENDING), ("is_read", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+            name="user_read_created"
+        ),
+        # One unread notification per user and group; coalesced upserts rely on it
+        IndexModel(
+            [("user_id", ASCENDING), ("group_key", ASCENDING)],
+            name="user_group_unread_unique",
+            unique=True,
+            partialFilterExpression={"is_read": False, "group_key": {"$exists": True}}
+        ),
+    ],
+    "service_views": [
+        IndexModel([("key", ASCENDING)], name="key_unique", unique=True),
+    ],
+    "counters": [
+        IndexModel([("user_id", ASCENDING)], name="user_unique", unique=True),
+    ],
+    "revoked_tokens": [
+        # Workers poll for entries newer than their last sync
+        IndexModel([("created_at", ASCENDING)], name="created_at"),
+        IndexModel([("expires_at", ASCENDING)], name="expires_ttl", expireAfterSeconds=0),
+    ],
+    "jobs": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("idempotency_key", ASCENDING)], name="idempotency_key_unique", unique=True),
+        # Claim query: due pending jobs and expired locks, oldest first
+        IndexModel([("status", ASCENDING), ("run_at", ASCENDING)], name="status_run_at"),
+        IndexModel([("status", ASCENDING), ("locked_until", ASCENDING)], name="status_locked_until"),
+        # Finished jobs are kept a week for inspection; failed ones stay
+        IndexModel(
+            [("finished_at", ASCENDING)],
+            name="finished_ttl",
+            expireAfterSeconds=7 * 24 * 3600,
+            partialFilterExpression={"status": "done"}
+        ),
+    ],
+    "blobs": [
+        # Collector sweep: unreferenced blobs past the grace period
+        IndexModel([("refs", ASCENDING), ("orphaned_at", ASCENDING)], name="refs_orphaned"),
+    ],
+    "job_effects": [
+        IndexModel([("created_at", ASCENDING)], name="created_ttl", expireAfterSeconds=30 * 24 * 3600),
+    ],
+}
+
+# Options that are part of an index definition and must match for the
+# existing index to count as "the same" index.
+COMPARED_OPTIONS = ("unique", "sparse", "expireAfterSeconds", "partialFilterExpression", "weights", "default_language")
+
+
+def _spec_from_model(model: IndexModel) -> dict:
+    document = model.document
+    spec = {"key": list(document["key"].items())}
+    for option in COMPARED_OPTIONS:
+        if option in document:
+            spec[option] = document[option]
+
+    # Mongo reports a text index as _fts/_ftsx plus a weight per text field
+    # (1 unless declared), so declared text keys are compared in that form
+    text_fields = [field for field, direction in spec["key"] if direction == TEXT]
+    if text_fields:
+        first = next(i for i, (_, direction) in enumerate(spec["key"]) if direction == TEXT)
+        suffix = [(field, direction) for field, direction in spec["key"][first:] if direction != TEXT]
+        spec["key"] = spec["key"][:first] + [("_fts", "text"), ("_ftsx", 1)] + suffix
+        weights = document.get("weights", {})
+        spec["weights"] = {field: weights.get(field, 1) for field in text_fields}
+    return spec
+
+
+def _spec_from_info(info: dict) -> dict:
+    spec = {"key": [(field, direction) for field, direction in info["key"]]}
+    for option in COMPARED_OPTIONS:
+        if option in info:
+            spec[option] = info[option]
+    if "weights" in spec:
+        spec["weights"] = {field: int(weight) for field, weight in spec["weights"].items()}
+    # Mongo reports unique=False only when explicitly set; normalise it away
+    if spec.get("unique") is False:
+        del spec["unique"]
+    return spec
+
+
+def _normalise_key(key):
+    # Index info returns float directions (1.0) for some server versions
+    return [(field, int(direction) if isinstance(direction, (int, float)) else direction) for field, direction in key]
+
+
+# Compare existing indexes with INDEXES. Only collections that drifted are
+# reported: {collection: {"missing": [...], "extra": [...], "changed": [...]}}
+async def index_drift(db: AsyncIOMotorDatabase, collections=None) -> dict:
+    report = {}
+    for collection_name, models in INDEXES.items():
+        if collections and collection_name not in collections:
+            continue
+
+        existing = await db[collection_name].index_information()
+        existing.pop("_id_", None)
+
+        declared = {model.document["name"]: _spec_from_model(model) for model in models}
+        actual = {name: _spec_from_info(info) for name, info in existing.items()}
+
+        missing, changed = [], []
+        for name, spec in declared.items():
+            if name not in actual:
+                missing.append(name)
+                continue
+            current = actual[name]
+            if _normalise_key(current["key"]) != _normalise_key(spec["key"]) or {
+                k: v for k, v in current.items() if k != "key"
+            } != {k: v for k, v in spec.items() if k != "key"}:
+                changed.append({"name": name, "declared": spec, "actual": current})
+
+        extra = sorted(name for name in actual if name not in declared)
+
+        if missing or extra or changed:
+            report[collection_name] = {"missing": missing, "extra": extra, "changed": changed}
+
+    return report
+
+
+# Create missing indexes and recreate changed ones. Undeclared indexes are
+# only dropped with drop_extra. Returns the drift report that was applied.
+async def ensure_indexes(db: AsyncIOMotorDatabase, drop_extra: bool = False, collections=None) -> dict:
+    report = await index_drift(db, collections)
+
+    for collection_name, drift in report.items():
+        collection = db[collection_name]
+        models = {model.document["name"]: model for model in INDEXES[collection_name]}
+
+        for item in drift["changed"]:
+            logger.info("Recreating index %s.%s", collection_name, item["name"])
+            await collection.drop_index(item["name"])
+
+        to_create = [models[name] for name in drift["missing"]] + [models[item["name"]] for item in drift["changed"]]
+        for model in to_create:
+            try:
+                await collection.create_indexes([model])
+                logger.info("Created index %s.%s", collection_name, model.document["name"])
+            except OperationFailure as e:
+                # Most likely duplicates under a unique index or the same keys
+                # under another name - report and keep going with the rest
+                logger.error("Failed to create index %s.%s: %s", collection_name, model.document["name"], e)
+
+        if drop_extra:
+            for name in drift["extra"]:
+                logger.info("Dropping undeclared index %s.%s", collection_name, name)
+                await collection.drop_index(name)
+
+    return report
@@ -0,0 +1,192 @@
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timezone, timedelta
+from typing import Optional
+import asyncio
+import logging
+import os
+import uuid
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "5"))
+JOB_BACKOFF_BASE = float(os.environ.get("JOB_BACKOFF_BASE", "2"))
+JOB_LOCK_TIMEOUT = float(os.environ.get("JOB_LOCK_TIMEOUT", "60"))
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "5"))
+JOB_DRAIN_TIMEOUT = float(os.environ.get("JOB_DRAIN_TIMEOUT", "10"))
+
+
+class JobQueue:
+    # Durable background jobs for request side effects. Jobs are persisted in
+    # the "jobs" collection before the request returns and executed by an
+    # in-process pool of async workers that claim them atomically, so jobs
+    # survive restarts and several server processes can share the queue.
+    #
+    # Delivery is at least once: a failed job is retried with exponential
+    # backoff up to JOB_MAX_ATTEMPTS, and a job whose worker died is picked up
+    # again once its lock expires. Handlers guard non-idempotent steps with
+    # once().
+
+    def __init__(self):
+        self._handlers = {}
+        self._workers = []
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._in_flight = 0
+        self.stats = {"enqueued": 0, "duplicates": 0, "completed": 0, "retried": 0, "failed": 0}
+
+    def handler(self, job_type: str):
+        def register(func):
+            self._handlers[job_type] = func
+            return func
+        return register
+
+    async def enqueue(
+        self,
+        db: AsyncIOMotorDatabase,
+        job_type: str,
+        payload: dict,
+        idempotency_key: Optional[str] = None,
+        delay: float = 0
+    ) -> Optional[str]:
+        now = datetime.now(timezone.utc)
+        job_id = str(uuid.uuid4())
+        try:
+            await db.jobs.insert_one({
+                "id": job_id,
+                "type": job_type,
+                "payload": payload,
+                "idempotency_key": idempotency_key or job_id,
+                "status": "pending",
+                "attempts": 0,
+                "run_at": now + timedelta(seconds=delay),
+                "created_at": now,
+                "updated_at": now
+            })
+        except DuplicateKeyError:
+            # Same side effect already queued (or done) - nothing to do
+            self.stats["duplicates"] += 1
+            return None
+
+        self.stats["enqueued"] += 1
+        self._wakeup.set()
+        return job_id
+
+    # Record that a step of a job ran. Returns False when it already did,
+    # so a retried job skips steps that succeeded on an earlier attempt.
+    async def once(self, db: AsyncIOMotorDatabase, key: str) -> bool:
+        try:
+            await db.job_effects.insert_one({"_id": key, "created_at": datetime.now(timezone.utc)})
+            return True
+        except DuplicateKeyError:
+            return False
+
+    # Run a non-idempotent step at most once per key. The marker is removed
+    # again if the step raises, so the retry runs it.
+    async def run_once(self, db: AsyncIOMotorDatabase, key: str, step):
+        if not await self.once(db, key):
+            return None
+        try:
+            return await step()
+        except Exception:
+            await db.job_effects.delete_one({"_id": key})
+            raise
+
+    def start(self, db: AsyncIOMotorDatabase, workers: int = JOB_WORKERS):
+        # The event binds to the running loop, so create it here
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        for n in range(workers - len(self._workers)):
+            self._workers.append(asyncio.create_task(self._work(db), name=f"job-worker-{n}"))
+
+    # Stop claiming new jobs and let running ones finish. Jobs left pending
+    # stay in the collection and are picked up on the next start.
+    async def drain(self, timeout: float = JOB_DRAIN_TIMEOUT):
+        self._stopping = True
+        self._wakeup.set()
+        if not self._workers:
+            return
+
+        done, pending = await asyncio.wait(self._workers, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning("Cancelled %d job workers still running after %ss", len(pending), timeout)
+            await asyncio.gather(*pending, return_exceptions=True)
+        self._workers = []
+
+    async def _claim(self, db: AsyncIOMotorDatabase):
+        now = datetime.now(timezone.utc)
+        return await db.jobs.find_one_and_update(
+            {"$or": [
+                {"status": "pending", "run_at": {"$lte": now}},
+                {"status": "running", "locked_until": {"$lt": now}}
+            ]},
+            {
+                "$set": {"status": "running", "locked_until": now + timedelta(seconds=JOB_LOCK_TIMEOUT), "updated_at": now},
+                "$inc": {"attempts": 1}
+            },
+            sort=[("run_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _work(self, db: AsyncIOMotorDatabase):
+        while not self._stopping:
+            try:
+                job = await self._claim(db)
+            except Exception:
+                logger.exception("Failed to claim job")
+                job = None
+
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                if not self._stopping:
+                    self._wakeup.clear()
+                continue
+
+            self._in_flight += 1
+            try:
+                await self._run(db, job)
+            finally:
+                self._in_flight -= 1
+
+    async def _run(self, db: AsyncIOMotorDatabase, job: dict):
+        handler = self._handlers.get(job["type"])
+        try:
+            if handler is None:
+                raise LookupError(f"No handler for job type {job['type']!r}")
+            await handler(db, job["payload"])
+        except Exception as e:
+            now = datetime.now(timezone.utc)
+            if job["attempts"] >= JOB_MAX_ATTEMPTS:
+                self.stats["failed"] += 1
+                logger.exception("Job %s (%s) failed permanently", job["id"], job["type"])
+                update = {"status": "failed", "finished_at": now}
+            else:
+                self.stats["retried"] += 1
+                delay = JOB_BACKOFF_BASE ** job["attempts"]
+                logger.warning("Job %s (%s) failed, retrying in %.0fs: %s", job["id"], job["type"], delay, e)
+                update = {"status": "pending", "run_at": now + timedelta(seconds=delay)}
+            await db.jobs.update_one(
+                {"id": job["id"]},
+                {"$set": {**update, "last_error": repr(e), "updated_at": now}, "$unset": {"locked_until": ""}}
+            )
+            return
+
+        now = datetime.now(timezone.utc)
+        await db.jobs.update_one(
+            {"id": job["id"]},
+            {"$set": {"status": "done", "finished_at": now, "updated_at": now}, "$unset": {"locked_until": ""}}
+        )
+        self.stats["completed"] += 1
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "workers": len(self._workers), "in_flight": self._in_flight}
+
+
+job_queue = JobQueue()
@@ -0,0 +1,46 @@
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from typing import Iterable, Optional
+
+# Fields loaded per collection. Documents are cached with this projection and
+# call sites pick what they need, so one query serves every enrichment shape.
+PROJECTIONS = {
+    "users": {"_id": 0, "password_hash": 0},
+    "services": {"_id": 0},
+}
+
+
+def pick(doc: Optional[dict], fields: Iterable[str]) -> Optional[dict]:
+    if doc is None:
+        return None
+    return {field: doc[field] for field in fields if field in doc}
+
+
+class DocumentLoader:
+    # Request-scoped batching loader keyed on the "id" field. Ids collected
+    # from a page are resolved with one {"id": {"$in": [...]}} query per
+    # collection; results (including misses) are memoized for the request.
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.db = db
+        self._cache = {}
+        self.queries = 0
+
+    async def load_many(self, collection: str, ids: Iterable[str]) -> dict:
+        cache = self._cache.setdefault(collection, {})
+        missing = list({id_ for id_ in ids if id_ is not None and id_ not in cache})
+
+        if missing:
+            self.queries += 1
+            cursor = self.db[collection].find({"id": {"$in": missing}}, PROJECTIONS.get(collection, {"_id": 0}))
+            for doc in await cursor.to_list(length=len(missing)):
+                cache[doc["id"]] = doc
+            for id_ in missing:
+                cache.setdefault(id_, None)
+
+        return {id_: cache.get(id_) for id_ in ids if id_ is not None}
+
+    async def load(self, collection: str, id_: str) -> Optional[dict]:
+        return (await self.load_many(collection, [id_])).get(id_)
+
+    def prime(self, collection: str, doc: dict):
+        self._cache.setdefault(collection, {})[doc["id"]] = doc
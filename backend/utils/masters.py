@@ -0,0 +1,42 @@
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from typing import Optional
+
+# Master fields embedded into every service as "master" so catalog pages
+# need no user lookups and can sort on master.rating through an index.
+# updated_at lets service ETags change when the master's profile does.
+MASTER_SUMMARY_FIELDS = ("id", "name", "avatar", "rating", "total_reviews", "updated_at")
+MASTER_SUMMARY_PROJECTION = {"_id": 0, **{field: 1 for field in MASTER_SUMMARY_FIELDS}}
+
+
+def master_summary(user: dict) -> dict:
+    return {
+        "id": user["id"],
+        "name": user.get("name"),
+        "avatar": user.get("avatar"),
+        "rating": user.get("rating", 0.0),
+        "total_reviews": user.get("total_reviews", 0),
+        "updated_at": user.get("updated_at"),
+    }
+
+
+# Fan the current summary out to all of the master's services. Pass the
+# user document when the caller already has it to save a read.
+async def propagate_master_summary(db: AsyncIOMotorDatabase, master_id: str, user: Optional[dict] = None) -> int:
+    if user is None or any(field not in user for field in MASTER_SUMMARY_FIELDS):
+        user = await db.users.find_one({"id": master_id}, MASTER_SUMMARY_PROJECTION)
+        if not user:
+            return 0
+    result = await db.services.update_many({"master_id": master_id}, {"$set": {"master": master_summary(user)}})
+    return result.modified_count
+
+
+# Rewrite the summary on every service, master by master. Used once after
+# deploy and whenever a fan-out is suspected to have been missed.
+async def sync_master_summaries(db: AsyncIOMotorDatabase, progress=None) -> int:
+    modified = 0
+    master_ids = await db.services.distinct("master_id")
+    for master_id in master_ids:
+        modified += await propagate_master_summary(db, master_id)
+        if progress:
+            progress(master_id, modified)
+    return modified
@@ -0,0 +1,151 @@
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from datetime import datetime, timezone
+import logging
+
+from utils.counters import rebuild_counters
+
+logger = logging.getLogger(__name__)
+
+# Fields that used to be written as ISO strings and are now native BSON dates
+DATETIME_FIELDS = {
+    "users": ["created_at", "updated_at"],
+    "services": ["created_at", "updated_at"],
+    "orders": ["created_at", "updated_at", "deadline", "completed_at"],
+    "messages": ["created_at"],
+    "reviews": ["created_at"],
+    "notifications": ["created_at"],
+}
+
+DATETIMES_MIGRATION = "datetimes"
+
+
+def parse_datetime(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        # Old documents were always written in UTC
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+# Converts ISO string fields to BSON dates in _id order, batch by batch. After
+# every batch the last processed _id is checkpointed in the "migrations"
+# collection, so an interrupted run resumes where it stopped.
+async def migrate_datetimes(
+    db: AsyncIOMotorDatabase,
+    batch_size: int = 1000,
+    collections=None,
+    restart: bool = False,
+    progress=None
+) -> dict:
+    if restart:
+        await db.migrations.delete_one({"_id": DATETIMES_MIGRATION})
+
+    checkpoint = await db.migrations.find_one({"_id": DATETIMES_MIGRATION}) or {"collections": {}}
+    summary = {}
+
+    for collection_name, fields in DATETIME_FIELDS.items():
+        if collections and collection_name not in collections:
+            continue
+
+        state = checkpoint["collections"].get(collection_name, {})
+        if state.get("done"):
+            summary[collection_name] = state
+            continue
+
+        last_id = state.get("last_id")
+        converted = state.get("converted", 0)
+        failed = state.get("failed", 0)
+        base_query = {"$or": [{field: {"$type": "string"}} for field in fields]}
+        projection = {field: 1 for field in fields}
+
+        while True:
+            query = dict(base_query)
+            if last_id is not None:
+                query["_id"] = {"$gt": last_id}
+
+            batch = await db[collection_name].find(query, projection).sort("_id", 1).limit(batch_size).to_list(length=batch_size)
+            if not batch:
+                break
+
+            operations = []
+            for doc in batch:
+                update = {}
+                for field in fields:
+                    value = doc.get(field)
+                    if not isinstance(value, str):
+                        continue
+                    try:
+                        update[field] = parse_datetime(value)
+                    except ValueError:
+                        failed += 1
+                        logger.warning("Unparseable %s.%s on %s: %r", collection_name, field, doc["_id"], value)
+                if update:
+                    operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": update}))
+
+            if operations:
+                result = await db[collection_name].bulk_write(operations, ordered=False)
+                converted += result.modified_count
+
+            last_id = batch[-1]["_id"]
+            await db.migrations.update_one(
+                {"_id": DATETIMES_MIGRATION},
+                {"$set": {
+                    f"collections.{collection_name}": {"last_id": last_id, "converted": converted, "failed": failed, "done": False},
+                    "updated_at": datetime.now(timezone.utc)
+                }},
+                upsert=True
+            )
+            if progress:
+                progress(collection_name, converted, failed)
+
+        state = {"last_id": last_id, "converted": converted, "failed": failed, "done": True}
+        await db.migrations.update_one(
+            {"_id": DATETIMES_MIGRATION},
+            {"$set": {f"collections.{collection_name}": state, "updated_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+        summary[collection_name] = state
+
+    return summary
+
+
+# Stamps orders with the time of their latest message, which GET /messages/chats
+# sorts on. send_message keeps it current; this fills in orders that got
+# messages before the field existed. $max makes reruns harmless.
+async def backfill_last_message_at(db: AsyncIOMotorDatabase, batch_size: int = 1000, progress=None) -> int:
+    pipeline = [{"$group": {"_id": "$order_id", "last_message_at": {"$max": "$created_at"}}}]
+    modified, operations = 0, []
+    async for row in db.messages.aggregate(pipeline):
+        operations.append(UpdateOne({"id": row["_id"]}, {"$max": {"last_message_at": row["last_message_at"]}}))
+        if len(operations) >= batch_size:
+            modified += (await db.orders.bulk_write(operations, ordered=False)).modified_count
+            operations = []
+            if progress:
+                progress(modified)
+    if operations:
+        modified += (await db.orders.bulk_write(operations, ordered=False)).modified_count
+    return modified
+
+
+# Backfills that must have run before the fields they fill are read. Each is
+# idempotent and recorded in "migrations" once complete, so every worker can
+# apply them at startup and only the first deploy does the work.
+DATA_MIGRATIONS = {
+    "last_message_at": backfill_last_message_at,
+    # Unread counters start from what notifications and messages hold
+    "counters": rebuild_counters,
+}
+
+
+async def apply_data_migrations(db: AsyncIOMotorDatabase) -> list:
+    applied = []
+    for name, migration in DATA_MIGRATIONS.items():
+        if await db.migrations.find_one({"_id": name, "done": True}):
+            continue
+        await migration(db)
+        await db.migrations.update_one(
+            {"_id": name}, {"$set": {"done": True, "finished_at": datetime.now(timezone.utc)}}, upsert=True
+        )
+        applied.append(name)
+    return applied
@@ -0,0 +1,205 @@
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from datetime import datetime, timezone
+from typing import Optional
+import asyncio
+import logging
+import os
+import uuid
+
+from models import NotificationCreate
+from utils.tasks import PeriodicTask
+from utils.counters import add_notifications
+from utils.realtime import event_bus
+
+logger = logging.getLogger(__name__)
+
+NOTIFICATION_FLUSH_INTERVAL = float(os.environ.get("NOTIFICATION_FLUSH_INTERVAL", "1"))
+NOTIFICATION_BUFFER_MAX = int(os.environ.get("NOTIFICATION_BUFFER_MAX", "500"))
+# Batch ids remembered per grouped notification; a retry only has to find
+# its own among the few writes since the failed one
+NOTIFICATION_BATCH_HISTORY = 20
+
+DUPLICATE_KEY = 11000
+
+
+def build_notification(notification: NotificationCreate, group_key: Optional[str] = None) -> dict:
+    notif_dict = notification.model_dump()
+    notif_dict["id"] = str(uuid.uuid4())
+    notif_dict["is_read"] = False
+    notif_dict["count"] = 1
+    notif_dict["created_at"] = datetime.now(timezone.utc)
+    if group_key:
+        notif_dict["group_key"] = group_key
+    return notif_dict
+
+
+def _only_duplicates(error: BulkWriteError) -> bool:
+    errors = error.details.get("writeErrors", [])
+    return bool(errors) and all(e.get("code") == DUPLICATE_KEY for e in errors)
+
+
+def _failed_indexes(error: BulkWriteError) -> set:
+    return {e["index"] for e in error.details.get("writeErrors", [])}
+
+
+class NotificationService:
+    # Single entry point for creating notifications. Notifications are
+    # buffered for NOTIFICATION_FLUSH_INTERVAL and written in one batch:
+    # plain ones with insert_many, grouped ones (group_key set, e.g. chat
+    # messages per order) are merged in the buffer and upserted into the
+    # user's unread notification for that group, bumping its count. A failed
+    # batch is replayed as is on the next flush: inserts are deduped by id
+    # and each grouped increment carries a batch id that the document
+    # records, so a partly applied write is not counted twice.
+
+    def __init__(self):
+        self._plain = []
+        self._grouped = {}
+        self._retry = []
+        self._task = None
+        self._flushing = None
+        self.stats = {"queued": 0, "coalesced": 0, "inserted": 0, "upserted": 0, "flushes": 0}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and self._task.running
+
+    async def notify(self, db: AsyncIOMotorDatabase, notification: NotificationCreate, group_key: Optional[str] = None):
+        notif_dict = build_notification(notification, group_key)
+        # Outside the server (scripts, jobs before startup) write right away
+        if not self.running:
+            await self.write(db, [notif_dict])
+            return
+
+        self.stats["queued"] += 1
+        if group_key:
+            key = (notif_dict["user_id"], group_key)
+            pending = self._grouped.get(key)
+            if pending:
+                pending["count"] += 1
+                pending["created_at"] = notif_dict["created_at"]
+                self.stats["coalesced"] += 1
+            else:
+                self._grouped[key] = notif_dict
+        else:
+            self._plain.append(notif_dict)
+
+        if len(self._plain) + len(self._grouped) >= NOTIFICATION_BUFFER_MAX and self._flushing is None:
+            self._flushing = asyncio.create_task(self._flush_full(db))
+
+    async def _flush_full(self, db: AsyncIOMotorDatabase):
+        try:
+            await self.flush(db)
+        except Exception:
+            logger.exception("Notification flush failed")
+        finally:
+            self._flushing = None
+
+    # Write prepared notification dicts. Inserts are unordered and ignore
+    # duplicate ids, so retried writes (e.g. from the job queue) are safe.
+    # Counters are bumped only for documents that were actually created.
+    async def write(self, db: AsyncIOMotorDatabase, notifications: list):
+        plain = [n for n in notifications if not n.get("group_key")]
+        grouped = [n for n in notifications if n.get("group_key")]
+        created = []
+
+        if plain:
+            try:
+                await db.notifications.insert_many(plain, ordered=False)
+                created += plain
+            except BulkWriteError as e:
+                if not _only_duplicates(e):
+                    raise
+                failed = _failed_indexes(e)
+                created += [n for i, n in enumerate(plain) if i not in failed]
+            self.stats["inserted"] += len(created)
+
+        if grouped:
+            for n in grouped:
+                # Kept on the dict, so a replay of this write reuses it
+                n.setdefault("batch", str(uuid.uuid4()))
+            operations = [self._group_update(n) for n in grouped]
+            try:
+                result = await db.notifications.bulk_write(operations, ordered=False)
+                upserted = result.upserted_ids
+            except BulkWriteError as e:
+                # Two processes upserting the same group race on the unique
+                # index; the loser's retry turns into a plain update.
+                if not _only_duplicates(e):
+                    raise
+                upserted = {u["index"]: u["_id"] for u in e.details.get("upserted", [])}
+                retry = sorted(_failed_indexes(e))
+                try:
+                    await db.notifications.bulk_write([operations[i] for i in retry], ordered=False)
+                except BulkWriteError as e:
+                    # Still no match: the unread notification already holds
+                    # this batch from an earlier, partly applied attempt
+                    if not _only_duplicates(e):
+                        raise
+            created += [grouped[i] for i in upserted]
+            self.stats["upserted"] += len(grouped)
+
+        deltas = {}
+        for n in created:
+            total, unread = deltas.get(n["user_id"], (0, 0))
+            deltas[n["user_id"]] = (total + 1, unread + (0 if n["is_read"] else 1))
+        await add_notifications(db, deltas)
+
+        for n in notifications:
+            await event_bus.publish([n["user_id"]], "notification", {k: v for k, v in n.items() if k not in ("_id", "batch")})
+
+    def _group_update(self, notif_dict: dict) -> UpdateOne:
+        # Filter fields are copied into the upserted document by MongoDB
+        skip = ("user_id", "group_key", "is_read", "count", "created_at", "batch")
+        on_insert = {k: v for k, v in notif_dict.items() if k not in skip}
+        return UpdateOne(
+            {
+                "user_id": notif_dict["user_id"],
+                "group_key": notif_dict["group_key"],
+                "is_read": False,
+                "batches": {"$ne": notif_dict["batch"]}
+            },
+            {
+                "$setOnInsert": on_insert,
+                "$set": {"created_at": notif_dict["created_at"]},
+                "$inc": {"count": notif_dict["count"]},
+                "$push": {"batches": {"$each": [notif_dict["batch"]], "$slice": -NOTIFICATION_BATCH_HISTORY}}
+            },
+            upsert=True
+        )
+
+    async def flush(self, db: AsyncIOMotorDatabase) -> int:
+        if not self._plain and not self._grouped and not self._retry:
+            return 0
+
+        retry, self._retry = self._retry, []
+        plain, self._plain = self._plain, []
+        grouped, self._grouped = self._grouped, {}
+        batch = retry + plain + list(grouped.values())
+        try:
+            await self.write(db, batch)
+        except Exception:
+            # Replayed unchanged, never merged into newer counts, so the
+            # batch ids still say which increments already landed
+            self._retry = batch + self._retry
+            raise
+
+        self.stats["flushes"] += 1
+        return len(batch)
+
+    def start(self, db: AsyncIOMotorDatabase, interval: float = NOTIFICATION_FLUSH_INTERVAL):
+        if self._task is None:
+            self._task = PeriodicTask("notification-flush", interval, lambda: self.flush(db))
+        self._task.start()
+
+    async def stop(self):
+        if self._task is not None:
+            await self._task.stop(final=True)
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "pending": len(self._plain) + len(self._grouped) + len(self._retry)}
+
+
+notification_service = NotificationService()
@@ -0,0 +1,110 @@
+from fastapi import HTTPException, status
+from datetime import datetime
+from typing import Optional
+import base64
+import json
+
+# Keyset (cursor) pagination. A cursor is an opaque token holding the sort
+# value and id of the last item of a page; the next page is everything that
+# sorts strictly after that (sort value, id) pair, so the database seeks
+# straight to it through the index instead of skipping over earlier pages.
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and "$date" in value:
+        return datetime.fromisoformat(value["$date"])
+    return value
+
+
+def _get_field(doc: dict, field: str):
+    for part in field.split("."):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(part)
+    return doc
+
+
+def encode_cursor(doc: dict, sort_field: str) -> str:
+    payload = json.dumps([_encode_value(_get_field(doc, sort_field)), doc["id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        value, last_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return _decode_value(value), last_id
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+def sort_spec(sort_field: str, sort_direction: int) -> list:
+    # id breaks ties so that the order is total and cursors are stable
+    return [(sort_field, sort_direction), ("id", sort_direction)]
+
+
+def apply_cursor(query: dict, sort_field: str, sort_direction: int, cursor: Optional[str]) -> dict:
+    if not cursor:
+        return query
+
+    value, last_id = decode_cursor(cursor)
+    op = "$lt" if sort_direction < 0 else "$gt"
+    if value is None:
+        # Missing values sort first ascending and last descending
+        after = {"$or": [
+            {sort_field: {"$ne": None}},
+            {sort_field: None, "id": {op: last_id}}
+        ]} if sort_direction > 0 else {sort_field: None, "id": {op: last_id}}
+    else:
+        after = {"$or": [
+            {sort_field: {op: value}},
+            {sort_field: value, "id": {op: last_id}}
+        ]}
+        if sort_direction < 0:
+            # Comparisons never match missing values, which come after every value here
+            after["$or"].append({sort_field: None})
+    if not query:
+        return after
+    return {"$and": [query, after]}
+
+
+def next_cursor(items: list, sort_field: str, limit: int) -> Optional[str]:
+    if limit <= 0 or len(items) < limit:
+        return None
+    return encode_cursor(items[-1], sort_field)
+
+
+# Runs a paginated find: keyset mode when a cursor is given, skip/limit
+# otherwise. Returns the page and the cursor for the page after it. With
+# peek, one extra item is fetched so the cursor is only returned when
+# another page really exists.
+async def find_page(
+    collection,
+    query: dict,
+    sort_field: str,
+    sort_direction: int,
+    skip: int = 0,
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    projection: Optional[dict] = None,
+    peek: bool = False
+):
+    find_cursor = collection.find(
+        apply_cursor(query, sort_field, sort_direction, cursor),
+        projection or {"_id": 0}
+    ).sort(sort_spec(sort_field, sort_direction))
+    if skip and not cursor:
+        find_cursor = find_cursor.skip(skip)
+    fetch = limit + 1 if peek and limit > 0 else limit
+    items = await find_cursor.limit(fetch).to_list(length=fetch)
+    if fetch > limit:
+        if len(items) <= limit:
+            return items, None
+        items = items[:limit]
+    return items, next_cursor(items, sort_field, limit)
@@ -0,0 +1,128 @@
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument, UpdateOne
+import logging
+import os
+
+from utils.masters import propagate_master_summary, MASTER_SUMMARY_PROJECTION
+
+logger = logging.getLogger(__name__)
+
+RATING_RECONCILE_INTERVAL = float(os.environ.get("RATING_RECONCILE_INTERVAL", "3600"))
+
+# Rating state is kept on users (per master) and services: rating_sum,
+# total_reviews and rating_histogram {"1".."5": count}; rating is derived
+# from them. Both targets are computed the same way from the reviews
+# collection, keyed by these fields.
+RATING_TARGETS = {
+    "users": "master_id",
+    "services": "service_id",
+}
+
+
+# Apply a new review to the service and the master. Each target's state is
+# recomputed from the reviews collection instead of incremented, so a
+# retried job, a partial failure between the two writes or a reconciliation
+# running alongside can never count a review twice. Returns the updated
+# master document (summary and rating fields), or None when a newer state
+# was already stored.
+async def apply_review_rating(db: AsyncIOMotorDatabase, review: dict):
+    await refresh_rating(db, "services", review["service_id"])
+    return await refresh_rating(
+        db, "users", review["master_id"], projection={**MASTER_SUMMARY_PROJECTION, "rating_histogram": 1}
+    )
+
+
+async def refresh_rating(db: AsyncIOMotorDatabase, collection_name: str, target_id: str, projection: dict = None):
+    key = RATING_TARGETS[collection_name]
+    histogram = {}
+    async for row in db.reviews.aggregate([
+        {"$match": {key: target_id}},
+        {"$group": {"_id": "$rating", "count": {"$sum": 1}}}
+    ]):
+        histogram[str(row["_id"])] = row["count"]
+    state = _expected_state(histogram)
+    # Reviews are only ever added, so a state counting fewer of them is
+    # stale: a slower job that read before a newer one must not overwrite it
+    return await db[collection_name].find_one_and_update(
+        {"id": target_id, "$or": [
+            {"total_reviews": {"$lte": state["total_reviews"]}},
+            {"total_reviews": {"$exists": False}}
+        ]},
+        {"$set": state},
+        projection=projection or {"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def _expected_state(histogram: dict) -> dict:
+    total = sum(histogram.values())
+    rating_sum = sum(int(star) * count for star, count in histogram.items())
+    return {
+        "rating": round(rating_sum / total, 2) if total else 0.0,
+        "rating_sum": rating_sum,
+        "total_reviews": total,
+        "rating_histogram": {star: count for star, count in sorted(histogram.items())},
+    }
+
+
+def _actual_state(doc: dict) -> dict:
+    return {
+        "rating": round(doc.get("rating") or 0.0, 2),
+        "rating_sum": doc.get("rating_sum", 0),
+        "total_reviews": doc.get("total_reviews", 0),
+        "rating_histogram": {star: count for star, count in sorted((doc.get("rating_histogram") or {}).items()) if count},
+    }
+
+
+# Recompute rating state from the reviews collection and report documents
+# whose stored state drifted. With fix=True the drifted documents are reset;
+# the update is conditional on the values that were read, so a review
+# applied concurrently is never overwritten (it is picked up next run).
+async def reconcile_ratings(db: AsyncIOMotorDatabase, fix: bool = False, batch_size: int = 500) -> dict:
+    report = {}
+
+    for collection_name, key in RATING_TARGETS.items():
+        histograms = {}
+        pipeline = [{"$group": {"_id": {"target": f"${key}", "rating": "$rating"}, "count": {"$sum": 1}}}]
+        async for row in db.reviews.aggregate(pipeline):
+            target_id = row["_id"]["target"]
+            histograms.setdefault(target_id, {})[str(row["_id"]["rating"])] = row["count"]
+
+        query = {"$or": [{"id": {"$in": list(histograms)}}, {"total_reviews": {"$gt": 0}}]}
+        projection = {"_id": 0, "id": 1, "rating": 1, "rating_sum": 1, "total_reviews": 1, "rating_histogram": 1}
+
+        drift, operations = [], []
+        async for doc in db[collection_name].find(query, projection):
+            expected = _expected_state(histograms.get(doc["id"], {}))
+            actual = _actual_state(doc)
+            if expected == actual:
+                continue
+
+            drift.append({"id": doc["id"], "expected": expected, "actual": actual})
+            if fix:
+                operations.append(UpdateOne(
+                    {"id": doc["id"], "total_reviews": doc.get("total_reviews"), "rating_sum": doc.get("rating_sum")},
+                    {"$set": expected}
+                ))
+            if len(operations) >= batch_size:
+                await db[collection_name].bulk_write(operations, ordered=False)
+                operations = []
+
+        if operations:
+            await db[collection_name].bulk_write(operations, ordered=False)
+
+        if fix and collection_name == "users":
+            for item in drift:
+                await propagate_master_summary(db, item["id"])
+
+        report[collection_name] = drift
+
+    return report
+
+
+# Periodic job entry point: fix drift and log how much was found
+async def run_rating_reconciliation(db: AsyncIOMotorDatabase):
+    report = await reconcile_ratings(db, fix=True)
+    for collection_name, drift in report.items():
+        if drift:
+            logger.warning("Rating drift fixed on %d %s", len(drift), collection_name)
@@ -0,0 +1,177 @@
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from fastapi.encoders import jsonable_encoder
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+from datetime import datetime, timezone
+from typing import Iterable
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+EVENT_BROKER = os.environ.get("EVENT_BROKER", "local")
+EVENT_QUEUE_SIZE = int(os.environ.get("EVENT_QUEUE_SIZE", "100"))
+EVENT_COLLECTION_BYTES = int(os.environ.get("EVENT_COLLECTION_BYTES", str(16 * 1024 * 1024)))
+EVENT_HEARTBEAT_INTERVAL = float(os.environ.get("EVENT_HEARTBEAT_INTERVAL", "25"))
+
+
+class ConnectionRegistry:
+    # Open push connections of this process: user id -> one queue per
+    # connection (a user may have several tabs). A connection that does not
+    # keep up has its oldest events dropped rather than blocking publishers.
+
+    def __init__(self, queue_size: int = EVENT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._connections = {}
+        self.stats = {"delivered": 0, "dropped": 0}
+
+    def connect(self, user_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(self.queue_size)
+        self._connections.setdefault(user_id, set()).add(queue)
+        return queue
+
+    def disconnect(self, user_id: str, queue: asyncio.Queue):
+        queues = self._connections.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._connections[user_id]
+
+    def deliver(self, user_ids: Iterable[str], event: dict):
+        for user_id in user_ids:
+            for queue in self._connections.get(user_id, ()):
+                if queue.full():
+                    queue.get_nowait()
+                    self.stats["dropped"] += 1
+                queue.put_nowait(event)
+                self.stats["delivered"] += 1
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            "users": len(self._connections),
+            "connections": sum(len(queues) for queues in self._connections.values()),
+        }
+
+
+class LocalBroker:
+    # Single-process fan-out: events go straight to this process' registry.
+    # Used in development and tests.
+
+    def __init__(self, registry: ConnectionRegistry):
+        self.registry = registry
+
+    async def start(self, db: AsyncIOMotorDatabase):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, user_ids: list, event: dict):
+        self.registry.deliver(user_ids, event)
+
+
+class MongoBroker:
+    # Fan-out across uvicorn workers through a capped collection. publish()
+    # inserts the event; every process tails the collection and delivers
+    # what it reads to its own registry, so no extra infrastructure is
+    # needed beyond the database the app already uses.
+
+    def __init__(self, registry: ConnectionRegistry, size: int = EVENT_COLLECTION_BYTES):
+        self.registry = registry
+        self.size = size
+        self._db = None
+        self._task = None
+
+    async def start(self, db: AsyncIOMotorDatabase):
+        self._db = db
+        try:
+            await db.create_collection("events", capped=True, size=self.size)
+        except CollectionInvalid:
+            pass
+        if self._task is None:
+            self._task = asyncio.create_task(self._tail(), name="event-broker-tail")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def publish(self, user_ids: list, event: dict):
+        await self._db.events.insert_one({
+            "user_ids": list(user_ids),
+            "event": event,
+            "created_at": datetime.now(timezone.utc)
+        })
+
+    async def _tail(self):
+        # Events are read in natural (insertion) order, the order a tailable
+        # cursor returns. ObjectIds from different writers are not ordered,
+        # so resuming with $gt on _id could skip events; instead a reopened
+        # cursor replays the collection and skips up to the last delivered
+        # event. Only events published after startup are delivered.
+        last = await self._db.events.find_one(sort=[("$natural", -1)], projection={"_id": 1})
+        last_id = last["_id"] if last else None
+
+        while True:
+            if last_id is not None and await self._db.events.find_one({"_id": last_id}, {"_id": 1}) is None:
+                # Overwritten by newer events: replay what the collection still holds
+                logger.warning("Event broker fell behind the capped events collection, some events were lost")
+                last_id = None
+            skipping = last_id is not None
+            cursor = self._db.events.find({}, cursor_type=CursorType.TAILABLE_AWAIT)
+            try:
+                async for doc in cursor:
+                    if skipping:
+                        skipping = doc["_id"] != last_id
+                        continue
+                    last_id = doc["_id"]
+                    self.registry.deliver(doc["user_ids"], doc["event"])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Event broker tail failed, reconnecting")
+            # A tailable cursor dies on an empty collection; retry shortly
+            await asyncio.sleep(1)
+
+
+BROKERS = {
+    "local": LocalBroker,
+    "mongo": MongoBroker,
+}
+
+
+class EventBus:
+    # Entry point for routers: publish(user_ids, type, data) pushes an event
+    # to every open connection of those users, whichever worker holds it.
+
+    def __init__(self, broker_name: str = EVENT_BROKER):
+        self.registry = ConnectionRegistry()
+        if broker_name not in BROKERS:
+            raise ValueError(f"Unknown EVENT_BROKER {broker_name!r}, expected one of {sorted(BROKERS)}")
+        self.broker = BROKERS[broker_name](self.registry)
+
+    async def start(self, db: AsyncIOMotorDatabase):
+        await self.broker.start(db)
+
+    async def stop(self):
+        await self.broker.stop()
+
+    async def publish(self, user_ids: Iterable[str], event_type: str, data: dict):
+        event = {"type": event_type, "data": jsonable_encoder(data)}
+        try:
+            await self.broker.publish(list(user_ids), event)
+        except Exception:
+            # Push is best effort: clients resync through the REST endpoints
+            logger.exception("Failed to publish %s event", event_type)
+
+    def get_stats(self) -> dict:
+        return {"broker": type(self.broker).__name__, **self.registry.get_stats()}
+
+
+event_bus = EventBus()
@@ -1,9 +1,100 @@
+from fastapi import HTTPException, status
 from passlib.context import CryptContext
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+import asyncio
+import os
+import time
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_QUEUE = int(os.environ.get("PASSWORD_HASH_MAX_QUEUE", "64"))
+
+# min == max == default: a hash made with any other cost needs an update,
+# so changing BCRYPT_ROUNDS rehashes passwords on the next login
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS
+)
 
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
+
+
+class PasswordHasher:
+    # Runs bcrypt on a dedicated thread pool (bcrypt releases the GIL), so a
+    # burst of logins no longer blocks the event loop. The number of calls
+    # waiting or running is capped; past that requests get 503 instead of
+    # queueing for seconds.
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_queue: int = PASSWORD_HASH_MAX_QUEUE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = None
+        self._pending = 0
+        self.stats = {"completed": 0, "rejected": 0, "rehashed": 0, "wait_ms_total": 0.0, "run_ms_total": 0.0}
+
+    async def _run(self, func, *args):
+        if self._pending >= self.workers + self.max_queue:
+            self.stats["rejected"] += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many authentication requests, try again shortly",
+                headers={"Retry-After": "1"}
+            )
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="password-hash")
+
+        def timed():
+            # Timings are returned so stats are only touched on the loop thread
+            started = time.perf_counter()
+            return func(*args), started, time.perf_counter()
+
+        queued_at = time.perf_counter()
+        self._pending += 1
+        try:
+            result, started, finished = await asyncio.get_running_loop().run_in_executor(self._executor, timed)
+        finally:
+            self._pending -= 1
+        self.stats["completed"] += 1
+        self.stats["wait_ms_total"] += (started - queued_at) * 1000
+        self.stats["run_ms_total"] += (finished - started) * 1000
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self._run(pwd_context.hash, password)
+
+    # Returns (valid, new_hash); new_hash is set when the stored hash was made
+    # with another cost and should be replaced
+    async def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        valid, new_hash = await self._run(pwd_context.verify_and_update, password, hashed_password)
+        if new_hash:
+            self.stats["rehashed"] += 1
+        return valid, new_hash
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def get_stats(self) -> dict:
+        completed = self.stats["completed"] or 1
+        return {
+            "workers": self.workers,
+            "queue_depth": max(self._pending - self.workers, 0),
+            "in_flight": self._pending,
+            "completed": self.stats["completed"],
+            "rejected": self.stats["rejected"],
+            "rehashed": self.stats["rehashed"],
+            "avg_wait_ms": round(self.stats["wait_ms_total"] / completed, 2),
+            "avg_run_ms": round(self.stats["run_ms_total"] / completed, 2),
+        }
+
+
+password_hasher = PasswordHasher()
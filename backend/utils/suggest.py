@@ -0,0 +1,235 @@
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from datetime import datetime, timezone
+from array import array
+import asyncio
+import logging
+import math
+import numpy as np
+import os
+import re
+import sys
+import time
+
+from models.service import ServiceCategory
+
+logger = logging.getLogger(__name__)
+
+SUGGEST_MAX_ENTRIES = int(os.environ.get("SUGGEST_MAX_ENTRIES", "200000"))
+SUGGEST_REFRESH_INTERVAL = float(os.environ.get("SUGGEST_REFRESH_INTERVAL", "30"))
+# Hard deletes made by other workers are only seen by a full rebuild
+SUGGEST_REBUILD_INTERVAL = float(os.environ.get("SUGGEST_REBUILD_INTERVAL", "900"))
+SUGGEST_MIN_SCORE = float(os.environ.get("SUGGEST_MIN_SCORE", "0.5"))
+MAX_TEXT_LENGTH = 100
+
+CATEGORY_LABELS = {
+    ServiceCategory.KNITTING: "Вязание",
+    ServiceCategory.EMBROIDERY: "Вышивка",
+    ServiceCategory.SEWING: "Шитье",
+    ServiceCategory.FELTING: "Валяние",
+    ServiceCategory.JEWELRY: "Украшения",
+    ServiceCategory.POTTERY: "Керамика",
+    ServiceCategory.WOODWORKING: "Работа по дереву",
+    ServiceCategory.PAINTING: "Живопись",
+    ServiceCategory.SOAP_MAKING: "Мыловарение",
+    ServiceCategory.OTHER: "Другое",
+}
+
+_NON_WORD = re.compile(r"[^\w]+")
+
+
+def normalize(text: str) -> str:
+    text = _NON_WORD.sub(" ", text.lower().replace("ё", "е"))
+    return " ".join(text.replace("_", " ").split())[:MAX_TEXT_LENGTH]
+
+
+def trigrams(text: str, partial_last: bool = False) -> set:
+    # pg_trgm style: each word padded with two spaces in front and one
+    # behind. While the user is still typing, the last word's closing
+    # trigram is left out so "свит" fully matches "свитер".
+    grams = set()
+    words = text.split()
+    for i, word in enumerate(words):
+        padded = f"  {word} "
+        if partial_last and i == len(words) - 1:
+            padded = padded[:-1]
+        grams.update(padded[j:j + 3] for j in range(len(padded) - 2))
+    return grams
+
+
+class SuggestIndex:
+    # In-process trigram index over service titles, master names and
+    # category labels for the search box. A query is scored by the share of
+    # its trigrams an entry contains, which tolerates a wrong, missing or
+    # extra letter. Entries live in integer slots and each trigram's
+    # postings are a compact int array, so a query is one numpy bincount
+    # over the postings of its trigrams. Updates take a new slot and leave
+    # the old one dead until the next compaction. A periodic refresh picks
+    # up writes made by other workers.
+
+    def __init__(self, max_entries: int = SUGGEST_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._reset()
+        self._synced_at = None
+        self._built_at = 0.0
+        self.stats = {"queries": 0, "dropped": 0, "rebuilds": 0, "compactions": 0, "query_us_total": 0.0}
+
+    def _reset(self):
+        self._slots = {}
+        self._keys = []
+        self._texts = []
+        self._gram_counts = array("H")
+        self._alive = bytearray()
+        self._postings = {}
+
+    def _add(self, key: tuple, text: str):
+        norm = normalize(text or "")
+        self._remove(key)
+        if not norm:
+            return
+        if len(self._slots) >= self.max_entries:
+            self.stats["dropped"] += 1
+            return
+        slot = len(self._keys)
+        grams = trigrams(norm)
+        self._slots[key] = slot
+        self._keys.append(key)
+        self._texts.append(text[:MAX_TEXT_LENGTH])
+        self._gram_counts.append(len(grams))
+        self._alive.append(1)
+        for gram in grams:
+            postings = self._postings.get(gram)
+            if postings is None:
+                postings = self._postings[gram] = array("i")
+            postings.append(slot)
+
+    def _remove(self, key: tuple):
+        slot = self._slots.pop(key, None)
+        if slot is not None:
+            self._alive[slot] = 0
+            self._texts[slot] = None
+
+    def compact(self):
+        # Drops dead slots and their postings by re-adding the live entries
+        live = [(key, self._texts[slot]) for key, slot in self._slots.items()]
+        self._reset()
+        for key, text in live:
+            self._add(key, text)
+        self.stats["compactions"] += 1
+
+    def add_service(self, service: dict):
+        key = ("service", service["id"])
+        if service.get("is_active", True):
+            self._add(key, service.get("title"))
+        else:
+            self._remove(key)
+
+    def remove_service(self, service_id: str):
+        self._remove(("service", service_id))
+
+    def add_master(self, user: dict):
+        self._add(("master", user["id"]), user.get("name"))
+
+    def _add_categories(self):
+        for category, label in CATEGORY_LABELS.items():
+            self._add(("category", category.value), label)
+
+    def search(self, query: str, limit: int = 8) -> list:
+        started = time.perf_counter()
+        grams = trigrams(normalize(query), partial_last=True)
+        postings = [self._postings[gram] for gram in grams if gram in self._postings]
+        results = []
+        if postings:
+            slots = len(self._keys)
+            hits = np.bincount(
+                np.concatenate([np.frombuffer(p, dtype=np.int32) for p in postings]), minlength=slots
+            )
+            alive = np.frombuffer(self._alive, dtype=np.uint8)
+            candidates = np.flatnonzero((hits >= math.ceil(SUGGEST_MIN_SCORE * len(grams))) & (alive == 1))
+            if len(candidates):
+                counts = hits[candidates]
+                # Among equal coverage, prefer entries closer in length to the query
+                dice = 2 * counts / (len(grams) + np.frombuffer(self._gram_counts, dtype=np.uint16)[candidates])
+                scores = counts / len(grams) + 0.1 * dice
+                top = min(len(candidates), limit * 2)
+                order = np.argpartition(-scores, top - 1)[:top]
+                order = order[np.argsort(-scores[order], kind="stable")]
+
+                seen = set()
+                for i in order:
+                    slot = int(candidates[i])
+                    kind, entry_id = self._keys[slot]
+                    text = self._texts[slot]
+                    if (kind, text) in seen:
+                        continue
+                    seen.add((kind, text))
+                    results.append({"type": kind, "id": entry_id, "text": text, "score": round(float(scores[i]), 3)})
+                    if len(results) >= limit:
+                        break
+
+        self.stats["queries"] += 1
+        self.stats["query_us_total"] += (time.perf_counter() - started) * 1e6
+        return results
+
+    async def build(self, db: AsyncIOMotorDatabase):
+        # Filled off to the side and swapped in, so queries never see a half
+        # built index; writes during the build are caught by the next refresh
+        synced_at = datetime.now(timezone.utc)
+        fresh = SuggestIndex(self.max_entries)
+        fresh._add_categories()
+        loaded = 0
+        async for user in db.users.find({"role": "master"}, {"_id": 0, "id": 1, "name": 1}):
+            fresh.add_master(user)
+            loaded += 1
+            if loaded % 2000 == 0:
+                await asyncio.sleep(0)
+        async for service in db.services.find({"is_active": True}, {"_id": 0, "id": 1, "title": 1, "is_active": 1}):
+            fresh.add_service(service)
+            loaded += 1
+            if loaded % 2000 == 0:
+                await asyncio.sleep(0)
+
+        self._slots, self._keys, self._texts = fresh._slots, fresh._keys, fresh._texts
+        self._gram_counts, self._alive, self._postings = fresh._gram_counts, fresh._alive, fresh._postings
+        self.stats["dropped"] = fresh.stats["dropped"]
+        self.stats["rebuilds"] += 1
+        self._synced_at = synced_at
+        self._built_at = time.monotonic()
+
+    async def refresh(self, db: AsyncIOMotorDatabase):
+        if self._synced_at is None or time.monotonic() - self._built_at > SUGGEST_REBUILD_INTERVAL:
+            await self.build(db)
+            return
+        synced_at = datetime.now(timezone.utc)
+        changed = {"updated_at": {"$gt": self._synced_at}}
+        async for user in db.users.find({**changed, "role": "master"}, {"_id": 0, "id": 1, "name": 1}):
+            self.add_master(user)
+        async for service in db.services.find(changed, {"_id": 0, "id": 1, "title": 1, "is_active": 1}):
+            self.add_service(service)
+        self._synced_at = synced_at
+        dead = len(self._keys) - len(self._slots)
+        if dead > 1000 and dead > len(self._slots):
+            self.compact()
+
+    def get_stats(self) -> dict:
+        queries = self.stats["queries"] or 1
+        approx_bytes = (
+            sys.getsizeof(self._slots) + sys.getsizeof(self._postings)
+            + sum(sys.getsizeof(postings) for postings in self._postings.values())
+            + sum(sys.getsizeof(text) for text in self._texts if text)
+            + len(self._keys) * 120 + len(self._gram_counts) * 3
+        )
+        return {
+            "entries": len(self._slots),
+            "dead_slots": len(self._keys) - len(self._slots),
+            "max_entries": self.max_entries,
+            "trigrams": len(self._postings),
+            "approx_bytes": approx_bytes,
+            "queries": self.stats["queries"],
+            "avg_query_us": round(self.stats["query_us_total"] / queries, 1),
+            "dropped": self.stats["dropped"],
+            "rebuilds": self.stats["rebuilds"],
+            "compactions": self.stats["compactions"],
+        }
+
+
+suggest_index = SuggestIndex()
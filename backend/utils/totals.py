@@ -0,0 +1,78 @@
+from collections import OrderedDict
+from typing import Literal, Optional
+import json
+import os
+import time
+
+COUNT_CACHE_TTL = float(os.environ.get("COUNT_CACHE_TTL", "15"))
+COUNT_CACHE_SIZE = int(os.environ.get("COUNT_CACHE_SIZE", "10000"))
+
+# ?total= on paginated listings: exact counts every request, estimate may be
+# up to COUNT_CACHE_TTL stale, none skips counting and reports has_more
+TotalMode = Literal["exact", "estimate", "none"]
+
+
+def normalize_filter(query: dict) -> str:
+    # Key order does not change what a filter matches
+    return json.dumps(query, sort_keys=True, default=str, separators=(",", ":"))
+
+
+class CountCache:
+    # Short-lived LRU of count_documents results keyed by collection and
+    # normalized filter. Writes do not invalidate it: paging through a
+    # listing sees one total instead of a count per page, and the TTL
+    # bounds how far it can drift.
+
+    def __init__(self, max_entries: int = COUNT_CACHE_SIZE, ttl: float = COUNT_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "estimated": 0}
+
+    def get(self, key: str) -> Optional[int]:
+        entry = self._entries.get(key)
+        if entry is None or entry[1] <= time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.stats["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return entry[0]
+
+    def set(self, key: str, total: int):
+        self._entries[key] = (total, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get_stats(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else 0.0,
+            "entries": len(self._entries),
+        }
+
+
+count_cache = CountCache()
+
+
+# Total for a listing in the requested mode (None for "none"). `trivial`
+# marks filters that match (nearly) the whole collection, which estimate
+# answers from collection metadata without touching an index.
+async def count_total(collection, query: dict, mode: str, trivial: bool = False) -> Optional[int]:
+    if mode == "none":
+        return None
+    if mode == "exact":
+        return await collection.count_documents(query)
+
+    if trivial or not query:
+        count_cache.stats["estimated"] += 1
+        return await collection.estimated_document_count()
+    key = f"{collection.name}:{normalize_filter(query)}"
+    total = count_cache.get(key)
+    if total is None:
+        total = await collection.count_documents(query)
+        count_cache.set(key, total)
+    return total
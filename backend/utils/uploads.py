@@ -0,0 +1,109 @@
+from fastapi import HTTPException, UploadFile, status
+from starlette.responses import JSONResponse
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pathlib import Path
+from typing import Iterable, Tuple
+import anyio
+import hashlib
+import os
+import uuid
+
+from utils.blobs import acquire_blob
+
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", str(256 * 1024)))
+# Room for multipart boundaries and part headers on top of the file bytes
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+def too_large(detail: str) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=detail)
+
+
+class UploadSizeLimitMiddleware:
+    # Caps request bodies per path prefix before the multipart parser spools
+    # them: a declared Content-Length over the limit is refused without
+    # reading anything, and chunked or lying clients are cut off as soon as
+    # the running byte count crosses it.
+
+    def __init__(self, app, limits: Iterable[Tuple[str, int]]):
+        self.app = app
+        self.limits = list(limits)
+
+    def _limit_for(self, path: str):
+        for prefix, limit in self.limits:
+            if path.startswith(prefix):
+                return limit
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT"):
+            await self.app(scope, receive, send)
+            return
+        limit = self._limit_for(scope["path"])
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        detail = f"Request body too large. Max size is {limit // (1024 * 1024)}MB"
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                try:
+                    declared = int(value)
+                except ValueError:
+                    declared = 0
+                if declared > limit:
+                    response = JSONResponse({"detail": detail}, status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+                    await response(scope, receive, send)
+                    return
+                break
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Raised inside the route's body parsing, so FastAPI turns it into a 413
+                    raise too_large(detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+async def save_upload(db: AsyncIOMotorDatabase, file: UploadFile, directory: Path, ext: str, max_size: int) -> str:
+    # Copy the spooled upload in chunks to a temp file next to the target,
+    # hashing it on the way; the file is stored under its SHA-256, so equal
+    # uploads share one file. Returns the stored filename.
+    temp_path = directory / f".{uuid.uuid4().hex}.part"
+    digest = hashlib.sha256()
+    written = 0
+    try:
+        async with await anyio.open_file(temp_path, "wb") as out:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > max_size:
+                    raise too_large(f"File {file.filename} is too large. Max size is {max_size // (1024 * 1024)}MB")
+                digest.update(chunk)
+                await out.write(chunk)
+
+        filename = f"{digest.hexdigest()}{ext}"
+        await acquire_blob(db, f"{directory.name}/{filename}", written)
+        # Renaming over an existing copy is harmless (same bytes) and also
+        # restores a file the collector set aside a moment ago
+        await anyio.to_thread.run_sync(os.replace, temp_path, directory / filename)
+    except BaseException:
+        await anyio.to_thread.run_sync(remove_file, temp_path)
+        raise
+    return filename
+
+
+def remove_file(path: Path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,114 @@
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+import hashlib
+import logging
+import math
+import os
+
+from utils.tasks import PeriodicTask
+from utils.cache import response_cache
+
+logger = logging.getLogger(__name__)
+
+VIEW_DEDUP_CAPACITY = int(os.environ.get("VIEW_DEDUP_CAPACITY", "1000000"))
+VIEW_DEDUP_ERROR_RATE = float(os.environ.get("VIEW_DEDUP_ERROR_RATE", "0.001"))
+VIEW_FLUSH_INTERVAL = float(os.environ.get("VIEW_FLUSH_INTERVAL", "10"))
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+    def add(self, key: str):
+        for p in self._positions(key):
+            self.bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+
+class ViewCounter:
+    # Buffers service views in process. (service, client) pairs are deduped
+    # with two rotating Bloom filters: when the current one reaches capacity
+    # it becomes the previous one and a fresh filter takes its place, which
+    # bounds memory to two filters while still remembering recent viewers.
+    # Aggregated per-service deltas are flushed with one unordered bulk_write.
+
+    def __init__(self, capacity: int = VIEW_DEDUP_CAPACITY, error_rate: float = VIEW_DEDUP_ERROR_RATE):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._current = BloomFilter(capacity, error_rate)
+        self._previous = None
+        self._pending = {}
+        self._task = None
+        self.stats = {"recorded": 0, "duplicates": 0, "flushed": 0, "flushes": 0}
+
+    def record(self, service_id: str, client_id: str) -> bool:
+        key = f"{service_id}:{client_id}"
+        if key in self._current or (self._previous is not None and key in self._previous):
+            self.stats["duplicates"] += 1
+            return False
+
+        if self._current.count >= self.capacity:
+            self._previous = self._current
+            self._current = BloomFilter(self.capacity, self.error_rate)
+        self._current.add(key)
+
+        self._pending[service_id] = self._pending.get(service_id, 0) + 1
+        self.stats["recorded"] += 1
+        return True
+
+    def pending(self, service_id: str) -> int:
+        return self._pending.get(service_id, 0)
+
+    async def flush(self, db: AsyncIOMotorDatabase) -> int:
+        if not self._pending:
+            return 0
+
+        pending, self._pending = self._pending, {}
+        operations = [UpdateOne({"id": service_id}, {"$inc": {"views": count}}) for service_id, count in pending.items()]
+        try:
+            await db.services.bulk_write(operations, ordered=False)
+        except Exception:
+            # Put the deltas back so the next flush retries them
+            for service_id, count in pending.items():
+                self._pending[service_id] = self._pending.get(service_id, 0) + count
+            raise
+
+        # Cached service responses hold views from before the flush; once the
+        # pending deltas are gone they would show a lower count until the TTL
+        response_cache.invalidate(*(f"service:{service_id}" for service_id in pending))
+        self.stats["flushed"] += sum(pending.values())
+        self.stats["flushes"] += 1
+        return len(operations)
+
+    def start(self, db: AsyncIOMotorDatabase, interval: float = VIEW_FLUSH_INTERVAL):
+        if self._task is None:
+            self._task = PeriodicTask("view-counter-flush", interval, lambda: self.flush(db))
+        self._task.start()
+
+    async def stop(self):
+        if self._task is not None:
+            await self._task.stop(final=True)
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            "pending_services": len(self._pending),
+            "pending_views": sum(self._pending.values()),
+            "filter_bytes": len(self._current.bits) * (2 if self._previous is not None else 1),
+        }
+
+
+view_counter = ViewCounter()
@@ -0,0 +1,49 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+# database.py connects lazily, so any URL will do; every test gets its own
+# in-memory database through the get_db override below
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+
+from fastapi.testclient import TestClient
+from mongomock_motor import AsyncMongoMockClient
+
+import database
+import server
+from utils import create_access_token
+from utils.cache import response_cache
+from utils.views import view_counter
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def db():
+    mock_db = AsyncMongoMockClient(tz_aware=True)["test"]
+    server.app.dependency_overrides[database.get_db] = lambda: mock_db
+    response_cache.clear()
+    view_counter._pending.clear()
+    yield mock_db
+    server.app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def client(db):
+    # Not entered as a context manager: startup would start the background
+    # workers against the real database
+    return TestClient(server.app)
+
+
+@pytest.fixture
+def auth_headers():
+    def make(user_id: str, role: str = "customer") -> dict:
+        token = create_access_token({"sub": user_id, "email": f"{user_id}@example.com", "role": role})
+        return {"Authorization": f"Bearer {token}"}
+    return make
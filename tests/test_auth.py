@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from utils.auth import TokenRevocations, token_digest
+
+pytestmark = pytest.mark.anyio
+
+
+def token_entry(token: str, created_at: datetime) -> dict:
+    return {
+        "kind": "token",
+        "digest": token_digest(token),
+        "expires_at": created_at + timedelta(hours=1),
+        "created_at": created_at,
+    }
+
+
+async def test_sync_picks_up_an_entry_committed_out_of_order(db):
+    revocations = TokenRevocations()
+    now = datetime.now(timezone.utc)
+    await db.revoked_tokens.insert_one(token_entry("later", now))
+    await revocations.sync(db)
+
+    # Stamped before the watermark but committed after the first sync
+    await db.revoked_tokens.insert_one(token_entry("earlier", now - timedelta(seconds=2)))
+    await revocations.sync(db)
+
+    assert revocations.is_revoked(token_digest("earlier"), {})
+    assert revocations.is_revoked(token_digest("later"), {})
+
+
+async def test_sync_skips_entries_it_already_applied(db):
+    revocations = TokenRevocations()
+    await revocations.revoke_user(db, "user-1")
+    await revocations.sync(db)
+    await revocations.sync(db)
+
+    assert len(revocations._seen) == 1
+    assert revocations.is_revoked("other", {"sub": "user-1", "iat": 0})
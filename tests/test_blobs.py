@@ -0,0 +1,109 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from tests.test_services import seed_service
+
+pytestmark = pytest.mark.anyio
+
+BLOB_A = "services/" + "a" * 64 + ".jpg"
+BLOB_B = "services/" + "b" * 64 + ".jpg"
+AVATAR_A = "avatars/" + "c" * 64 + ".png"
+AVATAR_B = "avatars/" + "d" * 64 + ".png"
+
+
+def url(key: str) -> str:
+    return "/api/upload/" + key
+
+
+async def seed_blob(db, key: str, refs: int):
+    blob = {"_id": key, "refs": refs, "size": 10, "created_at": datetime.now(timezone.utc)}
+    if refs <= 0:
+        blob["orphaned_at"] = datetime.now(timezone.utc)
+    await db.blobs.insert_one(blob)
+
+
+async def refs(db, key: str) -> dict:
+    return await db.blobs.find_one({"_id": key})
+
+
+async def test_replacing_service_images_moves_references(db, client, auth_headers):
+    await seed_blob(db, BLOB_A, 1)
+    await seed_blob(db, BLOB_B, 0)
+    service = await seed_service(db, images=[url(BLOB_A)])
+
+    response = client.put(
+        f"/api/services/{service['id']}", json={"images": [url(BLOB_B), url(BLOB_B)]},
+        headers=auth_headers("master-1", "master")
+    )
+
+    assert response.status_code == 200
+    old, new = await refs(db, BLOB_A), await refs(db, BLOB_B)
+    assert old["refs"] == 0 and "orphaned_at" in old
+    assert new["refs"] == 2 and "orphaned_at" not in new
+
+
+async def test_unknown_upload_url_is_rejected(db, client, auth_headers):
+    await seed_blob(db, BLOB_A, 0)
+    service = await seed_service(db)
+
+    response = client.put(
+        f"/api/services/{service['id']}", json={"images": [url(BLOB_A), url(BLOB_B)]},
+        headers=auth_headers("master-1", "master")
+    )
+
+    assert response.status_code == 400
+    assert (await refs(db, BLOB_A))["refs"] == 0
+    assert (await db.services.find_one({"id": service["id"]}))["images"] == []
+
+
+async def test_create_and_delete_service_take_and_release_references(db, client, auth_headers):
+    await seed_blob(db, BLOB_A, 0)
+    payload = {
+        "title": "Керамическая ваза", "description": "Ваза ручной работы из глины",
+        "category": "pottery", "price": 2500, "images": [url(BLOB_A), "https://example.com/photo.jpg"]
+    }
+
+    created = client.post("/api/services", json=payload, headers=auth_headers("master-1", "master"))
+    assert created.status_code == 201
+    assert (await refs(db, BLOB_A))["refs"] == 1
+
+    deleted = client.delete(f"/api/services/{created.json()['id']}", headers=auth_headers("master-1", "master"))
+    assert deleted.status_code == 204
+    assert (await refs(db, BLOB_A))["refs"] == 0
+
+
+async def test_avatar_set_through_profile_update_is_refcounted(db, client, auth_headers):
+    await seed_blob(db, AVATAR_A, 1)
+    await seed_blob(db, AVATAR_B, 0)
+    await db.users.insert_one({"id": "user-1", "email": "user-1@example.com", "name": "Ольга", "role": "customer",
+                               "avatar": url(AVATAR_A), "created_at": datetime.now(timezone.utc)})
+
+    response = client.put("/api/users/me", json={"avatar": url(AVATAR_B)}, headers=auth_headers("user-1"))
+
+    assert response.status_code == 200
+    assert (await refs(db, AVATAR_A))["refs"] == 0
+    assert (await refs(db, AVATAR_B))["refs"] == 1
+
+
+async def test_deleting_an_image_pulls_it_and_releases_each_copy(db, client, auth_headers):
+    await seed_blob(db, BLOB_A, 2)
+    await seed_blob(db, BLOB_B, 1)
+    service = await seed_service(db, images=[url(BLOB_A), url(BLOB_B), url(BLOB_A)])
+    # Another request appended an image after this one could have read the list
+    await db.services.update_one({"id": service["id"]}, {"$push": {"images": "https://example.com/new.jpg"}})
+
+    response = client.delete(
+        f"/api/upload/service/{service['id']}/image", params={"image_url": url(BLOB_A)},
+        headers=auth_headers("master-1", "master")
+    )
+
+    assert response.status_code == 200
+    assert (await db.services.find_one({"id": service["id"]}))["images"] == [url(BLOB_B), "https://example.com/new.jpg"]
+    assert (await refs(db, BLOB_A))["refs"] == 0
+    assert (await refs(db, BLOB_B))["refs"] == 1
+    missing = client.delete(
+        f"/api/upload/service/{service['id']}/image", params={"image_url": url(BLOB_A)},
+        headers=auth_headers("master-1", "master")
+    )
+    assert missing.status_code == 404
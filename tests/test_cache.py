@@ -0,0 +1,34 @@
+import pytest
+
+import utils.cache
+from utils.cache import ResponseCache
+from utils.etag import etag_for
+
+
+def test_etag_is_stored_with_the_entry(monkeypatch):
+    cache = ResponseCache()
+    body = {"services": [{"id": "s1", "title": "Вязаный свитер"}]}
+    value, etag = cache.set_with_etag("/api/services?", body, 60, ["services"])
+    assert value == body
+    assert etag == etag_for(body)
+
+    def rehash(*parts):
+        raise AssertionError("cache hit re-hashed the body")
+
+    monkeypatch.setattr(utils.cache, "etag_for", rehash)
+    assert cache.get_with_etag("/api/services?") == (body, etag)
+    assert cache.get("/api/services?") == body
+
+    cache.invalidate("services")
+    assert cache.get_with_etag("/api/services?") is None
+
+
+@pytest.mark.anyio
+async def test_cached_profile_revalidates_with_the_stored_etag(db, client):
+    await db.users.insert_one({"id": "master-1", "name": "Анна", "email": "anna@example.com", "role": "master"})
+
+    first = client.get("/api/users/master-1")
+    assert first.status_code == 200
+    second = client.get("/api/users/master-1", headers={"If-None-Match": first.headers["etag"]})
+    assert second.status_code == 304
+    assert second.headers["etag"] == first.headers["etag"]
@@ -0,0 +1,119 @@
+import asyncio
+from datetime import datetime, timezone, timedelta
+
+import pytest
+
+import utils.jobs as jobs
+from utils.indexes import ensure_indexes
+from utils.jobs import JobQueue
+
+pytestmark = pytest.mark.anyio
+
+
+async def wait_for_status(db, job_id: str, expected: str, timeout: float = 5):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while True:
+        job = await db.jobs.find_one({"id": job_id})
+        if job["status"] == expected or asyncio.get_running_loop().time() > deadline:
+            return job
+        await asyncio.sleep(0.01)
+
+
+async def test_enqueue_is_idempotent_per_key(db):
+    await ensure_indexes(db, collections=["jobs"])
+    queue = JobQueue()
+
+    first = await queue.enqueue(db, "notify", {"n": 1}, idempotency_key="order:1:created")
+    second = await queue.enqueue(db, "notify", {"n": 2}, idempotency_key="order:1:created")
+
+    assert first is not None
+    assert second is None
+    assert await db.jobs.count_documents({}) == 1
+    assert queue.stats["duplicates"] == 1
+
+
+async def test_failed_job_is_retried_until_it_succeeds(db, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_BACKOFF_BASE", 0)
+    queue = JobQueue()
+    calls = []
+
+    @queue.handler("flaky")
+    async def flaky(db, payload):
+        calls.append(payload)
+        if len(calls) < 3:
+            raise RuntimeError("temporary")
+
+    job_id = await queue.enqueue(db, "flaky", {"n": 1})
+    queue.start(db, workers=1)
+    try:
+        job = await wait_for_status(db, job_id, "done")
+    finally:
+        await queue.drain()
+
+    assert job["status"] == "done"
+    assert job["attempts"] == 3
+    assert len(calls) == 3
+    assert queue.stats["retried"] == 2
+
+
+async def test_job_fails_permanently_after_max_attempts(db, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_BACKOFF_BASE", 0)
+    monkeypatch.setattr(jobs, "JOB_MAX_ATTEMPTS", 2)
+    queue = JobQueue()
+
+    @queue.handler("broken")
+    async def broken(db, payload):
+        raise RuntimeError("always")
+
+    job_id = await queue.enqueue(db, "broken", {})
+    queue.start(db, workers=1)
+    try:
+        job = await wait_for_status(db, job_id, "failed")
+    finally:
+        await queue.drain()
+
+    assert job["status"] == "failed"
+    assert job["attempts"] == 2
+    assert "always" in job["last_error"]
+
+
+async def test_expired_lock_is_claimed_again(db):
+    queue = JobQueue()
+    now = datetime.now(timezone.utc)
+    await db.jobs.insert_one({
+        "id": "stale", "type": "noop", "payload": {}, "idempotency_key": "stale", "status": "running",
+        "attempts": 1, "run_at": now - timedelta(minutes=5), "locked_until": now - timedelta(seconds=1),
+        "created_at": now, "updated_at": now
+    })
+    await db.jobs.insert_one({
+        "id": "locked", "type": "noop", "payload": {}, "idempotency_key": "locked", "status": "running",
+        "attempts": 1, "run_at": now - timedelta(minutes=5), "locked_until": now + timedelta(minutes=1),
+        "created_at": now, "updated_at": now
+    })
+
+    claimed = await queue._claim(db)
+
+    assert claimed["id"] == "stale"
+    assert claimed["attempts"] == 2
+    assert await queue._claim(db) is None
+
+
+async def test_run_once_skips_steps_done_by_an_earlier_attempt(db):
+    queue = JobQueue()
+    effects = []
+
+    async def step():
+        effects.append(1)
+        return "sent"
+
+    async def failing_step():
+        raise RuntimeError("boom")
+
+    assert await queue.run_once(db, "order:1:email", step) == "sent"
+    assert await queue.run_once(db, "order:1:email", step) is None
+    assert effects == [1]
+
+    with pytest.raises(RuntimeError):
+        await queue.run_once(db, "order:1:sms", failing_step)
+    # The marker is removed with the failure, so the retry runs the step
+    assert await queue.run_once(db, "order:1:sms", step) == "sent"
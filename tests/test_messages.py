@@ -0,0 +1,64 @@
+import uuid
+from datetime import datetime, timezone, timedelta
+
+import pytest
+
+from utils.migrations import backfill_last_message_at
+
+pytestmark = pytest.mark.anyio
+
+
+async def seed_order(db, created_at: datetime) -> dict:
+    order = {"id": str(uuid.uuid4()), "customer_id": "customer-1", "master_id": "master-1",
+             "service_id": "service-1", "status": "pending", "created_at": created_at}
+    await db.orders.insert_one(dict(order))
+    return order
+
+
+@pytest.fixture
+async def participants(db):
+    await db.users.insert_many([
+        {"id": "customer-1", "name": "Ольга", "role": "customer"},
+        {"id": "master-1", "name": "Анна", "role": "master"},
+    ])
+    await db.services.insert_one({"id": "service-1", "master_id": "master-1", "title": "Вязаный свитер"})
+
+
+async def test_chats_are_ordered_by_their_latest_message(db, client, auth_headers, participants):
+    now = datetime.now(timezone.utc)
+    older = await seed_order(db, now - timedelta(days=2))
+    newer = await seed_order(db, now - timedelta(days=1))
+    silent = await seed_order(db, now)
+    headers = auth_headers("customer-1")
+
+    for order in (newer, older):
+        response = client.post("/api/messages", json={"order_id": order["id"], "content": "Здравствуйте"}, headers=headers)
+        assert response.status_code == 201
+
+    chats = client.get("/api/messages/chats", headers=headers).json()["chats"]
+    assert [chat["order_id"] for chat in chats] == [older["id"], newer["id"], silent["id"]]
+    assert chats[0]["last_message"]["content"] == "Здравствуйте"
+    assert chats[0]["other_user"]["name"] == "Анна"
+    assert chats[2]["last_message"] is None
+
+    page = client.get("/api/messages/chats?skip=1&limit=1&total=none", headers=headers).json()
+    assert [chat["order_id"] for chat in page["chats"]] == [newer["id"]]
+    assert page["has_more"] is True
+
+
+def test_chats_limit_is_validated(client, auth_headers):
+    assert client.get("/api/messages/chats?limit=0", headers=auth_headers("customer-1")).status_code == 422
+
+
+async def test_backfill_stamps_orders_with_their_latest_message(db):
+    now = datetime.now(timezone.utc)
+    order = await seed_order(db, now - timedelta(days=1))
+    await db.messages.insert_many([
+        {"id": "m1", "order_id": order["id"], "created_at": now - timedelta(hours=2)},
+        {"id": "m2", "order_id": order["id"], "created_at": now - timedelta(hours=1)},
+    ])
+
+    assert await backfill_last_message_at(db) == 1
+    assert await backfill_last_message_at(db) == 0
+    stored = await db.orders.find_one({"id": order["id"]})
+    assert abs(stored["last_message_at"] - (now - timedelta(hours=1))) < timedelta(milliseconds=1)
@@ -0,0 +1,82 @@
+import pytest
+
+from models import NotificationCreate
+from utils.counters import get_counters
+from utils.indexes import ensure_indexes
+from utils.migrations import apply_data_migrations
+from utils.notifications import NotificationService, build_notification
+
+pytestmark = pytest.mark.anyio
+
+
+MESSAGE = NotificationCreate(user_id="user-1", type="new_message", title="Новое сообщение", content="Привет")
+
+
+def chat_notification():
+    return build_notification(MESSAGE, group_key="order:1:messages")
+
+
+async def test_replayed_grouped_write_is_counted_once(db):
+    await ensure_indexes(db, collections=["notifications"])
+    service = NotificationService()
+    first, second = chat_notification(), chat_notification()
+    second["count"] = 3
+
+    await service.write(db, [first])
+    await service.write(db, [second])
+    # The second write is replayed, as after a failure that it survived in part
+    await service.write(db, [second])
+
+    docs = await db.notifications.find({"user_id": "user-1"}).to_list(None)
+    assert len(docs) == 1
+    assert docs[0]["count"] == 4
+
+
+async def test_failed_flush_is_replayed_without_merging(db, monkeypatch):
+    await ensure_indexes(db, collections=["notifications"])
+    # Buffer instead of writing through, as in the running server
+    monkeypatch.setattr(NotificationService, "running", property(lambda self: True))
+    service = NotificationService()
+    await service.notify(db, MESSAGE, group_key="order:1:messages")
+
+    original = service.write
+
+    async def write_then_fail(db, notifications):
+        await original(db, notifications)
+        raise RuntimeError("connection lost after the write")
+
+    monkeypatch.setattr(service, "write", write_then_fail)
+    with pytest.raises(RuntimeError):
+        await service.flush(db)
+    monkeypatch.setattr(service, "write", original)
+
+    await service.notify(db, MESSAGE, group_key="order:1:messages")
+    await service.flush(db)
+
+    docs = await db.notifications.find({"user_id": "user-1"}).to_list(None)
+    assert len(docs) == 1
+    assert docs[0]["count"] == 2
+    assert service.get_stats()["pending"] == 0
+
+
+async def test_unread_count_never_goes_negative(db, client, auth_headers):
+    # Reads of notifications and messages counted before the counters existed
+    await db.counters.insert_one({
+        "user_id": "user-1", "notifications_total": 0, "notifications_unread": -2,
+        "messages_unread": -1, "chats_unread": {"order-1": -1, "order-2": 2}
+    })
+
+    counts = client.get("/api/notifications/unread-count", headers=auth_headers("user-1")).json()
+    assert counts == {"notifications": 0, "messages": 0, "chats": {"order-2": 2}}
+
+
+async def test_counters_are_rebuilt_once_at_startup(db):
+    await db.notifications.insert_one(dict(build_notification(MESSAGE)))
+    await db.messages.insert_one({"id": "m1", "order_id": "order-1", "receiver_id": "user-1", "is_read": False})
+
+    assert "counters" in await apply_data_migrations(db)
+    assert await apply_data_migrations(db) == []
+
+    counters = await get_counters(db, "user-1")
+    assert counters["notifications_unread"] == 1
+    assert counters["chats_unread"] == {"order-1": 1}
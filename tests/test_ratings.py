@@ -0,0 +1,74 @@
+import pytest
+
+import utils.ratings as ratings
+from utils.ratings import apply_review_rating, reconcile_ratings
+
+pytestmark = pytest.mark.anyio
+
+
+async def seed_review(db, review_id: str, rating: int) -> dict:
+    review = {"id": review_id, "order_id": f"order-{review_id}", "rating": rating,
+              "master_id": "master-1", "service_id": "service-1", "customer_id": "customer-1"}
+    await db.reviews.insert_one(dict(review))
+    return review
+
+
+@pytest.fixture
+async def targets(db):
+    await db.users.insert_one({"id": "master-1", "name": "Анна", "role": "master", "rating": 0.0, "total_reviews": 0})
+    await db.services.insert_one({"id": "service-1", "master_id": "master-1", "rating": 0.0, "total_reviews": 0})
+
+
+async def state(db, collection_name: str) -> tuple:
+    doc = await db[collection_name].find_one({}, {"_id": 0})
+    return doc["total_reviews"], doc["rating"]
+
+
+async def test_replayed_review_job_counts_the_review_once(db, targets):
+    await seed_review(db, "r1", 5)
+    review = await seed_review(db, "r2", 4)
+
+    master = await apply_review_rating(db, review)
+    await apply_review_rating(db, review)
+
+    assert master["rating"] == 4.5
+    assert await state(db, "services") == (2, 4.5)
+    assert await state(db, "users") == (2, 4.5)
+
+
+async def test_retry_after_the_master_write_failed(db, targets, monkeypatch):
+    review = await seed_review(db, "r1", 3)
+    original = ratings.refresh_rating
+
+    async def fail_on_users(db, collection_name, *args, **kwargs):
+        if collection_name == "users":
+            raise RuntimeError("users write failed")
+        return await original(db, collection_name, *args, **kwargs)
+
+    monkeypatch.setattr(ratings, "refresh_rating", fail_on_users)
+    with pytest.raises(RuntimeError):
+        await apply_review_rating(db, review)
+    monkeypatch.setattr(ratings, "refresh_rating", original)
+    await apply_review_rating(db, review)
+
+    assert await state(db, "services") == (1, 3.0)
+    assert await state(db, "users") == (1, 3.0)
+
+
+async def test_reconciliation_before_the_job_does_not_double_count(db, targets):
+    review = await seed_review(db, "r1", 5)
+
+    await reconcile_ratings(db, fix=True)
+    await apply_review_rating(db, review)
+
+    assert await state(db, "services") == (1, 5.0)
+    assert await state(db, "users") == (1, 5.0)
+
+
+async def test_stale_recompute_does_not_overwrite_a_newer_state(db, targets):
+    review = await seed_review(db, "r1", 5)
+    await db.services.update_one({}, {"$set": {"total_reviews": 2, "rating": 4.0}})
+
+    await apply_review_rating(db, review)
+
+    assert await state(db, "services") == (2, 4.0)
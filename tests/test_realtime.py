@@ -0,0 +1,107 @@
+import asyncio
+import time
+import uuid
+from datetime import datetime, timezone
+
+import anyio.from_thread
+import pytest
+from starlette.requests import Request
+
+from models import MessageCreate
+from routers.messages import send_message, mark_messages_as_read
+from routers.realtime import sse_events
+from utils import create_access_token
+from utils.realtime import event_bus, LocalBroker
+
+pytestmark = pytest.mark.anyio
+
+
+def token(user_id: str) -> str:
+    return create_access_token({"sub": user_id, "email": f"{user_id}@example.com", "role": "customer"})
+
+
+@pytest.fixture
+async def order(db):
+    await db.users.insert_many([
+        {"id": "customer-1", "name": "Ольга", "role": "customer"},
+        {"id": "master-1", "name": "Анна", "role": "master"},
+    ])
+    order = {"id": str(uuid.uuid4()), "customer_id": "customer-1", "master_id": "master-1",
+             "service_id": "service-1", "status": "pending", "created_at": datetime.now(timezone.utc)}
+    await db.orders.insert_one(dict(order))
+    return order
+
+
+@pytest.fixture
+def live_client(client):
+    # One event loop for the socket and the requests, as in a real worker,
+    # so events published by a request reach the socket's queue
+    with anyio.from_thread.start_blocking_portal("asyncio") as portal:
+        client.portal = portal
+        yield client
+        client.portal = None
+
+
+def test_events_run_on_the_local_broker():
+    assert isinstance(event_bus.broker, LocalBroker)
+
+
+async def test_websocket_receives_message_and_notification_events(order, live_client, auth_headers):
+    with live_client.websocket_connect(f"/api/realtime/ws?token={token('master-1')}") as ws:
+        response = live_client.post(
+            "/api/messages", json={"order_id": order["id"], "content": "Здравствуйте"}, headers=auth_headers("customer-1")
+        )
+        assert response.status_code == 201
+
+        message = ws.receive_json()
+        assert message["type"] == "message.new"
+        assert message["data"]["content"] == "Здравствуйте"
+        notification = ws.receive_json()
+        assert notification["type"] == "notification"
+        assert notification["data"]["link"] == f"/chat/{order['id']}"
+
+        response = live_client.patch(f"/api/messages/order/{order['id']}/read", headers=auth_headers("master-1"))
+        assert response.json() == {"marked_as_read": 1}
+        receipt = ws.receive_json()
+        assert receipt["type"] == "message.read"
+        assert receipt["data"]["reader_id"] == "master-1"
+
+    # The handler cleans up on the portal thread once it sees the close
+    for _ in range(100):
+        if event_bus.registry.get_stats()["connections"] == 0:
+            break
+        time.sleep(0.01)
+    assert event_bus.registry.get_stats()["connections"] == 0
+
+
+def sse_request() -> Request:
+    async def receive():
+        # Never disconnects; is_disconnected() gives up right away
+        await asyncio.Event().wait()
+
+    return Request({"type": "http", "method": "GET", "path": "/api/realtime/events", "headers": [], "query_string": b""}, receive)
+
+
+async def test_sse_streams_message_and_notification_events(db, order):
+    customer = {"id": "customer-1", "role": "customer"}
+    master = {"id": "master-1", "role": "master"}
+    response = await sse_events(sse_request(), token("master-1"))
+    stream = response.body_iterator
+    assert await stream.__anext__() == "retry: 3000\n\n"
+
+    await send_message(MessageCreate(order_id=order["id"], content="Здравствуйте"), current_user=customer, db=db)
+    assert (await stream.__anext__()).startswith("event: message.new\n")
+    assert (await stream.__anext__()).startswith("event: notification\n")
+
+    await mark_messages_as_read(order["id"], current_user=master, db=db)
+    event = await stream.__anext__()
+    assert event.startswith("event: message.read\n")
+    assert '"reader_id": "master-1"' in event
+
+    await stream.aclose()
+    assert event_bus.registry.get_stats()["connections"] == 0
+
+
+async def test_sse_subscribes_only_once_streamed(db):
+    await sse_events(sse_request(), token("master-1"))
+    assert event_bus.registry.get_stats()["connections"] == 0
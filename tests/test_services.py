@@ -0,0 +1,110 @@
+import uuid
+from datetime import datetime, timezone, timedelta
+
+import pytest
+
+from utils.cache import response_cache
+from utils.views import view_counter
+
+pytestmark = pytest.mark.anyio
+
+
+async def seed_service(db, **fields) -> dict:
+    now = datetime.now(timezone.utc)
+    service = {
+        "id": str(uuid.uuid4()), "master_id": "master-1", "title": "Вязаный свитер", "description": "Ручная работа",
+        "category": "knitting", "price": 1000.0, "images": [], "is_active": True, "views": 0, "orders_count": 0,
+        "created_at": now, "updated_at": now, **fields
+    }
+    await db.services.insert_one(dict(service))
+    return service
+
+
+async def test_view_count_survives_flush_of_cached_service(db, client):
+    await db.users.insert_one({"id": "master-1", "name": "Анна", "role": "master"})
+    service = await seed_service(db)
+
+    first = client.get(f"/api/services/{service['id']}")
+    assert first.json()["views"] == 1
+
+    await view_counter.flush(db)
+    assert (await db.services.find_one({"id": service["id"]}))["views"] == 1
+
+    second = client.get(f"/api/services/{service['id']}")
+    assert second.json()["views"] == 1
+    assert second.headers["etag"] == first.headers["etag"]
+
+
+async def test_service_etag_follows_the_embedded_master(db, client):
+    # A legacy service with no embedded master summary
+    await db.users.insert_one({"id": "master-1", "name": "Анна", "role": "master", "completed_orders": 3})
+    service = await seed_service(db)
+    url = f"/api/services/{service['id']}"
+
+    first = client.get(url)
+    assert first.json()["master"]["completed_orders"] == 3
+
+    await db.users.update_one({"id": "master-1"}, {"$inc": {"completed_orders": 1}})
+    response_cache.invalidate("user:master-1")
+    second = client.get(url, headers={"If-None-Match": first.headers["etag"]})
+    assert second.status_code == 200
+    assert second.json()["master"]["completed_orders"] == 4
+
+    # Revalidation without a cached copy agrees with the full response
+    response_cache.invalidate("user:master-1")
+    third = client.get(url, headers={"If-None-Match": second.headers["etag"]})
+    assert third.status_code == 304
+
+
+def test_metrics_are_admin_only(client, auth_headers):
+    assert client.get("/api/metrics").status_code in (401, 403)
+    assert client.get("/api/metrics", headers=auth_headers("user-1")).status_code == 403
+    response = client.get("/api/metrics", headers=auth_headers("admin-1", "admin"))
+    assert response.status_code == 200
+    assert "views" in response.json()
+
+
+async def test_catalog_ignores_a_stale_token(db, client):
+    await seed_service(db)
+    headers = {"Authorization": "Bearer expired.or.invalid"}
+
+    response = client.get("/api/services", headers=headers)
+
+    assert response.status_code == 200
+    assert response.json()["total"] == 1
+    # Regex search is the one case that needs the token, and still rejects it
+    assert client.get("/api/services", params={"search": "свитер", "search_mode": "regex"}, headers=headers).status_code == 401
+
+
+async def test_regex_search_is_admin_only(db, client, auth_headers):
+    await seed_service(db)
+    params = {"search": "свитер", "search_mode": "regex"}
+
+    assert client.get("/api/services", params=params).status_code == 403
+    assert client.get("/api/services", params=params, headers=auth_headers("user-1")).status_code == 403
+    response = client.get("/api/services", params=params, headers=auth_headers("admin-1", "admin"))
+    assert response.status_code == 200
+    assert response.json()["total"] == 1
+
+
+async def test_faceted_listing_reports_has_more_from_an_extra_row(db, client):
+    await db.users.insert_one({"id": "master-1", "name": "Анна", "role": "master"})
+    now = datetime.now(timezone.utc)
+    for minutes in range(3):
+        await seed_service(db, created_at=now - timedelta(minutes=minutes))
+
+    # A price range keeps the histogram on $bucket, which mongomock handles
+    url = "/api/services?facets=true&total=none&min_price=0&max_price=5000"
+    first = client.get(f"{url}&limit=2").json()
+    assert len(first["services"]) == 2
+    assert first["has_more"] is True
+
+    rest = client.get(f"{url}&limit=2&cursor={first['next_cursor']}").json()
+    assert len(rest["services"]) == 1
+    assert rest["has_more"] is False
+
+    # A full last page is not mistaken for a page with more behind it
+    full = client.get(f"{url}&limit=3").json()
+    assert len(full["services"]) == 3
+    assert full["has_more"] is False
+    assert full["next_cursor"] is None